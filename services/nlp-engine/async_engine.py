@@ -0,0 +1,675 @@
+"""
+async_engine.py
+
+asyncio execution mode for the nlp-engine consumer (CONSUMER_MODE=async).
+
+ - aio-pika consumer: one task per delivery, up to ASYNC_MAX_INFLIGHT
+   deliveries in flight in a single process
+ - SerpAPI over one shared httpx.AsyncClient, GPT over AsyncOpenAI, both
+   behind the same provider gateways (rate limit, backoff, breaker)
+ - Local blocking work (media blob cache, pHash, Vision gRPC batcher,
+   relevance classifier) runs on the shared stage pool
+ - stage1_process_message, format_final_api_output / format_alert_output
+   (via build_outputs) and the caches are reused from main_script
+
+Stage timings land in report["timestamps"]["stages"] exactly as with
+StageDAG, so outputs are identical across modes.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import deadlines
+from deadlines import Deadline
+from event_clusters import EVENT_WAIT_SECONDS
+import main_script as ms
+import metrics
+from phash_index import reverse_search_from_hit
+import prefork
+import priority_lanes
+from provider_gateway import ProviderGateway, ProviderRetryable, ProviderUnavailable, skipped_result
+import retry_queues
+from stage_dag import iso_now, shared_executor
+import wire_codec
+
+try:
+    import aio_pika
+    import httpx
+    from openai import AsyncOpenAI
+except Exception:
+    aio_pika = None
+
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "256"))
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "100"))
+
+
+# ------------------------------
+# Stage helpers
+# ------------------------------
+def _in_pool(fn: Callable, *args) -> Awaitable:
+    return asyncio.get_running_loop().run_in_executor(shared_executor(), fn, *args)
+
+
+async def _timed(name: str, timings: Dict[str, Any], coro: Awaitable, fallback: Any = None) -> Any:
+    """
+    Await one stage, recording timings like StageDAG._run_stage.
+    fallback is returned on error when given; otherwise the error is raised.
+    """
+    entry = {"started_at": iso_now()}
+    timings[name] = entry
+    t0 = time.perf_counter()
+    try:
+        result = await coro
+        if isinstance(result, dict) and result.get("skipped"):
+            entry["skipped"] = result["skipped"]
+        return result
+    except Exception as e:
+        entry["error"] = str(e)
+        if fallback is None:
+            raise
+        return fallback
+    finally:
+        elapsed = time.perf_counter() - t0
+        entry["completed_at"] = iso_now()
+        entry["duration_ms"] = round(elapsed * 1000, 3)
+        metrics.observe_stage(name, elapsed, "error" in entry)
+
+
+async def _timed_call(gw: ProviderGateway, fn: Callable[[], Awaitable]) -> Any:
+    t0 = time.monotonic()
+    result = await fn()
+    gw.record_latency(time.monotonic() - t0)
+    return result
+
+
+async def _hedged(gw: ProviderGateway, fn: Callable[[], Awaitable], delay: float) -> Any:
+    """
+    Async twin of ProviderGateway._hedged; here the losing request is
+    cancelled.
+    """
+    primary = asyncio.ensure_future(_timed_call(gw, fn))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not gw.admit_hedge():
+            return await primary
+
+        hedge = asyncio.ensure_future(_timed_call(gw, fn))
+        tasks.append(hedge)
+        pending = set(tasks)
+        failed: List[asyncio.Future] = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = gw.race_winner(done, hedge, failed)
+            if winner is not None:
+                return winner.result()
+        # Both failed: raise the first error
+        return failed[0].result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _gateway_call(
+    gw: ProviderGateway,
+    fn: Callable[[], Awaitable],
+    retry_on: tuple,
+    deadline: Optional[float] = None,
+    hedge: bool = False,
+) -> Any:
+    """
+    Async driver for ProviderGateway (the policy lives there, as for
+    call()); waits are asyncio.sleep, so a retrying report costs nothing
+    while it waits.
+    deadline: time.monotonic() value after which no retry is started.
+    hedge: fn is idempotent and may be sent twice (see ProviderGateway).
+    """
+    attempt = 0
+    while True:
+        wait = gw.admit()
+        attempt += 1
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+            hedge_after = gw.hedge_delay() if hedge else None
+            if hedge_after is not None:
+                result = await _hedged(gw, fn, hedge_after)
+            else:
+                result = await _timed_call(gw, fn)
+        except BaseException as e:
+            # Cancellation included: after_failure hands back a probe slot
+            delay = gw.after_failure(e, attempt, retry_on, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        gw.record_success()
+        return result
+
+
+# ------------------------------
+# Engine
+# ------------------------------
+class AsyncEngine:
+    def __init__(self, max_inflight: int = ASYNC_MAX_INFLIGHT):
+        self.max_inflight = max(1, max_inflight)
+        self.http: Optional["httpx.AsyncClient"] = None
+        self.openai: Optional["AsyncOpenAI"] = None
+
+    async def start(self) -> None:
+        self.http = httpx.AsyncClient(
+            timeout=ms.SERPAPI_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+        # Retries are owned by the provider gateway
+        self.openai = AsyncOpenAI(api_key=ms.OPENAI_API_KEY, max_retries=0)
+
+    async def close(self) -> None:
+        if self.http is not None:
+            await self.http.aclose()
+        if self.openai is not None:
+            await self.openai.close()
+
+    # ---- providers ----
+    async def serpapi(
+        self, image_url: Optional[str], content_hash: Optional[str], deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        if not ms.SERPAPI_KEY or not isinstance(image_url, str) or not image_url:
+            return {"performed": False, "reason": "missing_key_or_image"}
+
+        if ms.serp_cache is not None:
+            cached = ms.serp_cache.get(image_url, content_hash)
+            if cached is not None:
+                cached["cached"] = True
+                return cached
+
+        timeout = ms.SERPAPI_TIMEOUT
+        if deadline is not None:
+            timeout = deadline.call_timeout(ms.SERPAPI_TIMEOUT)
+            if timeout is None:
+                return deadline.skip("reverse_search", performed=False)
+
+        params = {
+            "engine": "google_reverse_image",
+            "image_url": image_url,
+            "api_key": ms.SERPAPI_KEY,
+        }
+
+        async def _call():
+            resp = await self.http.get(ms.SERPAPI_ENDPOINT, params=params, timeout=timeout)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                raise ProviderRetryable(f"HTTP {resp.status_code}")
+            resp.raise_for_status()
+            return resp.json()
+
+        try:
+            data = await _gateway_call(
+                ms.serpapi_gateway, _call, (httpx.TimeoutException, httpx.TransportError, ProviderRetryable),
+                deadline.cutoff() if deadline else None,
+                hedge=True,
+            )
+        except ProviderUnavailable as e:
+            return {"performed": False, **skipped_result(e)}
+        except httpx.TimeoutException:
+            return {"performed": False, "error": "timeout", "retryable": True}
+        except (httpx.TransportError, ProviderRetryable) as e:
+            return {"performed": False, "error": str(e), "retryable": True}
+        except Exception as e:
+            metrics.PROVIDER_ERRORS.inc(provider="serpapi", kind="error")
+            return {"performed": False, "error": str(e)}
+
+        result = ms.serpapi_result(data)
+        if ms.serp_cache is not None:
+            ms.serp_cache.put(image_url, result, content_hash)
+        return result
+
+    async def gpt_decision(
+        self,
+        text: str,
+        reverse_search: Dict[str, Any],
+        vision: Dict[str, Any],
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        if not ms.USE_GPT:
+            return {"alert": False, "confidence": 0.0, "reasons": ["gpt_disabled"]}
+
+        cached = ms.decision_cache.get(text, reverse_search, vision)
+        if cached is not None:
+            return cached
+
+        prompt = ms.decision_prompt(text, reverse_search, vision)
+        timeout = deadline.decision_timeout(ms.OPENAI_TIMEOUT) if deadline else ms.OPENAI_TIMEOUT
+        try:
+            resp = await _gateway_call(
+                ms.openai_gateway,
+                lambda: self.openai.chat.completions.create(
+                    model=ms.OPENAI_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=ms.OPENAI_MAX_TOKENS,
+                    temperature=0.0,
+                    timeout=timeout,
+                ),
+                ms.openai_retryable(),
+                deadline.cutoff(0) if deadline else None,
+                hedge=True,
+            )
+            decision = json.loads(resp.choices[0].message.content)
+        except ProviderUnavailable as e:
+            return ms.skipped_decision(e)
+        except ms.openai_retryable() as e:
+            return {"alert": False, "confidence": 0.0, "reasons": [f"gpt_error:{e}"], "retryable": True}
+        except Exception as e:
+            metrics.PROVIDER_ERRORS.inc(provider="openai", kind="error")
+            return {"alert": False, "confidence": 0.0, "reasons": [f"gpt_error:{e}"]}
+
+        ms.decision_cache.put(text, reverse_search, vision, decision)
+        return decision
+
+    # ---- stages ----
+    async def reverse_search(
+        self,
+        image_ref: Optional[str],
+        media: Dict[str, Any],
+        image_hash_out: Dict[str, Any],
+        external: bool = True,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Same policy as main_script.reverse_search_stage.
+        """
+        if ms.is_skippable_media(media):
+            return {"performed": False, "reason": "not_an_image", "media_kind": media["kind"]}
+
+        h = image_hash_out.get("hash")
+        hit = image_hash_out.get("hit")
+        if hit is not None:
+            await _in_pool(ms.phash_index.touch, int(hit["hash"], 16), image_hash_out.get("sighting"), image_ref)
+            return reverse_search_from_hit(hit)
+        if not external:
+            return {"performed": False, "skipped": "event_member"}
+
+        result = await self.serpapi(image_ref, image_hash_out.get("sha256"), deadline)
+        if h is not None and result.get("performed"):
+            await _in_pool(ms.phash_index.add, h, image_ref, result, image_hash_out.get("sighting"))
+        return result
+
+    async def vision(
+        self,
+        image_ref: Optional[str],
+        media: Dict[str, Any],
+        external: bool = True,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        if ms.is_skippable_media(media):
+            return {"vision_available": False, "best_guess": None, "skipped": "not_an_image"}
+        if not external:
+            return {"vision_available": False, "best_guess": None, "skipped": "event_member"}
+        if not image_ref:
+            return {}
+        return await _in_pool(ms.ReverseChecker().check_image_duplicate, image_ref, deadline)
+
+    async def member_decision(
+        self, membership: Dict[str, Any], deadline: Optional[Deadline] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Await the representative's decision (woken by the clusterer, no
+        pool thread parked on it); None if it never arrives or carries no
+        verdict.
+        """
+        clusterer = ms.event_clusterer
+        timeout = EVENT_WAIT_SECONDS
+        if deadline is not None:
+            timeout = deadline.call_timeout(EVENT_WAIT_SECONDS) or 0.0
+        loop = asyncio.get_running_loop()
+        resolved = loop.create_future()
+
+        def settle() -> None:
+            if not resolved.done():
+                resolved.set_result(None)
+
+        def wake() -> None:
+            try:
+                loop.call_soon_threadsafe(settle)
+            except RuntimeError:
+                pass  # loop already closed
+
+        clusterer.on_resolved(membership["cluster_id"], wake)
+        try:
+            await asyncio.wait_for(resolved, timeout)
+        except asyncio.TimeoutError:
+            pass
+        rep = clusterer.wait(membership["cluster_id"], 0)
+        return clusterer.propagate(rep, membership) if rep is not None else None
+
+    async def run_report(self, msg: Dict[str, Any], final: bool = True) -> Dict[str, Any]:
+        """
+        Async counterpart of run_full_pipeline; same report shape.
+        """
+        ms.install_metrics()
+        deadline = deadlines.for_message(msg)
+        report = ms.new_report(msg)
+        image_ref = ms.image_ref_of(msg)
+        membership = ms.event_membership(report["id"], msg)
+        is_member = membership is not None and membership["role"] == "member"
+        timings: Dict[str, Any] = {}
+        report["timestamps"]["stages"] = timings
+
+        async def text_branch():
+            stage1 = await _timed("stage1", timings, _in_pool(ms.stage1_process_message, msg))
+            relevance = None
+            if ms.relevance_classifier is not None:
+                relevance = await _timed(
+                    "relevance", timings, _in_pool(ms.relevance_stage, stage1["sanitized_text"]),
+                    fallback={"score": None, "decision": None},
+                )
+            return stage1, relevance
+
+        text = asyncio.ensure_future(text_branch())
+
+        async def local_negative() -> bool:
+            # The paid lookups wait for the local tier, as in run_full_pipeline
+            await asyncio.wait([text])
+            return not text.cancelled() and text.exception() is None and ms.is_local_negative(text.result()[1])
+
+        async def image_branch():
+            media = await _timed(
+                "media", timings, _in_pool(ms.media_stage, image_ref, deadline),
+                fallback={"url": image_ref, "kind": "unavailable", "mime": None,
+                          "size": 0, "sha256": None, "cached": False},
+            )
+
+            async def reverse():
+                image_hash = await _timed(
+                    "image_hash", timings, _in_pool(ms.image_hash_stage, media, ms.sighting_key(msg, image_ref)),
+                    fallback={"hash": None, "sha256": None, "hit": None},
+                )
+                if await local_negative():
+                    return {"performed": False, "skipped": ms.LOCAL_NEGATIVE}
+                return await _timed(
+                    "reverse_search", timings,
+                    self.reverse_search(
+                        image_ref, media, image_hash, external=not is_member, deadline=deadline
+                    ),
+                )
+
+            async def vision():
+                if not ms.is_skippable_media(media) and await local_negative():
+                    return {"vision_available": False, "best_guess": None, "skipped": ms.LOCAL_NEGATIVE}
+                return await _timed(
+                    "vision_web", timings,
+                    self.vision(image_ref, media, external=not is_member, deadline=deadline),
+                    fallback={"vision_available": False, "best_guess": None},
+                )
+
+            rs, vw = await asyncio.gather(reverse(), vision())
+            return media, rs, vw
+
+        try:
+            (media, reverse_search, vision_web), (stage1, relevance) = await asyncio.gather(
+                image_branch(), text
+            )
+        except Exception:
+            text.cancel()
+            ms.resolve_event(membership, None)
+            raise
+
+        decision = None
+        try:
+            if relevance and relevance.get("decision") is not None:
+                decision = relevance["decision"]
+            elif is_member:
+                decision = await self.member_decision(membership, deadline)
+                if decision is None:
+                    # Representative gave nothing usable: verify this report itself
+                    media_hash = {"hash": None, "sha256": media.get("sha256"), "hit": None}
+                    reverse_search, vision_web = await asyncio.gather(
+                        self.reverse_search(image_ref, media, media_hash, deadline=deadline),
+                        self.vision(image_ref, media, deadline=deadline),
+                    )
+                    decision = await _timed(
+                        "decision", timings,
+                        self.gpt_decision(stage1["sanitized_text"], reverse_search, vision_web, deadline),
+                    )
+            else:
+                decision = await _timed(
+                    "decision", timings,
+                    self.gpt_decision(stage1["sanitized_text"], reverse_search, vision_web, deadline),
+                )
+        finally:
+            # Members never wait out a representative that failed, nor
+            # inherit a decision whose evidence is about to be retried
+            ms.resolve_event(membership, decision, ms.evidence_retried(
+                {"reverse_search": reverse_search, "vision_web": vision_web}, final
+            ))
+
+        report["stage1_text"] = stage1
+        report["media"] = {k: v for k, v in media.items() if k != "fetched_at"}
+        report["reverse_search"] = reverse_search
+        report["vision_web"] = vision_web
+        report["missing_evidence"] = deadlines.missing_evidence(reverse_search, vision_web)
+        report["cluster"] = ms.cluster_fields(membership)
+        report["relevance"] = relevance
+        report["decision"] = decision
+        report["decision_tier"] = ms.decision_tier(decision, relevance)
+        report["timestamps"]["completed_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        if deadline is not None:
+            report["deadline"] = deadline.summary()
+        return report
+
+    async def process_messages(self, msgs: List[Dict[str, Any]], final_attempt: bool = True) -> tuple:
+        """
+        Same contract as main_script.process_messages: (outputs, failed).
+        A report whose pipeline raised is routed on its own, with stage
+        "pipeline", while the others are published; without retry queues
+        (or if every report raised) the error is raised for the whole
+        delivery, as in the threaded consumers.
+        """
+        if not msgs:
+            return None, []
+        results = await asyncio.gather(
+            *(self.run_report(m, final_attempt) for m in msgs), return_exceptions=True
+        )
+        errors = [(i, r) for i, r in enumerate(results) if isinstance(r, BaseException)]
+        for _, e in errors:
+            if not isinstance(e, Exception):
+                raise e
+        if errors and (not retry_queues.RETRY_QUEUES_ENABLED or len(errors) == len(msgs)):
+            raise errors[0][1]
+        crashed = {i: e for i, e in errors}
+        reports = [r for i, r in enumerate(results) if i not in crashed]
+        index = [i for i in range(len(msgs)) if i not in crashed]
+        ready, failed = ms.split_failed(reports, [final_attempt] * len(reports))
+        failed = [(index[j], stages, reason) for j, stages, reason in failed]
+        for i, e in crashed.items():
+            print(f"[ERROR] pipeline failed for report {i}: {e}")
+            failed.append((i, ["pipeline"], str(e)))
+        return (ms.build_outputs(ready) if ready else None), sorted(failed)
+
+
+# ------------------------------
+# AMQP consumer
+# ------------------------------
+class AsyncConsumer:
+    """
+    Deliveries are handled as independent tasks; the broker's prefetch
+    (= ASYNC_MAX_INFLIGHT) is the only bound on concurrency. Outputs are
+    published on a confirm-mode channel before the input is acked; failed
+    and malformed deliveries go to the retry tiers / dead-letter queue
+    exactly as in the threaded consumers (main_script.settle_delivery).
+
+    With priority lanes, ASYNC_MAX_INFLIGHT is split across the lane
+    consumers by lane weight, so a low-lane backlog can only ever hold
+    its own share of the in-flight slots.
+
+    On the prefork stop signal the lane consumers are cancelled and run()
+    returns once the delivery tasks already started have settled.
+    """
+
+    def __init__(self, engine: Optional[AsyncEngine] = None):
+        self.engine = engine or AsyncEngine()
+        self._inflight = 0
+        self._tasks = set()
+        self._exchanges: Dict[str, Any] = {}
+        self.channel = None
+
+    async def _publish(self, final_outputs: list, alert_outputs: list) -> None:
+        t0 = time.perf_counter()
+        ok = True
+        try:
+            for queue, payload in ((ms.FINAL_QUEUE, final_outputs), (ms.ALERT_QUEUE, alert_outputs)):
+                if not payload:
+                    continue
+                body, content_type = wire_codec.encode(payload, ms.OUTPUT_CODEC)
+                await self.channel.default_exchange.publish(
+                    aio_pika.Message(
+                        body,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                        content_type=content_type,
+                        timestamp=int(time.time()),
+                    ),
+                    routing_key=queue,
+                )
+        except Exception:
+            ok = False
+            raise
+        finally:
+            metrics.observe_stage("publish", time.perf_counter() - t0, error=not ok)
+            if ms.snapshot_sink is not None:
+                ms.snapshot_sink.submit(final_outputs, alert_outputs)
+
+    async def _forward(self, message, route: tuple, body: Optional[bytes] = None,
+                       content_type: Optional[str] = None) -> None:
+        """
+        Republish to a retry tier / the dead-letter queue (see
+        main_script.settle_delivery); raises if the broker refuses it.
+        """
+        exchange, routing_key, headers = route
+        target = self._exchanges[exchange] if exchange else self.channel.default_exchange
+        await target.publish(
+            aio_pika.Message(
+                message.body if body is None else body,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                content_type=message.content_type if body is None else content_type,
+                headers=headers,
+                timestamp=message.timestamp,
+            ),
+            routing_key=routing_key,
+        )
+
+    async def _handle(self, message, lane: str) -> None:
+        self._inflight += 1
+        metrics.MESSAGES_INFLIGHT.set(self._inflight)
+        received_at = time.time()
+        headers = dict(message.headers or {})
+        origin = dict(ms.INPUT_LANES).get(lane, ms.INPUT_QUEUE)
+        try:
+            if message.timestamp:
+                metrics.QUEUE_LAG.observe(max(0.0, time.time() - message.timestamp.timestamp()))
+            msgs = ms.decode_body(message.body, message.content_type)
+            try:
+                if msgs is None:
+                    await self._forward(message, retry_queues.route_dead(ms.INPUT_QUEUE, headers, ms.MALFORMED))
+                    await message.ack()
+                    return
+                try:
+                    outputs, failed = await self.engine.process_messages(
+                        msgs, retry_queues.is_final_attempt(headers)
+                    )
+                except Exception as e:
+                    print(f"[ERROR] pipeline failed: {e}")
+                    if not retry_queues.RETRY_QUEUES_ENABLED and not message.redelivered:
+                        await message.nack(requeue=True)
+                        return
+                    await self._forward(message, retry_queues.route_failure(
+                        ms.INPUT_QUEUE, origin, headers, ["pipeline"], str(e)
+                    ))
+                    await message.ack()
+                    return
+
+                if outputs is not None:
+                    await self._publish(*outputs)
+                codec = wire_codec.codec_for(message.content_type)
+                for i, stages, reason in failed:
+                    body, content_type = wire_codec.encode(msgs[i], codec)
+                    route = retry_queues.route_failure(ms.INPUT_QUEUE, origin, headers, stages, reason)
+                    await self._forward(message, route, body, content_type)
+            except Exception as e:
+                # Could not publish / park it anywhere: keep the input
+                print(f"[ERROR] could not settle delivery: {e}")
+                await message.nack(requeue=True)
+                return
+            await message.ack()
+            if len(failed) < len(msgs):
+                published_at = message.timestamp.timestamp() if message.timestamp else received_at
+                metrics.LANE_LATENCY.observe(max(0.0, time.time() - published_at), lane=lane)
+        finally:
+            self._inflight -= 1
+            metrics.MESSAGES_INFLIGHT.set(self._inflight)
+
+    async def _on_message(self, message, lane: str = priority_lanes.NORMAL) -> None:
+        # Spawn and return so the next delivery is dispatched immediately
+        task = asyncio.create_task(self._handle(message, lane))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self) -> None:
+        await self.engine.start()
+        connection = await aio_pika.connect_robust(host=ms.RABBIT_HOST)
+        try:
+            self.channel = await connection.channel(publisher_confirms=True)
+            await self.channel.declare_queue(ms.ALERT_QUEUE, durable=True)
+            await self.channel.declare_queue(ms.FINAL_QUEUE, durable=True)
+            await self.channel.declare_queue(retry_queues.dead_letter_queue(ms.INPUT_QUEUE), durable=True)
+            if retry_queues.RETRY_QUEUES_ENABLED:
+                for name, arguments in retry_queues.topology(ms.INPUT_QUEUE):
+                    exchange = await self.channel.declare_exchange(
+                        name, aio_pika.ExchangeType.FANOUT, durable=True
+                    )
+                    tier = await self.channel.declare_queue(name, durable=True, arguments=arguments)
+                    await tier.bind(exchange)
+                    self._exchanges[name] = exchange
+
+            weights = priority_lanes.LANE_WEIGHTS
+            total = sum(weights[lane] for lane, _ in ms.INPUT_LANES)
+            consumers = []
+            for lane, name in ms.INPUT_LANES:
+                # basic.qos applies to the consumers started after it
+                share = max(1, self.engine.max_inflight * weights[lane] // total)
+                await self.channel.set_qos(prefetch_count=share)
+                queue = await self.channel.declare_queue(name, durable=True)
+                tag = await queue.consume(functools.partial(self._on_message, lane=lane))
+                consumers.append((queue, tag))
+
+            ms.consumer_ready()
+            print(
+                f"[+] Listening on {', '.join(repr(q) for _, q in ms.INPUT_LANES)} "
+                f"(async: max_inflight={self.engine.max_inflight})"
+            )
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            prefork.on_stop(lambda: loop.call_soon_threadsafe(stop.set))
+            await stop.wait()
+
+            for queue, tag in consumers:
+                await queue.cancel(tag)
+            print(f"[+] Stopping: finishing {len(self._tasks)} in-flight deliveries")
+            while self._tasks:
+                await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        finally:
+            await connection.close()
+            await self.engine.close()
+
+
+def run_async_consumer() -> None:
+    if aio_pika is None:
+        print("aio-pika / httpx not installed")
+        raise SystemExit(1)
+    asyncio.run(AsyncConsumer().run())
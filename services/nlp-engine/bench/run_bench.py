@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+run_bench.py
+
+Offline throughput benchmark for run_full_pipeline.
+
+Replays a corpus shaped like input.json through the pipeline against
+local stub providers (see stub_providers.py) and reports:
+ - reports/sec
+ - end-to-end and per-stage p50 / p99 latency
+ - peak RSS
+ - provider request / error counts
+
+Modes:
+ - serial:     run_full_pipeline, one report after the other
+ - batch:      run_pipeline_batch over fixed chunks
+ - concurrent: the real ConcurrentConsumer, fed by an in-process broker
+               (stub_broker.py); one report per delivery
+ - microbatch: the real MicroBatchConsumer, same broker
+ - async:      AsyncEngine.process_messages per delivery, up to --workers
+               in flight (needs httpx and openai)
+For the consumer modes end-to-end latency runs from the broker handing a
+delivery over to its ack.
+
+Examples:
+    python bench/run_bench.py --reports 200 --mode serial
+    python bench/run_bench.py --reports 500 --mode concurrent --workers 32 \\
+        --serpapi-latency lognormal:400,0.6 --openai-latency lognormal:900,0.4
+    python bench/run_bench.py --mode microbatch --batch-size 16 --max-wait-ms 100 --json out.json
+"""
+
+import argparse
+import asyncio
+import atexit
+import copy
+import json
+import os
+from pathlib import Path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+HERE = Path(__file__).resolve().parent
+ENGINE_DIR = HERE.parent
+sys.path.insert(0, str(ENGINE_DIR))
+sys.path.insert(0, str(HERE))
+
+from stub_broker import StubConnection, StubPublisher  # noqa: E402
+from stub_providers import ProviderProfile, StubProviders, StubVisionClient, stub_vision_module  # noqa: E402
+
+MODES = ["serial", "batch", "concurrent", "microbatch", "async"]
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--corpus", default=str(ENGINE_DIR / "input.json"))
+    p.add_argument("--reports", type=int, default=100, help="reports to replay (corpus is cycled)")
+    p.add_argument("--mode", choices=MODES, default="serial")
+    p.add_argument("--workers", type=int, default=16,
+                   help="concurrent / microbatch: worker threads; async: in-flight deliveries")
+    p.add_argument("--prefetch", type=int, default=32, help="consumer modes: broker prefetch per lane")
+    p.add_argument("--batch-size", type=int, default=8,
+                   help="batch: reports per run_pipeline_batch; microbatch: reports per window")
+    p.add_argument("--max-wait-ms", type=int, default=250, help="microbatch: window timeout")
+    p.add_argument("--repeat-media", action="store_true",
+                   help="keep corpus media URLs (cache-friendly) instead of making them unique")
+    p.add_argument("--with-caches", action="store_true", help="leave SerpAPI / GPT decision caches on")
+    p.add_argument("--serpapi-latency", default="lognormal:300,0.5")
+    p.add_argument("--vision-latency", default="lognormal:150,0.4")
+    p.add_argument("--openai-latency", default="lognormal:700,0.4")
+    p.add_argument("--serpapi-errors", type=float, default=0.0)
+    p.add_argument("--vision-errors", type=float, default=0.0)
+    p.add_argument("--openai-errors", type=float, default=0.0)
+    p.add_argument("--allow-idle", action="store_true",
+                   help="do not fail when a provider received no requests (e.g. everything cached)")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json", dest="json_out", help="also write the summary to this file")
+    return p.parse_args(argv)
+
+
+# ------------------------------
+# Corpus
+# ------------------------------
+def build_corpus(path: str, n: int, repeat_media: bool) -> List[Dict[str, Any]]:
+    base = json.loads(Path(path).read_text(encoding="utf-8"))
+    if isinstance(base, dict):
+        base = [base]
+    base = [m for m in base if isinstance(m, dict)]
+    if not base:
+        raise SystemExit(f"No report objects in {path}")
+
+    out = []
+    for i in range(n):
+        msg = copy.deepcopy(base[i % len(base)])
+        msg["id"] = f"bench_{i:06d}"
+        if not repeat_media and msg.get("media"):
+            media = msg["media"] if isinstance(msg["media"], list) else [msg["media"]]
+            sep = "&" if "?" in media[0] else "?"
+            msg["media"] = [f"{media[0]}{sep}bench={i}"] + media[1:]
+        out.append(msg)
+    return out
+
+
+# ------------------------------
+# Stats
+# ------------------------------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def summarize(reports: List[Dict[str, Any]], e2e: List[float], elapsed: float, stubs: StubProviders, args) -> Dict[str, Any]:
+    stage_ms: Dict[str, List[float]] = {}
+    for r in reports:
+        for name, t in (r.get("timestamps", {}).get("stages") or {}).items():
+            if "duration_ms" in t:
+                stage_ms.setdefault(name, []).append(t["duration_ms"])
+
+    tiers: Dict[str, int] = {}
+    for r in reports:
+        tier = r.get("decision_tier", "gpt")
+        tiers[tier] = tiers.get(tier, 0) + 1
+
+    return {
+        "mode": args.mode,
+        "workers": args.workers if args.mode in ("concurrent", "microbatch", "async") else 1,
+        "batch_size": args.batch_size if args.mode in ("batch", "microbatch") else 1,
+        "reports": len(reports),
+        "elapsed_s": round(elapsed, 3),
+        "reports_per_sec": round(len(reports) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "end_to_end": {"p50": round(percentile(e2e, 0.5), 1), "p99": round(percentile(e2e, 0.99), 1)},
+            **{
+                name: {"p50": round(percentile(v, 0.5), 1), "p99": round(percentile(v, 0.99), 1)}
+                for name, v in stage_ms.items()
+            },
+        },
+        "decision_tiers": tiers,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "providers": stubs.counts(),
+    }
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(
+        f"\nmode={summary['mode']} workers={summary['workers']} batch={summary['batch_size']} "
+        f"reports={summary['reports']} elapsed={summary['elapsed_s']}s"
+    )
+    print(f"throughput: {summary['reports_per_sec']} reports/sec   peak RSS: {summary['peak_rss_mb']} MB")
+    print(f"\n{'stage':<18}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, lat in summary["latency_ms"].items():
+        print(f"{name:<18}{lat['p50']:>10}{lat['p99']:>10}")
+    print(f"\ndecision tiers: {summary['decision_tiers']}")
+    print(f"providers:      {summary['providers']}")
+
+
+# ------------------------------
+# Harness
+# ------------------------------
+def configure_env(stubs: StubProviders, args) -> None:
+    """
+    main_script reads its configuration at import time, so this must run
+    before it is imported.
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("SERPAPI_KEY", "bench")
+    os.environ["SERPAPI_ENDPOINT"] = f"{stubs.base_url}/search"
+    os.environ["OPENAI_BASE_URL"] = f"{stubs.base_url}/v1"
+    os.environ.setdefault("METRICS_PORT", "0")
+    # Would download the real corpus images
+    os.environ.setdefault("PHASH_ENABLED", "false")
+    os.environ.setdefault("MEDIA_PREFETCH_ENABLED", "false")
+    if not args.with_caches:
+        os.environ["SERPAPI_CACHE_ENABLED"] = "false"
+        os.environ["GPT_CACHE_MODE"] = "off"
+    # On-disk caches live in a scratch dir, never the caller's cwd
+    scratch = tempfile.mkdtemp(prefix="nlp-bench-")
+    atexit.register(shutil.rmtree, scratch, True)
+    os.environ.setdefault("SERPAPI_CACHE_PATH", os.path.join(scratch, "serpapi_cache.sqlite3"))
+    os.environ.setdefault("PHASH_INDEX_PATH", os.path.join(scratch, "phash_index.sqlite3"))
+    os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(scratch, "media_cache"))
+
+
+def install_vision_stub(stubs: StubProviders) -> None:
+    """
+    Swap only the Vision transport: ReverseChecker, the provider gateway
+    and the VisionBatcher all run as in production.
+    """
+    from vision_client import get_vision_batcher
+
+    get_vision_batcher().use_client(stub_vision_module, StubVisionClient(stubs.base_url))
+
+
+def check_providers(summary: Dict[str, Any], args) -> None:
+    """
+    A provider that saw no requests means a stage silently fell back
+    instead of calling it; the numbers would not measure the pipeline.
+    """
+    idle = [name for name, c in summary["providers"].items() if not c["requests"]]
+    if idle and not args.allow_idle:
+        raise SystemExit(
+            f"No requests reached: {', '.join(idle)}. A stage is failing before it calls the provider "
+            "(check the stage errors in a report); pass --allow-idle if this is expected."
+        )
+
+
+# ------------------------------
+# Drivers
+# ------------------------------
+def drive_consumer(ms, consumer, corpus: List[Dict[str, Any]]) -> List[float]:
+    """
+    Run a consumer exactly as its run() would, but on a StubConnection,
+    until every delivery is settled. Returns the per-delivery latencies.
+    """
+    import priority_lanes
+    import wire_codec
+
+    conn = StubConnection()
+    ch = conn.channel()
+    ms._declare_queues(ch)
+    consumer.conn, consumer.ch = conn, ch
+    ch.basic_qos(prefetch_count=consumer.prefetch)
+
+    lanes = dict(consumer.lanes)
+    for msg in corpus:
+        lane = priority_lanes.classify(msg) if ms.PRIORITY_LANES_ENABLED else priority_lanes.NORMAL
+        body, content_type = wire_codec.encode([msg], ms.OUTPUT_CODEC)
+        ch.publish(lanes.get(lane, ms.INPUT_QUEUE), body, content_type)
+
+    consumer._start_consuming()
+    try:
+        while ch.settled < len(corpus):
+            conn.process_data_events(time_limit=0.05)
+    finally:
+        consumer._pool.shutdown(wait=True)
+    if ch.nacked:
+        print(f"[WARN] {ch.nacked} deliveries were nacked (requeued and retried)")
+    return [t * 1000 for t in ch.latencies]
+
+
+def drive_async(corpus: List[Dict[str, Any]], inflight: int) -> List[float]:
+    import async_engine
+
+    if async_engine.aio_pika is None:
+        raise SystemExit("--mode async needs aio-pika, httpx and openai installed")
+
+    async def go() -> List[float]:
+        engine = async_engine.AsyncEngine(max_inflight=inflight)
+        await engine.start()
+        slots = asyncio.Semaphore(max(1, inflight))
+
+        async def one(msg):
+            async with slots:
+                t0 = time.perf_counter()
+                await engine.process_messages([msg])
+                return (time.perf_counter() - t0) * 1000
+
+        try:
+            return list(await asyncio.gather(*(one(m) for m in corpus)))
+        finally:
+            await engine.close()
+
+    return asyncio.run(go())
+
+
+def run(args) -> Dict[str, Any]:
+    import random
+    random.seed(args.seed)
+
+    stubs = StubProviders(
+        serpapi=ProviderProfile(args.serpapi_latency, args.serpapi_errors),
+        vision=ProviderProfile(args.vision_latency, args.vision_errors),
+        openai=ProviderProfile(args.openai_latency, args.openai_errors),
+    ).start()
+    configure_env(stubs, args)
+
+    import main_script as ms
+    install_vision_stub(stubs)
+
+    corpus = build_corpus(args.corpus, args.reports, args.repeat_media)
+    reports: List[Dict[str, Any]] = []
+    e2e: List[float] = []
+
+    # Every mode formats its outputs through build_outputs; keep the raw
+    # reports for the stage timings
+    build_outputs = ms.build_outputs
+
+    def recording_build_outputs(batch):
+        reports.extend(batch)
+        return build_outputs(batch)
+
+    ms.build_outputs = recording_build_outputs
+    publisher = StubPublisher()
+    ms._publisher = lambda: publisher
+
+    started = time.perf_counter()
+    if args.mode == "serial":
+        for msg in corpus:
+            t0 = time.perf_counter()
+            ms.build_outputs([ms.run_full_pipeline(msg)])
+            e2e.append((time.perf_counter() - t0) * 1000)
+    elif args.mode == "batch":
+        size = max(1, args.batch_size)
+        for i in range(0, len(corpus), size):
+            t0 = time.perf_counter()
+            chunk = corpus[i:i + size]
+            ms.build_outputs(ms.run_pipeline_batch(chunk))
+            e2e.extend([(time.perf_counter() - t0) * 1000] * len(chunk))
+    elif args.mode == "concurrent":
+        e2e = drive_consumer(ms, ms.ConcurrentConsumer(workers=args.workers, prefetch=args.prefetch), corpus)
+    elif args.mode == "microbatch":
+        consumer = ms.MicroBatchConsumer(
+            max_reports=args.batch_size, max_wait_ms=args.max_wait_ms,
+            workers=args.workers, prefetch=args.prefetch,
+        )
+        e2e = drive_consumer(ms, consumer, corpus)
+    else:
+        e2e = drive_async(corpus, args.workers)
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(reports, e2e, elapsed, stubs, args)
+    summary["published"] = publisher.published
+    summary["forwarded"] = len(publisher.forwarded)
+    stubs.stop()
+    return summary
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = run(args)
+    print_summary(summary)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    check_providers(summary, args)
+
+
+if __name__ == "__main__":
+    main()
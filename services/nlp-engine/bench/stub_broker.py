@@ -0,0 +1,183 @@
+"""
+stub_broker.py
+
+In-process stand-in for the pika connection, channel and output
+publisher, so the real consumer classes (ConcurrentConsumer,
+MicroBatchConsumer) can be benchmarked without a RabbitMQ server.
+
+ - StubConnection: the "connection thread" is whoever calls
+   process_data_events(); it runs add_callback_threadsafe callbacks and
+   call_later timers there, exactly as pika's BlockingConnection does
+ - StubChannel: per-queue FIFO, basic_consume / basic_cancel, per-consumer
+   prefetch, ack / nack (requeue puts the delivery back, redelivered)
+ - StubPublisher: accepts every publish / forward and counts them
+ - Each settled delivery records the time from hand-over to ack / nack
+"""
+
+from collections import deque
+import heapq
+import itertools
+import queue
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+class StubChannel:
+    def __init__(self, connection: "StubConnection"):
+        self.connection = connection
+        self.queues: Dict[str, Deque[tuple]] = {}
+        self.prefetch = 0
+        self._consumers: Dict[str, Tuple[str, Callable]] = {}
+        # delivery_tag -> (consumer_tag, queue, properties, body, handed_over_at)
+        self._unacked: Dict[int, tuple] = {}
+        self._tags = itertools.count(1)
+        self._consumer_ids = itertools.count(1)
+        self.acked = 0
+        self.nacked = 0
+        self.latencies: List[float] = []
+
+    # ---- declarations ----
+    def queue_declare(self, queue: str, **kwargs) -> None:
+        self.queues.setdefault(queue, deque())
+
+    def exchange_declare(self, *args, **kwargs) -> None:
+        pass
+
+    def queue_bind(self, *args, **kwargs) -> None:
+        pass
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs) -> None:
+        self.prefetch = prefetch_count
+
+    # ---- producer side ----
+    def publish(self, queue: str, body: bytes, content_type: Optional[str] = None,
+                headers: Optional[Dict[str, Any]] = None, redelivered: bool = False) -> None:
+        properties = SimpleNamespace(content_type=content_type, headers=headers or {}, timestamp=None)
+        self.queues.setdefault(queue, deque()).append((properties, body, redelivered))
+
+    # ---- consumer side ----
+    def basic_consume(self, queue: str, on_message_callback: Callable, **kwargs) -> str:
+        tag = f"ctag{next(self._consumer_ids)}"
+        self.queue_declare(queue)
+        self._consumers[tag] = (queue, on_message_callback)
+        return tag
+
+    def basic_cancel(self, consumer_tag: str) -> None:
+        self._consumers.pop(consumer_tag, None)
+
+    def _settle(self, delivery_tag: int) -> tuple:
+        entry = self._unacked.pop(delivery_tag)
+        self.latencies.append(time.perf_counter() - entry[4])
+        return entry
+
+    def basic_ack(self, delivery_tag: int, **kwargs) -> None:
+        self._settle(delivery_tag)
+        self.acked += 1
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True, **kwargs) -> None:
+        _, q, properties, body, _ = self._settle(delivery_tag)
+        self.nacked += 1
+        if requeue:
+            self.queues[q].appendleft((properties, body, True))
+
+    @property
+    def settled(self) -> int:
+        return self.acked + self.nacked
+
+    def deliver(self) -> int:
+        """
+        Hand queued messages to the registered consumers, up to prefetch
+        unacked deliveries per consumer. Returns how many were handed over.
+        """
+        handed = 0
+        for tag, (q, callback) in list(self._consumers.items()):
+            pending = self.queues.get(q)
+            while pending and tag in self._consumers:
+                unacked = sum(1 for e in self._unacked.values() if e[0] == tag)
+                if self.prefetch and unacked >= self.prefetch:
+                    break
+                properties, body, redelivered = pending.popleft()
+                delivery_tag = next(self._tags)
+                self._unacked[delivery_tag] = (tag, q, properties, body, time.perf_counter())
+                method = SimpleNamespace(delivery_tag=delivery_tag, redelivered=redelivered)
+                callback(self, method, properties, body)
+                handed += 1
+        return handed
+
+
+class StubConnection:
+    def __init__(self):
+        self.is_open = True
+        self._channel = StubChannel(self)
+        self._callbacks: "queue.Queue[Callable]" = queue.Queue()
+        self._timers: List[tuple] = []
+        self._cancelled = set()
+        self._seq = itertools.count()
+
+    def channel(self) -> StubChannel:
+        return self._channel
+
+    def add_callback_threadsafe(self, fn: Callable) -> None:
+        self._callbacks.put(fn)
+
+    def call_later(self, delay: float, fn: Callable) -> object:
+        handle = object()
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), handle, fn))
+        return handle
+
+    def remove_timeout(self, handle: object) -> None:
+        self._cancelled.add(handle)
+
+    def _run_due_timers(self) -> Optional[float]:
+        """
+        Run expired timers; returns the next due time, if any.
+        """
+        while self._timers:
+            due, _, handle, fn = self._timers[0]
+            if handle in self._cancelled:
+                heapq.heappop(self._timers)
+                self._cancelled.discard(handle)
+                continue
+            if due > time.monotonic():
+                return due
+            heapq.heappop(self._timers)
+            fn()
+        return None
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        deadline = time.monotonic() + time_limit
+        while True:
+            self._channel.deliver()
+            next_due = self._run_due_timers()
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            wait = deadline - now if next_due is None else max(0.0, min(deadline, next_due) - now)
+            try:
+                fn = self._callbacks.get(timeout=wait)
+            except queue.Empty:
+                continue
+            fn()
+
+
+class StubPublisher:
+    def __init__(self):
+        self.published = 0
+        self.forwarded: List[Tuple[str, str, Dict[str, Any]]] = []
+
+    def attach(self, connection: Any) -> "StubPublisher":
+        return self
+
+    def publish_batch(self, messages: Iterable[Tuple[str, Any]]) -> bool:
+        self.published += len(list(messages))
+        return True
+
+    def publish(self, queue: str, payload: Any) -> bool:
+        self.published += 1
+        return True
+
+    def forward(self, exchange: str, routing_key: str, body: bytes, content_type: Optional[str],
+                headers: Optional[Dict[str, Any]] = None, timestamp: Any = None) -> bool:
+        self.forwarded.append((exchange, routing_key, dict(headers or {})))
+        return True
@@ -0,0 +1,282 @@
+"""
+stub_providers.py
+
+Local stand-ins for SerpAPI, Google Vision web detection and the OpenAI
+chat completions API, for offline benchmarking of the pipeline.
+
+ - Configurable latency distribution per provider
+ - Configurable error rate (HTTP 500) per provider
+ - Responses shaped like the real APIs, as far as main_script reads them
+ - StubVisionClient replaces only the google.cloud.vision transport, so
+   the VisionBatcher and the provider gateway in front of it are
+   benchmarked too
+
+Latency specs:
+    fixed:MS             e.g. fixed:200
+    uniform:LO,HI        e.g. uniform:100,400
+    lognormal:MEDIAN,S   e.g. lognormal:300,0.5   (heavy right tail)
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class LatencyModel:
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+
+    def sample_seconds(self) -> float:
+        if self.kind == "fixed":
+            ms = self.args[0] if self.args else 0.0
+        elif self.kind == "uniform":
+            ms = random.uniform(self.args[0], self.args[1])
+        elif self.kind == "lognormal":
+            median, sigma = self.args[0], self.args[1]
+            ms = random.lognormvariate(math.log(max(median, 1e-6)), sigma)
+        else:
+            raise ValueError(f"Unknown latency spec: {self.spec}")
+        return max(0.0, ms) / 1000.0
+
+
+class ProviderProfile:
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def simulate(self) -> bool:
+        """
+        Sleep for a sampled latency; returns False if this call should fail.
+        """
+        time.sleep(self.latency.sample_seconds())
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+        return not failed
+
+
+# ------------------------------
+# Canned responses
+# ------------------------------
+_DOMAINS = ["twitter.com", "reddit.com", "t.me", "thehindu.com", "ndtv.com", "imd.gov.in"]
+_BATCH_ID_RE = re.compile(r"### id: (\S+)")
+
+
+def serpapi_response(image_url: str) -> Dict[str, Any]:
+    rng = random.Random(image_url)
+    n = rng.choice([0, 0, 0, 1, 3, 8])
+    return {
+        "search_metadata": {"status": "Success"},
+        "image_results": [
+            {
+                "link": f"https://{rng.choice(_DOMAINS)}/post/{rng.randint(1, 10**6)}",
+                "date": f"2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+            }
+            for _ in range(n)
+        ],
+    }
+
+
+def vision_response(image_url: str) -> Dict[str, Any]:
+    rng = random.Random(image_url)
+    return {"best_guess": rng.choice(["flood", "sea wave", "coast", "storm", None])}
+
+
+def vision_batch_response(image_uris: List[str]) -> Dict[str, Any]:
+    return {"responses": [vision_response(uri) for uri in image_uris]}
+
+
+def _decision(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "alert": rng.random() < 0.6,
+        "confidence": round(rng.uniform(0.3, 0.99), 2),
+        "reasons": ["stub_decision"],
+    }
+
+
+def openai_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    prompt = ""
+    for m in body.get("messages", []):
+        if isinstance(m.get("content"), str):
+            prompt += m["content"]
+
+    rng = random.Random(prompt)
+    ids = _BATCH_ID_RE.findall(prompt)
+    if ids:
+        content = json.dumps([dict(id=i, **_decision(rng)) for i in ids])
+    else:
+        content = json.dumps(_decision(rng))
+
+    return {
+        "id": f"chatcmpl-stub-{rng.randint(0, 10**9)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                  "total_tokens": (len(prompt) + len(content)) // 4},
+    }
+
+
+# ------------------------------
+# Server
+# ------------------------------
+class StubProviders:
+    """
+    One HTTP server hosting all three stubs:
+        GET  /search                 SerpAPI google_reverse_image
+        POST /vision/web_detection   {"image_uri": ...} or {"image_uris": [...]}
+        POST /v1/chat/completions    OpenAI chat completions
+    """
+
+    def __init__(
+        self,
+        serpapi: Optional[ProviderProfile] = None,
+        vision: Optional[ProviderProfile] = None,
+        openai: Optional[ProviderProfile] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.profiles = {
+            "serpapi": serpapi or ProviderProfile(),
+            "vision": vision or ProviderProfile(),
+            "openai": openai or ProviderProfile(),
+        }
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        profiles = self.profiles
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b"{}"
+                try:
+                    return json.loads(raw)
+                except Exception:
+                    return {}
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path != "/search":
+                    return self._send(404, {"error": "not found"})
+                if not profiles["serpapi"].simulate():
+                    return self._send(500, {"error": "stub failure"})
+                image_url = parse_qs(parsed.query).get("image_url", [""])[0]
+                self._send(200, serpapi_response(image_url))
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._read_json()
+                if path.endswith("/chat/completions"):
+                    if not profiles["openai"].simulate():
+                        return self._send(500, {"error": {"message": "stub failure"}})
+                    return self._send(200, openai_response(body))
+                if path == "/vision/web_detection":
+                    if not profiles["vision"].simulate():
+                        return self._send(500, {"error": "stub failure"})
+                    if "image_uris" in body:
+                        return self._send(200, vision_batch_response(body["image_uris"]))
+                    return self._send(200, vision_response(body.get("image_uri", "")))
+                self._send(404, {"error": "not found"})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubProviders":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-providers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"requests": p.requests, "errors": p.errors}
+            for name, p in self.profiles.items()
+        }
+
+
+# ------------------------------
+# google.cloud.vision transport
+# ------------------------------
+class _Feature(SimpleNamespace):
+    Type = SimpleNamespace(WEB_DETECTION="WEB_DETECTION")
+
+
+# Just the request types vision_client builds
+stub_vision_module = SimpleNamespace(
+    AnnotateImageRequest=SimpleNamespace,
+    Image=SimpleNamespace,
+    ImageSource=SimpleNamespace,
+    Feature=_Feature,
+)
+
+
+class StubVisionClient:
+    """
+    Drop-in for vision.ImageAnnotatorClient: batch_annotate_images becomes
+    one POST to the stub server carrying every image of the batch.
+    """
+
+    def __init__(self, base_url: str):
+        import requests
+
+        self.url = f"{base_url}/vision/web_detection"
+        self._session = requests.Session()
+
+    def batch_annotate_images(self, requests: List[Any], timeout: Optional[float] = None):
+        uris = [r.image.source.image_uri for r in requests]
+        resp = self._session.post(self.url, json={"image_uris": uris}, timeout=timeout)
+        resp.raise_for_status()
+        responses = []
+        for item in resp.json()["responses"]:
+            guess = item.get("best_guess")
+            labels = [SimpleNamespace(label=guess)] if guess else []
+            responses.append(SimpleNamespace(
+                error=SimpleNamespace(message=""),
+                web_detection=SimpleNamespace(best_guess_labels=labels),
+            ))
+        return SimpleNamespace(responses=responses)
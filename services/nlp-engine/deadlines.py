@@ -0,0 +1,153 @@
+"""
+deadlines.py
+
+Per-report time budgets.
+
+ - Every report gets a Deadline when the pipeline picks it up: a budget
+   per priority lane (the same priority_lanes.classify the publishers
+   use), optionally overridden per source platform
+ - The Deadline is passed to every stage. Optional external work
+   (media download, SerpAPI, Vision, waiting on an event representative)
+   is capped to the time left, and skipped with {"skipped": "deadline"}
+   once too little is left for it to be useful
+ - The GPT decision is never skipped: evidence stages keep
+   DEADLINE_DECISION_RESERVE_SECONDS back for it, and its timeout is
+   shortened rather than dropped
+ - missing_evidence() names the evidence a decision had to do without,
+   so the prompt and the published report can account for it
+
+Disabled (DEADLINES_ENABLED=false) every stage keeps its own fixed
+timeout, as before.
+"""
+
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from decision_cache import COMPLETE_STATUSES, evidence_status
+import metrics
+import priority_lanes
+
+DEADLINES_ENABLED = os.getenv("DEADLINES_ENABLED", "false").lower() == "true"
+# An evidence stage does not start an external call with less time left
+DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", "1.5"))
+# Kept back for the decision step by every evidence stage
+DEADLINE_DECISION_RESERVE_SECONDS = float(os.getenv("DEADLINE_DECISION_RESERVE_SECONDS", "5"))
+
+SKIPPED = "deadline"
+
+
+def parse_budgets(spec: str) -> Dict[str, float]:
+    """
+    "high:10,normal:30,low:60" -> {"high": 10.0, "normal": 30.0, "low": 60.0}
+    """
+    out = {}
+    for part in spec.split(","):
+        key, _, seconds = part.partition(":")
+        key = key.strip().lower()
+        if key and seconds.strip():
+            out[key] = float(seconds)
+    return out
+
+
+DEADLINE_LANE_SECONDS = parse_budgets(os.getenv("DEADLINE_LANE_SECONDS", "high:10,normal:30,low:60"))
+# Per-platform overrides, e.g. "reddit:90,user_report:20"
+DEADLINE_SOURCE_SECONDS = parse_budgets(os.getenv("DEADLINE_SOURCE_SECONDS", ""))
+
+
+class Deadline:
+    def __init__(self, budget: float, lane: str = priority_lanes.NORMAL):
+        self.budget = budget
+        self.lane = lane
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+        self.skipped: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def cutoff(self, reserve: float = DEADLINE_DECISION_RESERVE_SECONDS) -> float:
+        """
+        time.monotonic() value for ProviderGateway.call(deadline=...):
+        no retry is started after it.
+        """
+        return self.expires_at - reserve
+
+    def call_timeout(self, cap: float, reserve: float = DEADLINE_DECISION_RESERVE_SECONDS) -> Optional[float]:
+        """
+        Timeout for one optional external call: the stage's own timeout,
+        shortened to the time left minus reserve. None means skip it.
+        """
+        left = self.remaining() - reserve
+        if left < DEADLINE_MIN_CALL_SECONDS:
+            return None
+        return min(cap, left)
+
+    def decision_timeout(self, cap: float) -> float:
+        """
+        The decision always runs; with the budget spent it still gets
+        DEADLINE_MIN_CALL_SECONDS.
+        """
+        return min(cap, max(DEADLINE_MIN_CALL_SECONDS, self.remaining()))
+
+    def skip(self, stage: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Stage result for work skipped for lack of time.
+        """
+        self.skipped.append(stage)
+        DEADLINE_SKIPS.inc(stage=stage, lane=self.lane)
+        return dict(fields, skipped=SKIPPED)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        if elapsed > self.budget:
+            DEADLINE_EXCEEDED.inc(lane=self.lane)
+        return {
+            "lane": self.lane,
+            "budget_s": self.budget,
+            "elapsed_s": round(elapsed, 3),
+            "exceeded": elapsed > self.budget,
+            "skipped_stages": list(self.skipped),
+        }
+
+
+def for_message(msg: Dict[str, Any]) -> Optional[Deadline]:
+    """
+    The report's Deadline, or None when deadlines are disabled.
+    """
+    if not DEADLINES_ENABLED:
+        return None
+    lane = priority_lanes.classify(msg)
+    source = str(msg.get("platform") or "").strip().lower()
+    budget = DEADLINE_SOURCE_SECONDS.get(source, DEADLINE_LANE_SECONDS.get(lane, math.inf))
+    return Deadline(budget, lane)
+
+
+def missing_evidence(reverse_search: Optional[Dict[str, Any]], vision: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    ["reverse_search:deadline", "vision_web:circuit_open", ...] for every
+    piece of evidence that applied to the report but was not obtained
+    (classified as in decision_cache.evidence_status).
+    """
+    out = []
+    for name, result in (("reverse_search", reverse_search), ("vision_web", vision)):
+        status = evidence_status(result)
+        if status not in COMPLETE_STATUSES:
+            out.append(f"{name}:{status.split(':', 1)[-1]}")
+    return out
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+DEADLINE_SKIPS = metrics.REGISTRY.counter(
+    "nlp_deadline_skips_total",
+    "Optional stage work skipped because the report's deadline was near",
+    labels=("stage", "lane"),
+)
+DEADLINE_EXCEEDED = metrics.REGISTRY.counter(
+    "nlp_deadline_exceeded_total",
+    "Reports that finished after their deadline",
+    labels=("lane",),
+)
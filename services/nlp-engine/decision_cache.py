@@ -0,0 +1,243 @@
+"""
+decision_cache.py
+
+Memoization for GPT verification decisions.
+
+ - exact:   reuse a decision when the sanitized text and the evidence
+            summaries fingerprint identically
+ - similar: additionally reuse a recent decision whose text SimHash is
+            within the configured similarity of the new text, as long as
+            the evidence fingerprint matches exactly
+
+Near-verbatim forwards (IMD bulletins, reposted alerts) collapse onto a
+single OpenAI call.
+
+The evidence fingerprint includes whether each piece of evidence was
+obtained, so a decision made with full SerpAPI / Vision evidence is never
+reused for a report whose evidence was skipped or failed (or the other
+way round). Decisions made without complete evidence are not cached.
+"""
+
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+GPT_CACHE_MODE = os.getenv("GPT_CACHE_MODE", "exact").lower()  # off | exact | similar
+GPT_CACHE_SIM_THRESHOLD = float(os.getenv("GPT_CACHE_SIM_THRESHOLD", "0.92"))
+GPT_CACHE_TTL = int(os.getenv("GPT_CACHE_TTL", "3600"))
+GPT_CACHE_MAX_ENTRIES = int(os.getenv("GPT_CACHE_MAX_ENTRIES", "5000"))
+
+SIMHASH_BITS = 64
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Skip reasons that mean the evidence does not apply, not that it is missing
+_NOT_APPLICABLE = ("not_an_image", "event_member", "local_negative")
+# evidence_status values for evidence that is not missing
+COMPLETE_STATUSES = ("ok", "none", "not_applicable")
+
+
+# ------------------------------
+# Fingerprints
+# ------------------------------
+def _normalize_text(text: str) -> str:
+    return " ".join(_TOKEN_RE.findall((text or "").lower()))
+
+
+def evidence_status(result: Optional[Dict[str, Any]]) -> str:
+    """
+    "ok" | "none" | "not_applicable" | "skipped:<reason>" | "timeout" | "error"
+    """
+    if not result:
+        return "none"
+    reason = result.get("skipped")
+    if reason:
+        return "not_applicable" if reason in _NOT_APPLICABLE else f"skipped:{reason}"
+    if result.get("error"):
+        return "timeout" if result["error"] == "timeout" else "error"
+    return "ok"
+
+
+def evidence_complete(reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> bool:
+    """
+    False when some evidence was skipped (deadline, open breaker, ...) or
+    failed; such decisions are made around a gap and are not cached.
+    """
+    return all(
+        evidence_status(r) in COMPLETE_STATUSES for r in (reverse_search, vision)
+    )
+
+
+def evidence_summary(reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Only the parts of the evidence the decision actually depends on;
+    debug / timing fields would otherwise defeat the cache.
+    """
+    rs_status = evidence_status(reverse_search)
+    vision_status = evidence_status(vision)
+    reverse_search = reverse_search or {}
+    vision = vision or {}
+    return {
+        "rs_status": rs_status,
+        "vision_status": vision_status,
+        "rs_performed": bool(reverse_search.get("performed")),
+        "rs_matches": reverse_search.get("matches", 0),
+        "rs_domains": sorted(reverse_search.get("domains") or []),
+        "rs_first_seen": reverse_search.get("first_seen"),
+        "vision_best_guess": vision.get("best_guess"),
+    }
+
+
+def evidence_fingerprint(reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> str:
+    blob = json.dumps(evidence_summary(reverse_search, vision), sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def text_fingerprint(text: str) -> str:
+    return hashlib.sha256(_normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """
+    64-bit SimHash over word shingles.
+    """
+    tokens = _normalize_text(text).split()
+    if len(tokens) < shingle:
+        features = [" ".join(tokens)] if tokens else []
+    else:
+        features = [" ".join(tokens[i:i + shingle]) for i in range(len(tokens) - shingle + 1)]
+
+    weights = [0] * SIMHASH_BITS
+    for feat in features:
+        h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if weights[bit] > 0:
+            value |= 1 << bit
+    return value
+
+
+def simhash_similarity(a: int, b: int) -> float:
+    return 1.0 - bin(a ^ b).count("1") / SIMHASH_BITS
+
+
+# ------------------------------
+# Cache
+# ------------------------------
+class DecisionCache:
+    def __init__(
+        self,
+        mode: str = GPT_CACHE_MODE,
+        threshold: float = GPT_CACHE_SIM_THRESHOLD,
+        ttl: int = GPT_CACHE_TTL,
+        max_entries: int = GPT_CACHE_MAX_ENTRIES,
+    ):
+        self.mode = mode
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits_exact = 0
+        self.hits_similar = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (stored_at, simhash, evidence_fp, decision)
+        self._entries: "OrderedDict[str, Tuple[float, int, str, Dict[str, Any]]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("exact", "similar")
+
+    @staticmethod
+    def _key(text: str, ev_fp: str) -> str:
+        return f"{text_fingerprint(text)}:{ev_fp}"
+
+    def _fresh(self, key: str, now: float) -> bool:
+        """
+        Entries expire lazily: a stale one is dropped when it is looked at.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if now - entry[0] > self.ttl:
+            del self._entries[key]
+            return False
+        return True
+
+    def get(self, text: str, reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+
+        ev_fp = evidence_fingerprint(reverse_search, vision)
+        key = self._key(text, ev_fp)
+        sh = simhash(text) if self.mode == "similar" else 0
+        now = time.time()
+
+        with self._lock:
+            if self._fresh(key, now):
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                decision = copy.deepcopy(self._entries[key][3])
+                decision["cache"] = {"match": "exact", "similarity": 1.0}
+                return decision
+
+            if self.mode == "similar":
+                best, best_sim = None, 0.0
+                stale = []
+                for k, (stored_at, other_sh, other_ev, _) in self._entries.items():
+                    if now - stored_at > self.ttl:
+                        stale.append(k)
+                        continue
+                    if other_ev != ev_fp:
+                        continue
+                    sim = simhash_similarity(sh, other_sh)
+                    if sim >= self.threshold and sim > best_sim:
+                        best, best_sim = k, sim
+                for k in stale:
+                    del self._entries[k]
+                if best is not None:
+                    self._entries.move_to_end(best)
+                    self.hits_similar += 1
+                    decision = copy.deepcopy(self._entries[best][3])
+                    decision["cache"] = {"match": "similar", "similarity": round(best_sim, 4)}
+                    return decision
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, reverse_search: Dict[str, Any], vision: Dict[str, Any], decision: Dict[str, Any]) -> None:
+        if not self.enabled or not evidence_complete(reverse_search, vision):
+            return
+
+        ev_fp = evidence_fingerprint(reverse_search, vision)
+        key = self._key(text, ev_fp)
+        sh = simhash(text) if self.mode == "similar" else 0
+
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now, sh, ev_fp, copy.deepcopy(decision))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            # Least recently used first: drop the stale ones found there
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if now - self._entries[oldest][0] <= self.ttl:
+                    break
+                del self._entries[oldest]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "entries": len(self._entries),
+                "hits_exact": self.hits_exact,
+                "hits_similar": self.hits_similar,
+                "misses": self.misses,
+            }
@@ -0,0 +1,300 @@
+"""
+event_clusters.py
+
+Pre-verification grouping of reports that describe the same event.
+
+ - Reports are bucketed by geohash cell (EVENT_GEOHASH_PRECISION) and a
+   time window (EVENT_WINDOW_MINUTES); the 8 neighbouring cells and the
+   adjacent windows are searched too, so an event on a cell edge is not
+   split
+ - Within a bucket, a report joins a cluster when its text SimHash is
+   within EVENT_SIM_THRESHOLD of the representative (and the hazard type,
+   when both carry one, agrees)
+ - The first report of a cluster is its representative and gets full
+   verification; members wait (bounded) for its decision and inherit it
+   with a confidence discounted by their similarity
+
+State is in-process and expires after two windows; reports without
+coordinates are never clustered.
+"""
+
+from datetime import datetime, timezone
+import itertools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from decision_cache import simhash, simhash_similarity
+
+EVENT_CLUSTERING_ENABLED = os.getenv("EVENT_CLUSTERING_ENABLED", "false").lower() == "true"
+EVENT_GEOHASH_PRECISION = int(os.getenv("EVENT_GEOHASH_PRECISION", "5"))  # ~4.9 km cells
+EVENT_WINDOW_MINUTES = float(os.getenv("EVENT_WINDOW_MINUTES", "30"))
+EVENT_SIM_THRESHOLD = float(os.getenv("EVENT_SIM_THRESHOLD", "0.75"))
+EVENT_MEMBER_DISCOUNT = float(os.getenv("EVENT_MEMBER_DISCOUNT", "0.95"))
+EVENT_WAIT_SECONDS = float(os.getenv("EVENT_WAIT_SECONDS", "30"))
+
+
+# ------------------------------
+# Geohash
+# ------------------------------
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lon: float, precision: int = EVENT_GEOHASH_PRECISION) -> str:
+    lat_rng = [-90.0, 90.0]
+    lon_rng = [-180.0, 180.0]
+    out = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(out) < precision:
+        rng, val = (lon_rng, lon) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits = 0
+            ch = 0
+    return "".join(out)
+
+
+def _cell_size(precision: int) -> Tuple[float, float]:
+    """
+    (lat_degrees, lon_degrees) covered by one cell.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def geohash_neighbourhood(lat: float, lon: float, precision: int = EVENT_GEOHASH_PRECISION) -> List[str]:
+    """
+    The cell containing the point (first) plus its 8 neighbours.
+    """
+    dlat, dlon = _cell_size(precision)
+    cells = [geohash_encode(lat, lon, precision)]
+    for i, j in itertools.product((-1, 0, 1), repeat=2):
+        la = min(89.999999, max(-89.999999, lat + i * dlat))
+        lo = (lon + j * dlon + 180.0) % 360.0 - 180.0
+        cell = geohash_encode(la, lo, precision)
+        if cell not in cells:
+            cells.append(cell)
+    return cells
+
+
+# ------------------------------
+# Clusters
+# ------------------------------
+def _parse_time(value: Any) -> Optional[float]:
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _coords(msg: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    loc = msg.get("location") or {}
+    try:
+        return float(loc["lat"]), float(loc["lon"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class EventCluster:
+    def __init__(self, cluster_id: str, representative_id: str, cell: str, event_time: float,
+                 text_hash: int, hazard_type: Optional[str]):
+        self.cluster_id = cluster_id
+        self.representative_id = representative_id
+        self.cell = cell
+        self.event_time = event_time
+        self.text_hash = text_hash
+        self.hazard_type = hazard_type
+        self.members = 1
+        self.decision: Optional[Dict[str, Any]] = None
+        self.resolved = threading.Event()
+        self.waiters: List[Callable[[], None]] = []
+        self.last_seen = time.time()
+
+
+class EventClusterer:
+    def __init__(
+        self,
+        precision: int = EVENT_GEOHASH_PRECISION,
+        window_minutes: float = EVENT_WINDOW_MINUTES,
+        threshold: float = EVENT_SIM_THRESHOLD,
+        discount: float = EVENT_MEMBER_DISCOUNT,
+    ):
+        self.precision = precision
+        self.window = window_minutes * 60.0
+        self.threshold = threshold
+        self.discount = discount
+        self.representatives = 0
+        self.members = 0
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # (cell, window index) -> clusters started there
+        self._buckets: Dict[Tuple[str, int], List[EventCluster]] = {}
+        self._clusters: Dict[str, EventCluster] = {}
+        # representative report id -> its cluster
+        self._by_representative: Dict[str, EventCluster] = {}
+
+    def _expire(self, now: float) -> None:
+        horizon = now - 2 * self.window
+        for key in [k for k, cs in self._buckets.items() if all(c.last_seen < horizon for c in cs)]:
+            for c in self._buckets.pop(key):
+                self._clusters.pop(c.cluster_id, None)
+                self._by_representative.pop(c.representative_id, None)
+
+    def assign(self, report_id: str, msg: Dict[str, Any], text: str) -> Optional[Dict[str, Any]]:
+        """
+        Place a report in an event cluster.
+        Returns {"cluster_id", "role": representative|member,
+        "representative_id", "similarity"} or None if it cannot be clustered.
+        """
+        coords = _coords(msg)
+        if coords is None:
+            return None
+
+        now = time.time()
+        event_time = _parse_time(msg.get("created_at")) or now
+        window = int(event_time // self.window)
+        text_hash = simhash(text)
+        hazard = ((msg.get("extra") or {}).get("hazard_type") or "").lower() or None
+        cells = geohash_neighbourhood(coords[0], coords[1], self.precision)
+
+        with self._lock:
+            self._expire(now)
+
+            own = self._by_representative.get(str(report_id))
+            if own is not None:
+                # The representative again (retry tier, redelivery): it
+                # verifies itself, never joins its own cluster
+                own.last_seen = now
+                if own.resolved.is_set() and own.decision is None:
+                    # Let later members wait for this attempt's decision
+                    own.resolved = threading.Event()
+                return {
+                    "cluster_id": own.cluster_id,
+                    "role": "representative",
+                    "representative_id": own.representative_id,
+                    "similarity": 1.0,
+                }
+
+            best, best_sim = None, 0.0
+            for cell in cells:
+                for w in (window - 1, window, window + 1):
+                    for c in self._buckets.get((cell, w), ()):
+                        if abs(c.event_time - event_time) > self.window:
+                            continue
+                        if hazard and c.hazard_type and hazard != c.hazard_type:
+                            continue
+                        sim = simhash_similarity(text_hash, c.text_hash)
+                        if sim >= self.threshold and sim > best_sim:
+                            best, best_sim = c, sim
+
+            if best is not None:
+                best.members += 1
+                best.last_seen = now
+                self.members += 1
+                return {
+                    "cluster_id": best.cluster_id,
+                    "role": "member",
+                    "representative_id": best.representative_id,
+                    "similarity": round(best_sim, 4),
+                }
+
+            cluster = EventCluster(
+                f"evc_{cells[0]}_{window}_{next(self._ids)}",
+                str(report_id), cells[0], event_time, text_hash, hazard,
+            )
+            self._buckets.setdefault((cells[0], window), []).append(cluster)
+            self._clusters[cluster.cluster_id] = cluster
+            self._by_representative[cluster.representative_id] = cluster
+            self.representatives += 1
+            return {
+                "cluster_id": cluster.cluster_id,
+                "role": "representative",
+                "representative_id": cluster.representative_id,
+                "similarity": 1.0,
+            }
+
+    def resolve(self, cluster_id: str, decision: Optional[Dict[str, Any]]) -> None:
+        """
+        Record the representative's decision (None = verification failed,
+        members must verify themselves) and wake waiting members.
+        """
+        with self._lock:
+            cluster = self._clusters.get(cluster_id)
+            if cluster is None or cluster.resolved.is_set():
+                return
+            cluster.decision = decision
+            cluster.resolved.set()
+            waiters, cluster.waiters = cluster.waiters, []
+        for fn in waiters:
+            try:
+                fn()
+            except Exception:
+                pass
+
+    def wait(self, cluster_id: str, timeout: float = EVENT_WAIT_SECONDS) -> Optional[Dict[str, Any]]:
+        cluster = self._clusters.get(cluster_id)
+        if cluster is None or not cluster.resolved.wait(timeout):
+            return None
+        return cluster.decision
+
+    def on_resolved(self, cluster_id: str, fn: Callable[[], None]) -> None:
+        """
+        Call fn() once the cluster is resolved (from the resolving thread),
+        or right away if it already is or has expired. Lets asyncio callers
+        wait without parking a thread or polling.
+        """
+        with self._lock:
+            cluster = self._clusters.get(cluster_id)
+            if cluster is not None and not cluster.resolved.is_set():
+                cluster.waiters.append(fn)
+                return
+        fn()
+
+    def size(self, cluster_id: str) -> int:
+        cluster = self._clusters.get(cluster_id)
+        return cluster.members if cluster is not None else 1
+
+    def propagate(self, decision: Dict[str, Any], membership: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Member decision derived from the representative's.
+        """
+        confidence = float(decision.get("confidence", 0.0)) * self.discount * membership["similarity"]
+        return {
+            "alert": bool(decision.get("alert")),
+            "confidence": round(confidence, 4),
+            "reasons": list(decision.get("reasons") or []) + [
+                f"propagated_from:{membership['representative_id']}"
+            ],
+            "propagated": {
+                "cluster_id": membership["cluster_id"],
+                "representative_id": membership["representative_id"],
+                "similarity": membership["similarity"],
+                "representative_confidence": decision.get("confidence"),
+            },
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clusters": len(self._clusters),
+            "representatives": self.representatives,
+            "members": self.members,
+        }
@@ -1,30 +1,64 @@
 #!/usr/bin/env python3
+"""
+main_script.py
+
+nlp-engine entry point: consumes reports from RabbitMQ, verifies each
+one and publishes the processed report and any alert.
+
+ - Per-report pipeline (run_full_pipeline): text normalization, local
+   relevance classifier, media prefetch + pHash, SerpAPI reverse image
+   search, Google Vision web detection, then a local or GPT decision
+ - run_pipeline_batch decides many reports per GPT call
+ - Consumer modes: serial, concurrent, microbatch, async (async_engine.py),
+   optionally in pre-forked workers (prefork.py)
+ - Provider keys come from the environment / .env and are checked by
+   warm_up(); importing this module opens no client, file or socket
+ - Importing declares the metric families owned by each module (counters
+   and histograms, in memory only); the stage-latency observer and the
+   process-state gauges are wired up by install_metrics() on warm-up or
+   the first pipeline run
+"""
+import startup
+import os
 from dotenv import load_dotenv
 load_dotenv()
 
-"""
-combined_pipeline_functions.py
-
-FIXED VERSION:
- - Reads image from `media` field (list or string)
- - Hard-coded OpenAI + SerpAPI keys
- - Robust image normalization
- - Debug logging for image handling
- - ChatGPT-assisted decision (bounded)
- - RabbitMQ consumer unchanged
-"""
+# Time every import below (and the lazy ones made during warm-up)
+STARTUP_REPORT_ENABLED = os.getenv("STARTUP_REPORT_ENABLED", "false").lower() == "true"
+if STARTUP_REPORT_ENABLED:
+    startup.track_imports()
 
+from concurrent.futures import ThreadPoolExecutor, wait
+import functools
 from pathlib import Path
 import json
-import os
 import sys
 import tempfile
+import threading
 import time
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import requests
-from openai import OpenAI
+
+from deadlines import Deadline, for_message as deadline_for, missing_evidence
+from decision_cache import DecisionCache
+from event_clusters import EVENT_CLUSTERING_ENABLED, EVENT_WAIT_SECONDS, EventClusterer
+from media_fetch import MEDIA_PREFETCH_ENABLED, MediaFetcher
+import metrics
+import wire_codec
+from provider_gateway import ProviderRetryable, ProviderUnavailable, get_gateway, share_quota, skipped_result
+from phash_index import PHASH_ENABLED, PHashIndex, image_hash, reverse_search_from_hit
+import prefork
+import priority_lanes
+from priority_lanes import LaneScheduler
+import retry_queues
+from retry_queues import RETRY_QUEUES_ENABLED
+from rabbit_publisher import get_publisher
+from relevance_classifier import RELEVANCE_ENABLED, RelevanceClassifier
+from serp_cache import SerpCache
+from stage_dag import StageDAG, add_stage_observer, iso_now
+from vision_client import VISION_TIMEOUT, get_vision_batcher
 
 # ------------------------------
 # Optional: pika import
@@ -40,33 +74,171 @@ except Exception:
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 
-if not OPENAI_API_KEY:
-    raise RuntimeError("Missing OPENAI_API_KEY")
-if not SERPAPI_KEY:
-    raise RuntimeError("Missing SERPAPI_KEY")
+
+def require_keys() -> None:
+    """
+    Checked by warm_up() before consuming, not at import, so tools and
+    workers that never call a provider can import this module.
+    """
+    if not OPENAI_API_KEY:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    if not SERPAPI_KEY:
+        raise RuntimeError("Missing SERPAPI_KEY")
 
 
 # ------------------------------
 # Config
 # ------------------------------
 RABBIT_HOST = os.getenv("RABBIT_HOST")
-INPUT_QUEUE = "reports"
+INPUT_QUEUE = priority_lanes.REPORTS_QUEUE
 ALERT_QUEUE = "alerts"
 FINAL_QUEUE = "processed_cluster"
+# Codec for published outputs; the alerts / processed_cluster consumers
+# are Node services, so keep "json" unless they learn msgpack
+OUTPUT_CODEC = os.getenv("OUTPUT_CODEC", "json").lower()
 
 ALERT_FILENAME = "true_alert.json"
 FINAL_FILENAME = "true_final_output.json"
-
-SERPAPI_ENDPOINT = "https://serpapi.com/search"
+# Debug-only: also snapshot each batch's outputs to the files above
+OUTPUT_SNAPSHOTS = os.getenv("OUTPUT_SNAPSHOTS", "false").lower() == "true"
+
+# serial: one message at a time inside the pika callback (prefetch=1)
+# concurrent: bounded worker pool, acks marshalled back to the connection thread
+# microbatch: concurrent + deliveries grouped into size/time windows
+# async: asyncio engine (aio-pika, httpx, AsyncOpenAI), see async_engine.py
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "serial").lower()
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "16"))
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "32"))
+MICROBATCH_MAX_REPORTS = int(os.getenv("MICROBATCH_MAX_REPORTS", "16"))
+MICROBATCH_MAX_WAIT_MS = int(os.getenv("MICROBATCH_MAX_WAIT_MS", "250"))
+# Consume reports.high / reports / reports.low by weighted priority
+# (see priority_lanes.py); publishers must route to the lanes too
+PRIORITY_LANES_ENABLED = os.getenv("PRIORITY_LANES_ENABLED", "false").lower() == "true"
+INPUT_LANES = (
+    priority_lanes.lane_queues(INPUT_QUEUE)
+    if PRIORITY_LANES_ENABLED
+    else [(priority_lanes.NORMAL, INPUT_QUEUE)]
+)
+
+SERPAPI_ENDPOINT = os.getenv("SERPAPI_ENDPOINT", "https://serpapi.com/search")
 SERPAPI_TIMEOUT = 15
-SERPAPI_MAX_RETRIES = 2
+SERPAPI_CACHE_ENABLED = os.getenv("SERPAPI_CACHE_ENABLED", "true").lower() == "true"
 
 OPENAI_MODEL = "gpt-4.1-mini"
 OPENAI_MAX_TOKENS = 300
 OPENAI_TIMEOUT = 20
+GPT_BATCH_SIZE = int(os.getenv("GPT_BATCH_SIZE", "8"))
+BATCH_ENRICH_WORKERS = int(os.getenv("BATCH_ENRICH_WORKERS", "16"))
 USE_GPT = True
+DEBUG = os.getenv("NLP_DEBUG", "false").lower() == "true"
+
+# Initialise providers / load models before taking the first message
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Start consuming after this long even if warm-up is still running; the
+# first report that needs an unfinished piece waits for it instead
+WARMUP_MAX_WAIT_SECONDS = float(os.getenv("WARMUP_MAX_WAIT_SECONDS", "30"))
+
+serp_cache = SerpCache() if SERPAPI_CACHE_ENABLED else None
+decision_cache = DecisionCache()
+relevance_classifier = RelevanceClassifier() if RELEVANCE_ENABLED else None
+phash_index = PHashIndex() if PHASH_ENABLED else None
+media_fetcher = MediaFetcher() if MEDIA_PREFETCH_ENABLED else None
+event_clusterer = EventClusterer() if EVENT_CLUSTERING_ENABLED else None
+serpapi_gateway = get_gateway("serpapi")
+openai_gateway = get_gateway("openai")
+vision_gateway = get_gateway("vision")
+if RETRY_QUEUES_ENABLED:
+    # Transient failures go to the delayed-retry tiers instead of
+    # backoff sleeps on the consumer's thread
+    for _gw in (serpapi_gateway, openai_gateway, vision_gateway):
+        _gw.max_retries = min(_gw.max_retries, retry_queues.RETRY_INLINE_MAX_RETRIES)
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# ------------------------------
+# Lazy provider clients
+# ------------------------------
+# The openai package alone takes ~0.4 s to import; it is loaded on first
+# use or by warm_up(), never at import
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+
+                # Retries are owned by the provider gateway
+                _openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _openai_client
+
+
+@functools.lru_cache(maxsize=None)
+def openai_retryable() -> Tuple[type, ...]:
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    return (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)
+
+# ------------------------------
+# Metrics wiring
+# ------------------------------
+def _cache_requests() -> Dict[tuple, float]:
+    out = {}
+    if serp_cache is not None:
+        out[("serpapi", "hit")] = serp_cache.hits
+        out[("serpapi", "miss")] = serp_cache.misses
+    if phash_index is not None:
+        out[("phash", "hit")] = phash_index.hits
+        out[("phash", "miss")] = phash_index.misses
+    if media_fetcher is not None:
+        out[("media", "hit")] = media_fetcher.hits
+        out[("media", "miss")] = media_fetcher.misses
+    dc = decision_cache.stats()
+    out[("gpt_decision", "hit_exact")] = dc["hits_exact"]
+    out[("gpt_decision", "hit_similar")] = dc["hits_similar"]
+    out[("gpt_decision", "miss")] = dc["misses"]
+    return out
+
+
+def _cache_hit_ratio() -> Dict[tuple, float]:
+    out = {}
+    req = _cache_requests()
+    for cache in ("serpapi", "phash", "media", "gpt_decision"):
+        hits = sum(v for (c, r), v in req.items() if c == cache and r.startswith("hit"))
+        total = sum(v for (c, _), v in req.items() if c == cache)
+        if total:
+            out[(cache,)] = hits / total
+    return out
+
+
+_metrics_installed = False
+
+
+def install_metrics() -> None:
+    """
+    Stage-latency observer and the process-local callback gauges; done
+    once per process by warm_up() or the first run_full_pipeline.
+    """
+    global _metrics_installed
+    if _metrics_installed:
+        return
+    _metrics_installed = True
+    add_stage_observer(metrics.observe_stage)
+    startup.register_metrics()
+    metrics.REGISTRY.callback_gauge(
+        "nlp_cache_requests", "Cache lookups by result (process-local)",
+        _cache_requests, labels=("cache", "result"),
+    )
+    metrics.REGISTRY.callback_gauge(
+        "nlp_cache_hit_ratio", "Cache hit ratio (process-local)",
+        _cache_hit_ratio, labels=("cache",),
+    )
+    metrics.REGISTRY.callback_gauge(
+        "nlp_event_clusters", "Event clustering counts (process-local)",
+        lambda: {(k,): v for k, v in event_clusterer.stats().items()} if event_clusterer else {},
+        labels=("kind",),
+    )
 
 # ------------------------------
 # Atomic JSON write
@@ -122,7 +294,7 @@ def format_final_api_output(report: Dict[str, Any]) -> list:
         media_url = inp["media"]
 
     if media_url:
-        media_type = "Image"
+        media_type = "Video" if report.get("media", {}).get("kind") == "video" else "Image"
 
     # ---- Sentiment (rule-based) ----
     sentiment = "neutral"
@@ -154,6 +326,14 @@ def format_final_api_output(report: Dict[str, Any]) -> list:
         "user_name": user.get("name"),
     }
 
+    cluster = report.get("cluster")
+    if cluster:
+        formatted["cluster_id"] = cluster["cluster_id"]
+        formatted["cluster_role"] = cluster["role"]
+        formatted["cluster_representative"] = cluster["representative_id"]
+    if report.get("missing_evidence"):
+        formatted["missing_evidence"] = report["missing_evidence"]
+
     return [formatted]
 
 def format_alert_output(report: Dict[str, Any]) -> Dict[str, Any]:
@@ -181,7 +361,7 @@ def format_alert_output(report: Dict[str, Any]) -> Dict[str, Any]:
     elif extra.get("alert_level", "").lower() == "low":
         priority = "low"
 
-    return {
+    alert = {
         "id": report.get("id"),
         "priority": priority,
         "location": {
@@ -195,22 +375,29 @@ def format_alert_output(report: Dict[str, Any]) -> Dict[str, Any]:
         "mediaUrl": media_url,
         "reported_at": inp.get("created_at"),
     }
+    if report.get("cluster"):
+        alert["cluster_id"] = report["cluster"]["cluster_id"]
+    return alert
 
 
 # ------------------------------
-# Output writer
+# Output builder
 # ------------------------------
-def write_outputs(reports: list[Dict[str, Any]]):
+def build_outputs(reports: list[Dict[str, Any]]) -> tuple:
     """
-    Write final outputs and alerts for one or more pipeline reports.
+    Build final outputs and alerts for one or more pipeline reports.
     - FINAL output is always a list
     - ALERT output uses the new external alert schema
+    Returns (final_outputs, alert_outputs), both in memory.
     """
 
+    t0 = time.perf_counter()
     final_outputs = []
     alert_outputs = []
 
     for report in reports:
+        metrics.REPORTS_PROCESSED.inc(tier=report.get("decision_tier", "gpt"))
+
         # ---- Final API output (unchanged) ----
         formatted_list = format_final_api_output(report)
         final_outputs.extend(formatted_list)
@@ -234,7 +421,17 @@ def write_outputs(reports: list[Dict[str, Any]]):
                 format_alert_output(report)
             )
 
-    # ---- Atomic writes (once per batch) ----
+    metrics.observe_stage("format_outputs", time.perf_counter() - t0)
+    return final_outputs, alert_outputs
+
+
+# ------------------------------
+# Optional snapshot sink (debug)
+# ------------------------------
+def write_outputs(final_outputs: list, alert_outputs: list) -> None:
+    """
+    Atomically snapshot one batch's outputs to FINAL_FILENAME / ALERT_FILENAME.
+    """
     _atomic_write_json(FINAL_FILENAME, final_outputs)
 
     if alert_outputs:
@@ -245,6 +442,39 @@ def write_outputs(reports: list[Dict[str, Any]]):
             Path(ALERT_FILENAME).unlink()
 
 
+class SnapshotSink:
+    """
+    Writes output snapshots on a background thread so disk I/O never sits
+    on the publish path. Only the latest pending snapshot is kept; older
+    unwritten ones are dropped.
+    """
+
+    def __init__(self):
+        self._pending = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="snapshot-sink", daemon=True)
+        self._thread.start()
+
+    def submit(self, final_outputs: list, alert_outputs: list) -> None:
+        with self._cond:
+            self._pending = (final_outputs, alert_outputs)
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                final_outputs, alert_outputs = self._pending
+                self._pending = None
+            try:
+                write_outputs(final_outputs, alert_outputs)
+            except Exception as e:
+                print(f"[WARN] snapshot write failed: {e}")
+
+
+snapshot_sink = SnapshotSink() if OUTPUT_SNAPSHOTS else None
+
 
 # ------------------------------
 # Stage 1: text normalization
@@ -265,16 +495,18 @@ def stage1_process_message(msg: Dict[str, Any]) -> Dict[str, Any]:
 # ------------------------------
 # SerpAPI reverse image search
 # ------------------------------
-def serpapi_reverse_image_search(image_url: str) -> Dict[str, Any]:
+def serpapi_reverse_image_search(
+    image_url: str, content_hash: str = None, deadline: Optional[Deadline] = None
+) -> Dict[str, Any]:
     # Normalize image input
     if isinstance(image_url, list):
         image_url = image_url[0] if image_url else None
     if isinstance(image_url, dict):
         image_url = image_url.get("url")
 
-    print("[DEBUG] SERPAPI_KEY =", SERPAPI_KEY)
-    print("[DEBUG] image_url =", image_url)
-    print("[DEBUG] image_url type =", type(image_url))
+    if DEBUG:
+        print("[DEBUG] image_url =", image_url)
+        print("[DEBUG] image_url type =", type(image_url))
 
     if not SERPAPI_KEY or not image_url or not isinstance(image_url, str):
         return {
@@ -287,106 +519,254 @@ def serpapi_reverse_image_search(image_url: str) -> Dict[str, Any]:
             },
         }
 
+    # ---- Cache lookup (shared across workers on this node) ----
+    if serp_cache is not None:
+        cached = serp_cache.get(image_url, content_hash)
+        if cached is not None:
+            cached["cached"] = True
+            return cached
+
+    timeout = SERPAPI_TIMEOUT
+    if deadline is not None:
+        timeout = deadline.call_timeout(SERPAPI_TIMEOUT)
+        if timeout is None:
+            return deadline.skip("reverse_search", performed=False)
+
     params = {
         "engine": "google_reverse_image",
         "image_url": image_url,
         "api_key": SERPAPI_KEY,
     }
 
-    for attempt in range(1, SERPAPI_MAX_RETRIES + 1):
-        try:
-            resp = requests.get(
-                SERPAPI_ENDPOINT,
-                params=params,
-                timeout=SERPAPI_TIMEOUT,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-
-            results = data.get("image_results") or data.get("visual_matches") or []
-
-            domains = set()
-            first_seen = None
-
-            for r in results:
-                link = r.get("link") or r.get("source")
-                if not link:
-                    continue
-                domain = urlparse(link).netloc.lower()
-                if domain:
-                    domains.add(domain)
-
-                date = r.get("date")
-                if date and (not first_seen or date < first_seen):
-                    first_seen = date
-
-            return {
-                "performed": True,
-                "matches": len(results),
-                "domains": sorted(domains),
-                "first_seen": first_seen,
-                "engine": "google_reverse_image",
-            }
-
-        except requests.exceptions.Timeout:
-            if attempt == SERPAPI_MAX_RETRIES:
-                return {"performed": False, "error": "timeout"}
-            time.sleep(2 ** attempt)
-        except Exception as e:
-            return {"performed": False, "error": str(e)}
+    def _call():
+        resp = requests.get(SERPAPI_ENDPOINT, params=params, timeout=timeout)
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise ProviderRetryable(f"HTTP {resp.status_code}")
+        resp.raise_for_status()
+        return resp.json()
+
+    try:
+        data = serpapi_gateway.call(
+            _call,
+            retry_on=(requests.exceptions.Timeout, requests.exceptions.ConnectionError, ProviderRetryable),
+            deadline=deadline.cutoff() if deadline else None,
+            hedge=True,
+        )
+    except ProviderUnavailable as e:
+        return {"performed": False, **skipped_result(e)}
+    except requests.exceptions.Timeout:
+        # Counted by the gateway
+        return {"performed": False, "error": "timeout", "retryable": True}
+    except (requests.exceptions.ConnectionError, ProviderRetryable) as e:
+        return {"performed": False, "error": str(e), "retryable": True}
+    except Exception as e:
+        metrics.PROVIDER_ERRORS.inc(provider="serpapi", kind="error")
+        return {"performed": False, "error": str(e)}
+
+    result = serpapi_result(data)
+    if serp_cache is not None:
+        serp_cache.put(image_url, result, content_hash)
+    return result
+
+
+def serpapi_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    SerpAPI JSON → reverse-search summary used by the decision stage.
+    """
+    results = data.get("image_results") or data.get("visual_matches") or []
+
+    domains = set()
+    first_seen = None
+
+    for r in results:
+        link = r.get("link") or r.get("source")
+        if not link:
+            continue
+        domain = urlparse(link).netloc.lower()
+        if domain:
+            domains.add(domain)
+
+        date = r.get("date")
+        if date and (not first_seen or date < first_seen):
+            first_seen = date
+
+    return {
+        "performed": True,
+        "matches": len(results),
+        "domains": sorted(domains),
+        "first_seen": first_seen,
+        "engine": "google_reverse_image",
+    }
+
+# ------------------------------
+# Media prefetch
+# ------------------------------
+def media_stage(image_ref: Optional[str], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Download the media once into the blob cache and tag its real type.
+    {"url", "kind": image|video|other|unavailable, "mime", "size", "sha256", "cached"}
+    Short on time, only the blob cache is consulted.
+    """
+    if media_fetcher is None:
+        return {"url": image_ref, "kind": "unavailable", "mime": None, "size": 0, "sha256": None, "cached": False}
+    if deadline is None:
+        return media_fetcher.fetch(image_ref)
+
+    timeout = deadline.call_timeout(media_fetcher.timeout)
+    media = media_fetcher.fetch(image_ref, timeout=timeout, cached_only=timeout is None)
+    if media.get("skipped"):
+        return deadline.skip("media", **media)
+    return media
+
+
+def is_skippable_media(media: Dict[str, Any]) -> bool:
+    """
+    Image-only stages are skipped for media known not to be an image.
+    "unavailable" is not skippable: the providers fetch the URL themselves.
+    """
+    return media.get("kind") in ("video", "other")
+
+
+# ------------------------------
+# Local perceptual-hash lookup
+# ------------------------------
+def sighting_key(msg: Dict[str, Any], image_ref: Optional[str]) -> Optional[str]:
+    """
+    The report's own entry in the pHash index, stable across redeliveries
+    and retries: the message id, else the image URL.
+    """
+    if msg.get("id"):
+        return f"id:{msg['id']}"
+    return f"url:{image_ref}" if image_ref else None
+
+
+def image_hash_stage(media: Dict[str, Any], sighting: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Hash the prefetched image and look it up in the local index, ignoring
+    this report's own earlier sightings (see sighting_key).
+    {"hash": int | None, "sha256": str | None, "hit": dict | None, "sighting": str | None}
+    """
+    out = {"hash": None, "sha256": media.get("sha256"), "hit": None, "sighting": sighting}
+    if phash_index is None or media.get("kind") != "image" or not media.get("sha256"):
+        return out
+
+    blob = media_fetcher.open_blob(media["sha256"])
+    if blob is None:
+        return out
+    try:
+        out["hash"] = image_hash(blob)
+    except Exception:
+        # Sniffed as an image but not decodable by Pillow
+        return out
+    finally:
+        blob.close()
+
+    out["hit"] = phash_index.lookup(out["hash"], sighting)
+    return out
+
+
+def reverse_search_stage(
+    image_ref: Optional[str],
+    media: Dict[str, Any],
+    image_hash_out: Dict[str, Any],
+    external: bool = True,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """
+    Prior-upload check: local pHash index first, SerpAPI only for images
+    no other report has been seen with. A hashed image is recorded once
+    it has a result (a hit, or a successful search); a failed search
+    leaves no sighting behind for a retry to match.
+    external=False (event cluster members) stops after the local index.
+    """
+    if is_skippable_media(media):
+        return {"performed": False, "reason": "not_an_image", "media_kind": media["kind"]}
+
+    h = image_hash_out.get("hash")
+    hit = image_hash_out.get("hit")
+    sighting = image_hash_out.get("sighting")
+
+    if hit is not None:
+        phash_index.touch(int(hit["hash"], 16), sighting, image_ref)
+        return reverse_search_from_hit(hit)
+    if not external:
+        return {"performed": False, "skipped": "event_member"}
+
+    result = serpapi_reverse_image_search(image_ref, image_hash_out.get("sha256"), deadline)
+    if h is not None and result.get("performed"):
+        phash_index.add(h, image_ref, result, sighting)
+    return result
 
-    return {"performed": False, "error": "unknown"}
 
 # ------------------------------
 # Google Vision Web Detection
 # ------------------------------
 class ReverseChecker:
+    """
+    Thin facade over the process-wide VisionBatcher: constructing one per
+    report is free, and concurrent checks share batch_annotate_images calls.
+    """
+
     def __init__(self):
-        self.available = False
-        self._client = None
+        self._batcher = get_vision_batcher()
 
-    def _init_client(self):
-        try:
-            from google.cloud import vision
-            self._client = vision.ImageAnnotatorClient()
-            self.available = True
-        except Exception:
-            self.available = False
+    @property
+    def available(self) -> bool:
+        return bool(self._batcher.available)
 
-    def check_image_duplicate(self, source: str) -> Dict[str, Any]:
+    def check_image_duplicate(self, source: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         result = {"vision_available": False, "best_guess": None}
+        timeout = None
+        if deadline is not None:
+            timeout = deadline.call_timeout(VISION_TIMEOUT)
+            if timeout is None:
+                return deadline.skip("vision_web", **result)
         try:
-            if self._client is None:
-                self._init_client()
-            if not self.available:
-                return result
-
-            from google.cloud import vision
-            image = vision.Image()
-            image.source.image_uri = source
-            response = self._client.web_detection(image=image)
-
-            wd = response.web_detection
-            if wd and wd.best_guess_labels:
-                result["best_guess"] = wd.best_guess_labels[0].label
-                result["vision_available"] = True
-        except Exception:
-            pass
+            result = vision_gateway.call(
+                lambda: self._batcher.annotate(source, timeout),
+                deadline=deadline.cutoff() if deadline else None,
+            )
+            if result.get("error"):
+                metrics.PROVIDER_ERRORS.inc(provider="vision", kind="error")
+        except ProviderUnavailable as e:
+            result = {**result, **skipped_result(e)}
+        except TimeoutError:
+            # Counted by the gateway
+            result = {**result, "error": "timeout", "retryable": True}
+        except Exception as e:
+            # Counted by the gateway
+            result = {**result, "error": str(e) or type(e).__name__}
         return result
 
 # ------------------------------
 # ChatGPT decision wrapper
 # ------------------------------
-def gpt_decision_wrapper(text: str, reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> Dict[str, Any]:
-    if not USE_GPT:
-        return {"alert": False, "confidence": 0.0, "reasons": ["gpt_disabled"]}
+def skipped_decision(e: ProviderUnavailable) -> Dict[str, Any]:
+    return {"alert": False, "confidence": 0.0, "reasons": [f"gpt_skipped:{e.reason}"], **skipped_result(e)}
 
-    prompt = (
+
+def missing_evidence_note(reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> str:
+    """
+    Prompt line naming the evidence that was not obtained, so the model
+    treats it as unknown rather than as "no prior uploads found".
+    """
+    missing = missing_evidence(reverse_search, vision)
+    if not missing:
+        return ""
+    return (
+        f"Missing evidence (not obtained, NOT negative): {', '.join(missing)}. "
+        "Base the decision on what is available and lower confidence accordingly.\n"
+    )
+
+
+def decision_prompt(text: str, reverse_search: Dict[str, Any], vision: Dict[str, Any]) -> str:
+    return (
         "You are a verification system.\n"
         "Respond ONLY with valid JSON.\n\n"
         f"Text:\n{text}\n\n"
         f"Reverse image search:\n{json.dumps(reverse_search)}\n\n"
         f"Vision web detection:\n{json.dumps(vision)}\n\n"
+        f"{missing_evidence_note(reverse_search, vision)}"
         "Return JSON:\n"
         "{"
         "\"alert\": boolean, "
@@ -395,23 +775,327 @@ def gpt_decision_wrapper(text: str, reverse_search: Dict[str, Any], vision: Dict
         "}"
     )
 
+
+def gpt_decision_wrapper(
+    text: str,
+    reverse_search: Dict[str, Any],
+    vision: Dict[str, Any],
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    if not USE_GPT:
+        return {"alert": False, "confidence": 0.0, "reasons": ["gpt_disabled"]}
+
+    # ---- Reuse identical / near-identical recent decisions ----
+    cached = decision_cache.get(text, reverse_search, vision)
+    if cached is not None:
+        return cached
+
+    prompt = decision_prompt(text, reverse_search, vision)
+    timeout = deadline.decision_timeout(OPENAI_TIMEOUT) if deadline else OPENAI_TIMEOUT
+
     try:
-        resp = openai_client.chat.completions.create(
+        resp = openai_gateway.call(
+            lambda: get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=OPENAI_MAX_TOKENS,
+                temperature=0.0,
+                timeout=timeout,
+            ),
+            retry_on=openai_retryable(),
+            deadline=deadline.cutoff(0) if deadline else None,
+            hedge=True,
+        )
+        decision = json.loads(resp.choices[0].message.content)
+    except ProviderUnavailable as e:
+        return skipped_decision(e)
+    except openai_retryable() as e:
+        # Counted by the gateway
+        return {"alert": False, "confidence": 0.0, "reasons": [f"gpt_error:{e}"], "retryable": True}
+    except Exception as e:
+        metrics.PROVIDER_ERRORS.inc(provider="openai", kind="error")
+        return {"alert": False, "confidence": 0.0, "reasons": [f"gpt_error:{e}"]}
+
+    # Errors are never cached, only real model decisions
+    decision_cache.put(text, reverse_search, vision, decision)
+    return decision
+
+# ------------------------------
+# Batched ChatGPT decisions
+# ------------------------------
+def _validate_decision(obj: Any) -> Optional[Dict[str, Any]]:
+    """
+    Strict shape check for one model decision.
+    Returns the cleaned decision or None if anything is off.
+    """
+    if not isinstance(obj, dict):
+        return None
+    alert = obj.get("alert")
+    confidence = obj.get("confidence")
+    reasons = obj.get("reasons")
+    if not isinstance(alert, bool):
+        return None
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        return None
+    if not 0.0 <= float(confidence) <= 1.0:
+        return None
+    if not isinstance(reasons, list) or not all(isinstance(r, str) for r in reasons):
+        return None
+    return {"alert": alert, "confidence": float(confidence), "reasons": reasons}
+
+
+def _gpt_batch_call(chunk: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    One chat completion for up to GPT_BATCH_SIZE items.
+    Returns only the entries that parsed and validated.
+    The timeout follows the chunk's earliest deadline.
+    """
+    blocks = []
+    for item in chunk:
+        blocks.append(
+            f"### id: {item['id']}\n"
+            f"Text:\n{item['text']}\n"
+            f"Reverse image search:\n{json.dumps(item['reverse_search'])}\n"
+            f"Vision web detection:\n{json.dumps(item['vision'])}\n"
+            f"{missing_evidence_note(item['reverse_search'], item['vision'])}"
+        )
+
+    prompt = (
+        "You are a verification system.\n"
+        "Evaluate EACH report below independently.\n"
+        "Respond ONLY with a valid JSON array, one object per report:\n"
+        "[{"
+        "\"id\": string (the report id), "
+        "\"alert\": boolean, "
+        "\"confidence\": number between 0 and 1, "
+        "\"reasons\": array of strings"
+        "}]\n\n"
+        + "\n".join(blocks)
+    )
+
+    deadlines = [item["deadline"] for item in chunk if item.get("deadline") is not None]
+    earliest = min(deadlines, key=lambda d: d.expires_at) if deadlines else None
+
+    resp = openai_gateway.call(
+        lambda: get_openai_client().chat.completions.create(
             model=OPENAI_MODEL,
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=OPENAI_MAX_TOKENS,
+            max_tokens=OPENAI_MAX_TOKENS * len(chunk),
             temperature=0.0,
-            timeout=OPENAI_TIMEOUT,
+            timeout=earliest.decision_timeout(OPENAI_TIMEOUT) if earliest else OPENAI_TIMEOUT,
+        ),
+        retry_on=openai_retryable(),
+        deadline=earliest.cutoff(0) if earliest else None,
+    )
+    parsed = json.loads(resp.choices[0].message.content)
+    if isinstance(parsed, dict):
+        parsed = parsed.get("decisions") or parsed.get("results") or []
+    if not isinstance(parsed, list):
+        return {}
+
+    wanted = {item["id"] for item in chunk}
+    out = {}
+    for entry in parsed:
+        if not isinstance(entry, dict):
+            continue
+        rid = entry.get("id")
+        if rid not in wanted or rid in out:
+            continue
+        decision = _validate_decision(entry)
+        if decision is not None:
+            out[rid] = decision
+    return out
+
+
+def gpt_batch_decision_wrapper(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Batch counterpart of gpt_decision_wrapper.
+
+    items: [{"id", "text", "reverse_search", "vision", ["deadline"]}, ...]
+    with unique ids
+    Returns {id: decision}. Up to GPT_BATCH_SIZE items share one prompt;
+    any item missing or invalid in the batch response falls back to a
+    single gpt_decision_wrapper call.
+    """
+    if not USE_GPT:
+        return {
+            item["id"]: {"alert": False, "confidence": 0.0, "reasons": ["gpt_disabled"]}
+            for item in items
+        }
+
+    decisions: Dict[str, Dict[str, Any]] = {}
+    pending = []
+
+    for item in items:
+        cached = decision_cache.get(item["text"], item["reverse_search"], item["vision"])
+        if cached is not None:
+            decisions[item["id"]] = cached
+        else:
+            pending.append(item)
+
+    size = max(1, GPT_BATCH_SIZE)
+    for start in range(0, len(pending), size):
+        chunk = pending[start:start + size]
+
+        if len(chunk) > 1:
+            try:
+                batch = _gpt_batch_call(chunk)
+            except ProviderUnavailable as e:
+                # Provider down: don't fall back to one call per item
+                for item in chunk:
+                    decisions[item["id"]] = skipped_decision(e)
+                continue
+            except Exception:
+                metrics.PROVIDER_ERRORS.inc(provider="openai", kind="batch_error")
+                batch = {}
+            invalid = len(chunk) - len(batch)
+            if invalid:
+                metrics.PROVIDER_ERRORS.inc(invalid, provider="openai", kind="batch_item_fallback")
+        else:
+            batch = {}
+
+        for item in chunk:
+            decision = batch.get(item["id"])
+            if decision is not None:
+                decision_cache.put(item["text"], item["reverse_search"], item["vision"], decision)
+                decisions[item["id"]] = decision
+            else:
+                decisions[item["id"]] = gpt_decision_wrapper(
+                    item["text"], item["reverse_search"], item["vision"], item.get("deadline")
+                )
+
+    return decisions
+
+# ------------------------------
+# Decision cascade: local classifier → GPT
+# ------------------------------
+def _local_relevance(score: Optional[float]) -> Dict[str, Any]:
+    if score is None:
+        return {"score": None, "decision": None}
+    return {
+        "score": round(score, 4),
+        "decision": relevance_classifier.local_decision(score),
+    }
+
+
+def relevance_stage(text: str) -> Optional[Dict[str, Any]]:
+    if relevance_classifier is None:
+        return None
+    return _local_relevance(relevance_classifier.score(text))
+
+
+def is_local_negative(relevance: Optional[Dict[str, Any]]) -> bool:
+    """
+    The local tier cleared the report: no provider (SerpAPI, Vision, GPT)
+    is consulted for it. Local positives still collect image evidence,
+    which the prior-upload relevance rule needs.
+    """
+    return bool(relevance) and relevance.get("decision") is not None and not relevance["decision"]["alert"]
+
+
+LOCAL_NEGATIVE = "local_negative"
+
+
+def decision_tier(decision: Dict[str, Any], relevance: Optional[Dict[str, Any]]) -> str:
+    """
+    Which tier produced the decision: local | event | cache | gpt
+    """
+    if relevance and relevance.get("decision") is not None:
+        return "local"
+    if "propagated" in decision:
+        return "event"
+    if "cache" in decision:
+        return "cache"
+    return "gpt"
+
+
+# ------------------------------
+# Event clustering: verify one representative per event
+# ------------------------------
+def event_membership(report_id: str, msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if event_clusterer is None:
+        return None
+    return event_clusterer.assign(report_id, msg, msg.get("text") or "")
+
+
+def is_verified_decision(decision: Optional[Dict[str, Any]]) -> bool:
+    """
+    Only real verdicts are propagated to event members, never a
+    skipped / failed / disabled placeholder.
+    """
+    if not decision or decision.get("skipped"):
+        return False
+    return not any(str(r).startswith(("gpt_error", "gpt_disabled")) for r in decision.get("reasons") or [])
+
+
+def resolve_event(
+    membership: Optional[Dict[str, Any]], decision: Optional[Dict[str, Any]], retried: bool = False
+) -> None:
+    """
+    retried: the report goes back to a retry tier for its evidence (see
+    evidence_retried), so members verify themselves rather than inherit
+    a decision made without it.
+    """
+    if membership is not None and membership["role"] == "representative":
+        event_clusterer.resolve(
+            membership["cluster_id"], decision if is_verified_decision(decision) and not retried else None
         )
-        return json.loads(resp.choices[0].message.content)
-    except Exception as e:
-        return {"alert": False, "confidence": 0.0, "reasons": [f"gpt_error:{e}"]}
+
+
+def member_decision(membership: Dict[str, Any], verify, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Inherit the representative's decision; if it does not arrive in time
+    (or verification failed there), verify this report itself via verify().
+    """
+    timeout = EVENT_WAIT_SECONDS
+    if deadline is not None:
+        timeout = deadline.call_timeout(EVENT_WAIT_SECONDS) or 0.0
+    rep = event_clusterer.wait(membership["cluster_id"], timeout)
+    if rep is not None:
+        return event_clusterer.propagate(rep, membership)
+    return verify()
+
+
+def verify_member(
+    report: Dict[str, Any], image_ref: Optional[str], deadline: Optional[Deadline] = None
+) -> Dict[str, Any]:
+    """
+    Full verification for a member whose representative produced no
+    usable decision: the external lookups skipped earlier, then GPT.
+    Overwrites the report's skipped evidence in place.
+    """
+    media = report["media"]
+    if not is_skippable_media(media):
+        hash_out = {"hash": None, "sha256": media.get("sha256"), "hit": None}
+        try:
+            report["reverse_search"] = reverse_search_stage(image_ref, media, hash_out, deadline=deadline)
+        except Exception as e:
+            report["reverse_search"] = {"performed": False, "error": str(e)}
+        if image_ref:
+            try:
+                report["vision_web"] = ReverseChecker().check_image_duplicate(image_ref, deadline)
+            except Exception:
+                report["vision_web"] = {"vision_available": False, "best_guess": None}
+    report["missing_evidence"] = missing_evidence(report["reverse_search"], report["vision_web"])
+    return gpt_decision_wrapper(
+        report["stage1_text"]["sanitized_text"], report["reverse_search"], report["vision_web"], deadline
+    )
+
+
+def _is_member(report: Dict[str, Any]) -> bool:
+    return bool(report.get("cluster")) and report["cluster"]["role"] == "member"
+
+
+def cluster_fields(membership: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if membership is None:
+        return None
+    return dict(membership, size=event_clusterer.size(membership["cluster_id"]))
 
 # ------------------------------
 # Full pipeline
 # ------------------------------
-def run_full_pipeline(msg: Dict[str, Any]) -> Dict[str, Any]:
-    report = {
+def new_report(msg: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "id": msg.get("id") or f"evt_{int(time.time())}",
         "input": msg,
         "timestamps": {
@@ -419,119 +1103,950 @@ def run_full_pipeline(msg: Dict[str, Any]) -> Dict[str, Any]:
         },
     }
 
-    stage1 = stage1_process_message(msg)
-    report["stage1_text"] = stage1
 
+def image_ref_of(msg: Dict[str, Any]) -> Optional[str]:
     # ✅ IMAGE NORMALIZATION (FIXED FOR YOUR INPUT)
-    image_ref = None
     if isinstance(msg.get("media"), list) and msg["media"]:
-        image_ref = msg["media"][0]
-    elif isinstance(msg.get("media"), str):
-        image_ref = msg["media"]
+        return msg["media"][0]
+    if isinstance(msg.get("media"), str):
+        return msg["media"]
+    return None
 
-    reverse_search = serpapi_reverse_image_search(image_ref)
-    report["reverse_search"] = reverse_search
 
-    vision = ReverseChecker()
-    vision_out = vision.check_image_duplicate(image_ref) if image_ref else {}
-    report["vision_web"] = vision_out
-
-    report["decision"] = gpt_decision_wrapper(
-        stage1["sanitized_text"],
-        reverse_search,
-        vision_out,
+def run_full_pipeline(
+    msg: Dict[str, Any], decide: bool = True, deadline: Optional[Deadline] = None, final: bool = True
+) -> Dict[str, Any]:
+    """
+    Run every stage for one message.
+    decide=False stops after enrichment so the GPT decision can be
+    made for several reports at once (see run_pipeline_batch).
+    deadline: the report's time budget (default: from its lane / source).
+    final: False if a transient failure may still be retried later.
+    """
+    install_metrics()
+    if deadline is None:
+        deadline = deadline_for(msg)
+    report = new_report(msg)
+    image_ref = image_ref_of(msg)
+    membership = event_membership(report["id"], msg)
+    is_member = membership is not None and membership["role"] == "member"
+
+    # ---- Stage DAG ----
+    # stage1 ──> relevance ──────────┬──────────────────────────┐
+    #                                 ├─> reverse_search ──┐     │
+    # media ──> image_hash ──────────┤                     ├─> decision (local or gpt)
+    #       └────────────────────────┴─> vision ───────────┘
+    # Media download and hashing overlap text normalization and the
+    # local classifier; the paid lookups start once the classifier has
+    # not cleared the report.
+    dag = StageDAG()
+    dag.add("stage1", lambda: stage1_process_message(msg))
+    dag.add(
+        "media",
+        lambda: media_stage(image_ref, deadline),
+        fallback=lambda e: {"url": image_ref, "kind": "unavailable", "mime": None,
+                            "size": 0, "sha256": None, "cached": False, "error": str(e)},
     )
-
-    report["timestamps"]["completed_at"] = time.strftime(
-        "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+    dag.add(
+        "image_hash",
+        lambda media: image_hash_stage(media, sighting_key(msg, image_ref)),
+        deps=("media",),
+        fallback=lambda e: {"hash": None, "sha256": None, "hit": None},
+    )
+    # The external evidence stages wait for the local tier so a clear
+    # negative never reaches SerpAPI / Vision
+    dag.add(
+        "relevance",
+        lambda stage1: relevance_stage(stage1["sanitized_text"]),
+        deps=("stage1",),
+        fallback=lambda e: None,
     )
+    dag.add(
+        "reverse_search",
+        lambda media, image_hash, relevance: (
+            {"performed": False, "skipped": LOCAL_NEGATIVE}
+            if is_local_negative(relevance)
+            else reverse_search_stage(
+                image_ref, media, image_hash, external=not is_member, deadline=deadline
+            )
+        ),
+        deps=("media", "image_hash", "relevance"),
+    )
+    dag.add(
+        "vision_web",
+        lambda media, relevance: (
+            {"vision_available": False, "best_guess": None, "skipped": "not_an_image"}
+            if is_skippable_media(media)
+            else {"vision_available": False, "best_guess": None, "skipped": LOCAL_NEGATIVE}
+            if is_local_negative(relevance)
+            else {"vision_available": False, "best_guess": None, "skipped": "event_member"}
+            if is_member
+            else ReverseChecker().check_image_duplicate(image_ref, deadline) if image_ref else {}
+        ),
+        deps=("media", "relevance"),
+        fallback=lambda e: {"vision_available": False, "best_guess": None},
+    )
+    if decide:
+        # Members wait for their representative outside the DAG so a
+        # blocked wait never holds a stage pool thread
+        if not is_member:
+            dag.add(
+                "decision",
+                lambda stage1, reverse_search, vision_web, relevance: (
+                    relevance["decision"]
+                    if relevance and relevance["decision"] is not None
+                    else gpt_decision_wrapper(
+                        stage1["sanitized_text"],
+                        reverse_search,
+                        vision_web,
+                        deadline,
+                    )
+                ),
+                deps=("stage1", "reverse_search", "vision_web", "relevance"),
+            )
+
+    try:
+        results = dag.run(report["timestamps"])
+    except Exception:
+        # Also with decide=False: the batch that would have resolved the
+        # event never sees this report, and members must not wait it out
+        resolve_event(membership, None)
+        raise
+
+    report["stage1_text"] = results["stage1"]
+    report["media"] = {k: v for k, v in results["media"].items() if k != "fetched_at"}
+    report["reverse_search"] = results["reverse_search"]
+    report["vision_web"] = results["vision_web"]
+    report["missing_evidence"] = missing_evidence(report["reverse_search"], report["vision_web"])
+    report["cluster"] = cluster_fields(membership)
+    report["relevance"] = results["relevance"]
+
+    if decide:
+        if is_member:
+            report["decision"] = (
+                report["relevance"]["decision"]
+                if report["relevance"] and report["relevance"]["decision"] is not None
+                else member_decision(
+                    membership, lambda: verify_member(report, image_ref, deadline), deadline
+                )
+            )
+        else:
+            report["decision"] = results["decision"]
+            resolve_event(membership, report["decision"], evidence_retried(report, final))
+        report["decision_tier"] = decision_tier(report["decision"], report["relevance"])
+        report["timestamps"]["completed_at"] = time.strftime(
+            "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+        )
+        if deadline is not None:
+            report["deadline"] = deadline.summary()
 
     return report
 
+
+_enrich_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _batch_enrich_pool() -> ThreadPoolExecutor:
+    """
+    Reports in a batch are enriched concurrently. This pool only waits on
+    stage futures, so it must stay separate from the stage pool itself.
+    """
+    global _enrich_pool
+    if _enrich_pool is None:
+        _enrich_pool = ThreadPoolExecutor(max_workers=BATCH_ENRICH_WORKERS, thread_name_prefix="enrich")
+    return _enrich_pool
+
+
+def run_pipeline_batch(
+    msgs: List[Dict[str, Any]], final_attempts: Optional[List[bool]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Enrich every message (the local classifier runs inside each report's
+    DAG; concurrent calls share one forward pass), then decide the
+    uncertain ones with batched GPT calls instead of one round-trip per
+    report.
+    final_attempts: as in process_messages (default: all final).
+    """
+    if not msgs:
+        return []
+    finals = final_attempts or [True] * len(msgs)
+    deadlines = [deadline_for(m) for m in msgs]
+    futures = [
+        _batch_enrich_pool().submit(run_full_pipeline, m, decide=False, deadline=d)
+        for m, d in zip(msgs, deadlines)
+    ]
+    wait(futures)
+    try:
+        return _decide_batch(msgs, [f.result() for f in futures], deadlines, finals)
+    finally:
+        # Whatever failed, representatives enriched here release their
+        # members (a no-op for those already resolved)
+        for f in futures:
+            if f.exception() is None:
+                resolve_event(f.result()["cluster"], None)
+
+
+def _decide_batch(
+    msgs: List[Dict[str, Any]],
+    reports: List[Dict[str, Any]],
+    deadlines: List[Optional[Deadline]],
+    finals: List[bool],
+) -> List[Dict[str, Any]]:
+    """
+    Decision half of run_pipeline_batch for the enriched reports.
+    """
+    # Batch keys must be unique even if report ids repeat
+    keys = []
+    seen = set()
+    for i, report in enumerate(reports):
+        key = str(report["id"])
+        if key in seen:
+            key = f"{key}#{i}"
+        seen.add(key)
+        keys.append(key)
+
+    items = [
+        {
+            "id": key,
+            "text": report["stage1_text"]["sanitized_text"],
+            "reverse_search": report["reverse_search"],
+            "vision": report["vision_web"],
+            "deadline": deadline,
+        }
+        for key, report, deadline in zip(keys, reports, deadlines)
+        if not (report["relevance"] and report["relevance"]["decision"] is not None)
+        and not _is_member(report)
+    ]
+
+    started_at = iso_now()
+    t0 = time.perf_counter()
+    decisions = gpt_batch_decision_wrapper(items)
+    metrics.observe_stage("decision_batch", time.perf_counter() - t0)
+    timing = {
+        "started_at": started_at,
+        "completed_at": iso_now(),
+        "duration_ms": round((time.perf_counter() - t0) * 1000, 3),
+        "batch_size": len(items),
+    }
+
+    # Representatives first, so members later in this batch find them resolved
+    members = []
+    for i, (key, report) in enumerate(zip(keys, reports)):
+        if key in decisions:
+            report["decision"] = decisions[key]
+            report["timestamps"].setdefault("stages", {})["decision"] = dict(timing)
+        elif report["relevance"] and report["relevance"]["decision"] is not None:
+            report["decision"] = report["relevance"]["decision"]
+        else:
+            members.append(i)
+            continue
+        resolve_event(report["cluster"], report["decision"], evidence_retried(report, finals[i]))
+
+    for i in members:
+        report = reports[i]
+        report["decision"] = member_decision(
+            report["cluster"],
+            lambda: verify_member(report, image_ref_of(msgs[i]), deadlines[i]),
+            deadlines[i],
+        )
+
+    completed_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    for report, deadline in zip(reports, deadlines):
+        report["decision_tier"] = decision_tier(report["decision"], report["relevance"])
+        report["timestamps"]["completed_at"] = completed_at
+        if deadline is not None:
+            report["deadline"] = deadline.summary()
+
+    return reports
+
 # ------------------------------
 # RabbitMQ helpers
 # ------------------------------
+def _rabbit_params():
+    return pika.ConnectionParameters(host=RABBIT_HOST)
+
+
+def _publisher():
+    return get_publisher(_rabbit_params(), OUTPUT_CODEC)
+
+
 def _send_to_rabbit(queue: str, payload: Any) -> bool:
     if pika is None:
         return False
-    try:
-        conn = pika.BlockingConnection(pika.ConnectionParameters(host=RABBIT_HOST))
-        ch = conn.channel()
-        ch.queue_declare(queue=queue, durable=True)
-        ch.basic_publish(
-            exchange="",
-            routing_key=queue,
-            body=json.dumps(payload),
-            properties=pika.BasicProperties(delivery_mode=2),
-        )
-        conn.close()
-        return True
-    except Exception:
-        return False
+    return _publisher().publish(queue, payload)
 
-def send_files_to_queues():
-    # Send final output (always expected to be valid JSON)
-    if Path(FINAL_FILENAME).exists():
-        final_text = Path(FINAL_FILENAME).read_text().strip()
-        if final_text:
-            _send_to_rabbit(FINAL_QUEUE, json.loads(final_text))
+def publish_outputs(final_outputs: list, alert_outputs: list) -> bool:
+    """
+    Publish one batch straight from the in-memory formatted objects.
+    """
+    messages = []
+    if final_outputs:
+        messages.append((FINAL_QUEUE, final_outputs))
+    if alert_outputs:
+        messages.append((ALERT_QUEUE, alert_outputs))
+
+    ok = True
+    if messages and pika is not None:
+        # Both outputs go out back-to-back on the long-lived channel
+        t0 = time.perf_counter()
+        ok = _publisher().publish_batch(messages)
+        metrics.observe_stage("publish", time.perf_counter() - t0, error=not ok)
 
-    # Send alert output ONLY if file exists AND is non-empty
-    if Path(ALERT_FILENAME).exists():
-        alert_text = Path(ALERT_FILENAME).read_text().strip()
-        if alert_text:
-            _send_to_rabbit(ALERT_QUEUE, json.loads(alert_text))
+    if snapshot_sink is not None:
+        snapshot_sink.submit(final_outputs, alert_outputs)
+
+    return ok
 
 
 # ------------------------------
 # Consumer
 # ------------------------------
+def decode_body(body: bytes, content_type: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Decode one delivery into a list of report messages, using the codec
+    named by its AMQP content_type (JSON when absent).
+    A single-object payload becomes a one-item list; None if malformed.
+    """
+    try:
+        msg = wire_codec.decode(body, content_type)
+    except ValueError:
+        return None
+
+    if isinstance(msg, dict):
+        return [msg]
+    if isinstance(msg, list):
+        return [item for item in msg if isinstance(item, dict)]
+    return None
+
+
+def _transient_error(result: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Why a stage result is a transient provider failure (gateway
+    rejection, timeout, connection error, 429/5xx), or None.
+    """
+    if not result:
+        return None
+    if result.get("skipped") and "provider" in result:
+        return f"{result['provider']}:{result['skipped']}"
+    if result.get("retryable"):
+        return str(result.get("error") or (result.get("reasons") or ["retryable"])[0])
+    return None
+
+
+def evidence_retried(report: Dict[str, Any], final: bool) -> bool:
+    """
+    True when split_failed will hold the report back to retry its
+    evidence (SerpAPI / Vision failed transiently, attempts left).
+    """
+    return RETRY_QUEUES_ENABLED and not final and any(
+        _transient_error(report.get(stage)) is not None for stage in ("reverse_search", "vision_web")
+    )
+
+
+def split_failed(
+    reports: List[Dict[str, Any]], final_attempts: List[bool]
+) -> Tuple[List[Dict[str, Any]], List[tuple]]:
+    """
+    Hold back reports that failed transiently, to be retried later.
+    On a final attempt missing evidence is published as it is; only a
+    failed decision is still held back (and dead-lettered) rather than
+    published as a false "no alert".
+    Returns (ready_reports, [(index, stages, error), ...]).
+    """
+    if not RETRY_QUEUES_ENABLED:
+        return reports, []
+    ready, failed = [], []
+    for i, (report, final) in enumerate(zip(reports, final_attempts)):
+        errors = {
+            stage: err
+            for stage in ("reverse_search", "vision_web", "decision")
+            for err in [_transient_error(report.get(stage))]
+            if err is not None and (stage == "decision" or not final)
+        }
+        if errors:
+            failed.append((i, list(errors), "; ".join(f"{k}={v}" for k, v in errors.items())))
+        else:
+            ready.append(report)
+    return ready, failed
+
+
+def process_messages(
+    msgs: List[Dict[str, Any]], final_attempts: Optional[List[bool]] = None
+) -> Tuple[Optional[tuple], List[tuple]]:
+    """
+    Run decoded report messages through the pipeline.
+    final_attempts: per message, False if it may still be retried later
+    (default: all final).
+    Returns (outputs, failed): outputs is (final_outputs, alert_outputs)
+    or None if no report is ready; failed as in split_failed.
+    """
+    if not msgs:
+        return None, []
+    finals = final_attempts or [True] * len(msgs)
+    if len(msgs) == 1:
+        reports = [run_full_pipeline(msgs[0], final=finals[0])]
+    else:
+        reports = run_pipeline_batch(msgs, finals)
+    ready, failed = split_failed(reports, finals)
+    return (build_outputs(ready) if ready else None), failed
+
+
+def _observe_queue_lag(properties) -> None:
+    ts = getattr(properties, "timestamp", None)
+    if ts:
+        metrics.QUEUE_LAG.observe(max(0.0, time.time() - ts))
+
+
+def _observe_lane_latency(lane: str, published_at: float) -> None:
+    metrics.LANE_LATENCY.observe(max(0.0, time.time() - published_at), lane=lane)
+
+
+def _declare_queues(ch) -> None:
+    for _, queue in INPUT_LANES:
+        ch.queue_declare(queue=queue, durable=True)
+    retry_queues.declare(ch, INPUT_QUEUE)
+    ch.queue_declare(queue=ALERT_QUEUE, durable=True)
+    ch.queue_declare(queue=FINAL_QUEUE, durable=True)
+
+
 def start_rabbit_consumer():
     if pika is None:
         print("pika not installed")
         sys.exit(1)
 
-    conn = pika.BlockingConnection(pika.ConnectionParameters(host=RABBIT_HOST))
+    warm_up()
+
+    if CONSUMER_MODE == "async":
+        # async_engine imports main_script; reuse this module when run as a script
+        sys.modules.setdefault("main_script", sys.modules[__name__])
+        from async_engine import run_async_consumer
+        return run_async_consumer()
+    if CONSUMER_MODE == "concurrent":
+        return ConcurrentConsumer().run()
+    if CONSUMER_MODE == "microbatch":
+        return MicroBatchConsumer().run()
+    if len(INPUT_LANES) > 1:
+        # Lanes need the local scheduler; one worker keeps it serial
+        return ConcurrentConsumer(workers=1, prefetch=1).run()
+
+    conn = pika.BlockingConnection(_rabbit_params())
     ch = conn.channel()
 
-    ch.queue_declare(queue=INPUT_QUEUE, durable=True)
-    ch.queue_declare(queue=ALERT_QUEUE, durable=True)
-    ch.queue_declare(queue=FINAL_QUEUE, durable=True)
+    _declare_queues(ch)
+
+    # Outputs are published on a confirm-mode channel of this same
+    # connection; its heartbeats are serviced by start_consuming()
+    _publisher().attach(conn)
 
     def _callback(ch, method, properties, body):
+        _observe_queue_lag(properties)
+        delivery = Delivery(method, properties, body, priority_lanes.NORMAL)
+        outputs, failed, error = run_delivery(delivery)
+        if outputs is not None:
+            publish_outputs(*outputs)
+        settle_delivery(ch, delivery, failed, error)
+
+    ch.basic_qos(prefetch_count=1)
+    tag = ch.basic_consume(queue=INPUT_QUEUE, on_message_callback=_callback)
+
+    consumer_ready()
+    print(f"[+] Listening on '{INPUT_QUEUE}' (waiting for messages)")
+    # Deliveries run inside process_data_events, so none is in flight
+    # when the stop flag is checked
+    while conn.is_open and not prefork.stop_requested():
+        conn.process_data_events(time_limit=1)
+    if conn.is_open:
+        print("[+] Stopping: no delivery in flight")
+        ch.basic_cancel(tag)
+        conn.close()
+
+
+# ------------------------------
+# Deliveries: run, then ack / retry / dead-letter
+# ------------------------------
+MALFORMED = "malformed"
+_LANE_QUEUES = dict(INPUT_LANES)
+
+
+class Delivery:
+    __slots__ = (
+        "tag", "redelivered", "body", "content_type", "headers", "timestamp",
+        "lane", "queue", "published_at", "msgs",
+    )
+
+    def __init__(self, method, properties, body: bytes, lane: str):
+        self.tag = method.delivery_tag
+        self.redelivered = method.redelivered
+        self.body = body
+        self.content_type = properties.content_type
+        self.headers = properties.headers or {}
+        self.timestamp = properties.timestamp
+        self.lane = lane
+        self.queue = _LANE_QUEUES.get(lane, INPUT_QUEUE)
+        self.published_at = properties.timestamp or time.time()
+        self.msgs: List[Dict[str, Any]] = []
+
+    @property
+    def final(self) -> bool:
+        return retry_queues.is_final_attempt(self.headers)
+
+
+def run_delivery(delivery: Delivery) -> tuple:
+    """
+    Worker side. Returns (outputs, failed, error); error is MALFORMED
+    for a body that cannot be decoded, or the pipeline exception.
+    """
+    if not delivery.msgs:
+        msgs = decode_body(delivery.body, delivery.content_type)
+        if msgs is None:
+            return None, [], MALFORMED
+        delivery.msgs = msgs
+    try:
+        outputs, failed = process_messages(delivery.msgs, [delivery.final] * len(delivery.msgs))
+    except Exception as e:
+        return None, [], e
+    return outputs, failed, None
+
+
+def _forward(delivery: Delivery, route: tuple, body: bytes = None, content_type: str = None) -> bool:
+    exchange, routing_key, headers = route
+    return _publisher().forward(
+        exchange, routing_key,
+        delivery.body if body is None else body,
+        delivery.content_type if body is None else content_type,
+        headers, delivery.timestamp,
+    )
+
+
+def settle_delivery(ch, delivery: Delivery, failed: List[tuple], error) -> None:
+    """
+    Connection-thread side, after the delivery's outputs are published.
+    - malformed body: dead-letter queue
+    - pipeline exception: next retry tier (without tiers: requeue once,
+      then dead-letter)
+    - reports in failed: each republished alone to its next retry tier
+    The input is acked only once everything is parked somewhere; if a
+    republish fails it is requeued instead.
+    """
+    if error is MALFORMED:
+        ok = _forward(delivery, retry_queues.route_dead(INPUT_QUEUE, delivery.headers, MALFORMED))
+    elif error is not None:
+        print(f"[ERROR] pipeline failed: {error}")
+        if not RETRY_QUEUES_ENABLED and not delivery.redelivered:
+            ch.basic_nack(delivery_tag=delivery.tag, requeue=True)
+            return
+        ok = _forward(delivery, retry_queues.route_failure(
+            INPUT_QUEUE, delivery.queue, delivery.headers, ["pipeline"], str(error)
+        ))
+    else:
+        ok = True
+        codec = wire_codec.codec_for(delivery.content_type)
+        for i, stages, reason in failed:
+            body, content_type = wire_codec.encode(delivery.msgs[i], codec)
+            route = retry_queues.route_failure(INPUT_QUEUE, delivery.queue, delivery.headers, stages, reason)
+            ok = _forward(delivery, route, body, content_type) and ok
+        if len(failed) < len(delivery.msgs):
+            _observe_lane_latency(delivery.lane, delivery.published_at)
+
+    if ok:
+        ch.basic_ack(delivery_tag=delivery.tag)
+    else:
+        ch.basic_nack(delivery_tag=delivery.tag, requeue=True)
+
+
+class ConcurrentConsumer:
+    """
+    Keeps many I/O-bound reports in flight in one process.
+
+    - The pika connection thread only receives deliveries, publishes
+      outputs and acks; pipeline work runs on a bounded worker pool
+    - Workers hand results back with add_callback_threadsafe, so every
+      channel operation happens on the connection thread
+    - Deliveries wait in a LaneScheduler and are handed to a worker only
+      when one is free, so a later high-lane report overtakes a buffered
+      low-lane backlog instead of queueing behind it in the pool
+    - Backpressure: prefetch bounds what the broker sends, and consuming
+      is paused while in-flight work is at the high watermark
+    - stop() (or the prefork stop signal) cancels consuming; run()
+      returns once every delivery already received is settled
+    """
+
+    def __init__(
+        self,
+        workers: int = CONSUMER_WORKERS,
+        prefetch: int = CONSUMER_PREFETCH,
+        lanes: Optional[List[tuple]] = None,
+    ):
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self.lanes = list(lanes or INPUT_LANES)
+        # prefetch is per consumer, i.e. per lane
+        self.high_watermark = max(self.workers, self.prefetch * len(self.lanes))
+        self.low_watermark = max(1, self.high_watermark // 2)
+
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report")
+        self._scheduler = LaneScheduler()
+        self._inflight = 0
+        self._busy = 0
+        self._consumer_tags: List[str] = []
+        self._stopping = False
+        self.conn = None
+        self.ch = None
+
+    # ---- connection thread ----
+    def _on_message(self, ch, method, properties, body, lane: str = priority_lanes.NORMAL):
+        _observe_queue_lag(properties)
+        self._inflight += 1
+        metrics.MESSAGES_INFLIGHT.set(self._inflight)
+        self._scheduler.push(lane, Delivery(method, properties, body, lane))
+        self._dispatch()
+        if self._inflight >= self.high_watermark:
+            self._pause()
+
+    def _dispatch(self):
+        while self._busy < self.workers:
+            picked = self._scheduler.pop()
+            if picked is None:
+                break
+            self._busy += 1
+            self._pool.submit(self._work, picked[1])
+        self._report_buffered()
+
+    def _report_buffered(self):
+        for lane, depth in self._scheduler.depths().items():
+            metrics.LANE_BUFFERED.set(depth, lane=lane)
+
+    def _finish(self, delivery: Delivery, outputs, failed, error):
+        self._inflight -= 1
+        self._busy -= 1
+        metrics.MESSAGES_INFLIGHT.set(self._inflight)
+        if outputs is not None:
+            publish_outputs(*outputs)
+        settle_delivery(self.ch, delivery, failed, error)
+
+        self._dispatch()
+        self._maybe_resume()
+
+    def _maybe_resume(self):
+        if not self._stopping and not self._consumer_tags and self._inflight <= self.low_watermark:
+            self._start_consuming()
+
+    def _start_consuming(self):
+        self._consumer_tags = [
+            self.ch.basic_consume(
+                queue=queue, on_message_callback=functools.partial(self._on_message, lane=lane)
+            )
+            for lane, queue in self.lanes
+        ]
+
+    def _pause(self):
+        for tag in self._consumer_tags:
+            self.ch.basic_cancel(tag)
+        self._consumer_tags = []
+
+    def stop(self):
+        """
+        Take no new deliveries; the buffered and running ones still finish.
+        """
+        if self._stopping:
+            return
+        self._stopping = True
+        self._pause()
+        print(f"[+] Stopping: finishing {self._inflight} in-flight deliveries")
+
+    # ---- worker threads ----
+    def _work(self, delivery: Delivery):
+        self.conn.add_callback_threadsafe(
+            functools.partial(self._finish, delivery, *run_delivery(delivery))
+        )
+
+    def run(self):
+        self.conn = pika.BlockingConnection(_rabbit_params())
+        self.ch = self.conn.channel()
+        _declare_queues(self.ch)
+        _publisher().attach(self.conn)
+
+        self.ch.basic_qos(prefetch_count=self.prefetch)
+        self._start_consuming()
+
+        consumer_ready()
+        print(
+            f"[+] Listening on {', '.join(repr(q) for _, q in self.lanes)} "
+            f"(concurrent: workers={self.workers}, prefetch={self.prefetch})"
+        )
+        # Not start_consuming(): it returns as soon as no consumer is
+        # registered, which is exactly the paused state under backpressure
         try:
-            msg = json.loads(body.decode("utf-8"))
-        except Exception:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            while self.conn.is_open:
+                if prefork.stop_requested():
+                    self.stop()
+                if self._stopping and not self._inflight:
+                    self.conn.close()
+                    break
+                self.conn.process_data_events(time_limit=1)
+        finally:
+            self._pool.shutdown(wait=False)
+
+class MicroBatchConsumer(ConcurrentConsumer):
+    """
+    Accumulates deliveries until MICROBATCH_MAX_REPORTS reports or
+    MICROBATCH_MAX_WAIT_MS have passed, whichever comes first, then runs
+    the whole window through run_pipeline_batch on the worker pool.
+
+    - One combined processed_cluster (and alerts) message per window
+    - Every delivery in the window is settled only once the window's
+      outputs are published; if the window fails, each of its
+      deliveries goes to its retry tier
+    - Windows are filled from the LaneScheduler when a worker is free;
+      a high-lane delivery closes the window immediately
+    """
+
+    def __init__(
+        self,
+        max_reports: int = MICROBATCH_MAX_REPORTS,
+        max_wait_ms: int = MICROBATCH_MAX_WAIT_MS,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.max_reports = max(1, max_reports)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        # The broker must be allowed to send a full window
+        self.prefetch = max(self.prefetch, self.max_reports)
+        self.high_watermark = max(self.high_watermark, self.prefetch * len(self.lanes))
+        self.low_watermark = max(1, self.high_watermark // 2)
+
+        self._buffered_reports = 0
+        self._timer = None
+
+    # ---- connection thread ----
+    def _on_message(self, ch, method, properties, body, lane: str = priority_lanes.NORMAL):
+        _observe_queue_lag(properties)
+        delivery = Delivery(method, properties, body, lane)
+        msgs = decode_body(body, properties.content_type)
+        if not msgs:
+            # Malformed (dead-lettered) / empty (acked): nothing to batch
+            settle_delivery(ch, delivery, [], MALFORMED if msgs is None else None)
             return
+        delivery.msgs = msgs
+        self._inflight += 1
+        metrics.MESSAGES_INFLIGHT.set(self._inflight)
+        self._scheduler.push(lane, delivery)
+        self._buffered_reports += len(msgs)
+
+        if lane == priority_lanes.HIGH:
+            self._flush()
+        elif self._buffered_reports >= self.max_reports:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = self.conn.call_later(self.max_wait, self._on_timer)
+
+        if self._inflight >= self.high_watermark:
+            self._pause()
+
+    def _on_timer(self):
+        self._timer = None
+        self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self.conn.remove_timeout(self._timer)
+            self._timer = None
+        self._dispatch(partial=True)
+
+    def _dispatch(self, partial: bool = False):
+        """
+        Start windows while workers are free: full ones only, unless
+        partial (timer expired / high-lane arrival).
+        """
+        while self._busy < self.workers and self._scheduler and (
+            partial or self._buffered_reports >= self.max_reports
+        ):
+            window: List[Delivery] = []
+            count = 0
+            while count < self.max_reports:
+                picked = self._scheduler.pop()
+                if picked is None:
+                    break
+                window.append(picked[1])
+                count += len(picked[1].msgs)
+            self._buffered_reports -= count
+            self._busy += 1
+            self._pool.submit(self._work_batch, window)
+        self._report_buffered()
+
+        if self._scheduler and self._timer is None:
+            self._timer = self.conn.call_later(self.max_wait, self._on_timer)
+
+    def _finish_batch(self, window: List[Delivery], outputs, failed, error):
+        self._inflight -= len(window)
+        self._busy -= 1
+        metrics.MESSAGES_INFLIGHT.set(self._inflight)
+        if outputs is not None:
+            publish_outputs(*outputs)
+
+        # failed indexes the concatenated window; split it per delivery
+        offset = 0
+        for delivery in window:
+            end = offset + len(delivery.msgs)
+            mine = [(i - offset, stages, reason) for i, stages, reason in failed if offset <= i < end]
+            settle_delivery(self.ch, delivery, mine, error)
+            offset = end
+
+        self._dispatch(partial=self._stopping)
+        self._maybe_resume()
+
+    def stop(self):
+        super().stop()
+        # No more deliveries will fill the open window
+        self._flush()
+
+    # ---- worker threads ----
+    def _work_batch(self, window: List[Delivery]):
+        outputs, failed, error = None, [], None
+        try:
+            outputs, failed = process_messages(
+                [m for d in window for m in d.msgs],
+                [d.final for d in window for _ in d.msgs],
+            )
+        except Exception as e:
+            error = e
 
-        reports = []
+        self.conn.add_callback_threadsafe(
+            functools.partial(self._finish_batch, window, outputs, failed, error)
+        )
 
-        if isinstance(msg, dict):
-            reports.append(run_full_pipeline(msg))
+    def run(self):
+        print(
+            f"[+] Micro-batching up to {self.max_reports} reports "
+            f"or {int(self.max_wait * 1000)} ms"
+        )
+        return super().run()
 
-        elif isinstance(msg, list):
-            for item in msg:
-                if isinstance(item, dict):
-                    reports.append(run_full_pipeline(item))
+# ------------------------------
+# Warm-up
+# ------------------------------
+def _warmup_tasks() -> Dict[str, Any]:
+    tasks: Dict[str, Any] = {
+        # The async engine builds its own AsyncOpenAI; the import is shared
+        "openai": openai_retryable if CONSUMER_MODE == "async" else get_openai_client,
+        "vision": get_vision_batcher().warm_up,
+    }
+    if phash_index is not None:
+        tasks["phash"] = phash_index.open
+    if relevance_classifier is not None:
+        tasks["relevance_model"] = relevance_classifier.load
+    return tasks
 
-        if reports:
-            write_outputs(reports)
-            send_files_to_queues()
 
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+def _warm(name: str, fn) -> None:
+    try:
+        fn()
+    except Exception as e:
+        print(f"[warmup] {name} failed: {e}")
+        return
+    startup.mark(f"warmup.{name}")
 
-    ch.basic_qos(prefetch_count=1)
-    ch.basic_consume(queue=INPUT_QUEUE, on_message_callback=_callback)
 
-    print(f"[+] Listening on '{INPUT_QUEUE}' (waiting for messages)")
-    ch.start_consuming()
+def warm_up(max_wait: float = WARMUP_MAX_WAIT_SECONDS) -> None:
+    """
+    Runs before the consumer takes its first message:
+    - fails fast on missing provider keys
+    - wires up the metrics (install_metrics)
+    - imports / builds the provider clients, opens the pHash index and
+      loads the relevance model, all in parallel
+    Anything still running after max_wait seconds finishes in the
+    background; every piece is lazily initialised under a lock, so a
+    report that needs it early simply waits for it.
+    """
+    require_keys()
+    install_metrics()
+    if WARMUP_ENABLED:
+        threads = [
+            threading.Thread(target=_warm, args=(name, fn), name=f"warmup-{name}", daemon=True)
+            for name, fn in _warmup_tasks().items()
+        ]
+        deadline = time.monotonic() + max(0.0, max_wait)
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        pending = [t.name[len("warmup-"):] for t in threads if t.is_alive()]
+        if pending:
+            print(f"[warmup] still running in the background: {', '.join(pending)}")
+    startup.mark("warmup")
+
+
+def consumer_ready() -> None:
+    """
+    Called by every consumer mode just before it starts consuming.
+    """
+    startup.mark("ready")
+    if STARTUP_REPORT_ENABLED:
+        startup.stop_tracking()
+        startup.report()
+
 
 # ------------------------------
 # Entrypoint
 # ------------------------------
 def main():
+    metrics.start_metrics_server()
     start_rabbit_consumer()
 
+
+def init_worker(worker_id: int, workers: int) -> None:
+    """
+    Per-process setup in a forked worker:
+    - own snapshot files (FINAL_FILENAME / ALERT_FILENAME get a .wN suffix)
+    - own metrics port (METRICS_PORT + worker_id)
+    - math-library threads pinned, provider quotas split across workers
+    RabbitMQ connections, the stage pool and the publisher are all created
+    lazily, so each worker gets its own.
+    """
+    global FINAL_FILENAME, ALERT_FILENAME, snapshot_sink
+    FINAL_FILENAME = prefork.worker_path(FINAL_FILENAME, worker_id)
+    ALERT_FILENAME = prefork.worker_path(ALERT_FILENAME, worker_id)
+    if OUTPUT_SNAPSHOTS:
+        # The parent's writer thread did not survive fork()
+        snapshot_sink = SnapshotSink()
+
+    prefork.pin_threads(prefork.threads_per_worker(workers))
+    share_quota(workers)
+    if metrics.METRICS_PORT > 0:
+        metrics.start_metrics_server(metrics.METRICS_PORT + worker_id)
+
+
+def main_prefork(workers: int = prefork.PREFORK_WORKERS) -> None:
+    """
+    Supervisor entry point (PREFORK_WORKERS > 0): load the read-only
+    state once, then fork and babysit the consumer workers.
+    """
+    require_keys()
+    # Imported / loaded here once and shared copy-on-write; clients that
+    # own sockets or threads (OpenAI, Vision) are built by each worker's
+    # warm_up()
+    openai_retryable()
+    if phash_index is not None:
+        phash_index.open()
+    if relevance_classifier is not None:
+        # Load on one thread so no OpenMP pool exists at fork time; the
+        # weights are then shared copy-on-write by every worker
+        prefork.pin_threads(1)
+        relevance_classifier.load()
+    prefork.freeze_shared()
+
+    def _worker(worker_id: int) -> None:
+        init_worker(worker_id, workers)
+        start_rabbit_consumer()
+
+    print(f"[+] Pre-forking {workers} workers")
+    sys.exit(prefork.Supervisor(workers, _worker).run())
+
+
+startup.mark("import")
+
 if __name__ == "__main__":
-    main()
+    if prefork.PREFORK_WORKERS > 0:
+        main_prefork()
+    else:
+        main()
@@ -0,0 +1,386 @@
+"""
+media_fetch.py
+
+Media prefetch stage with content-type sniffing and a content-addressed
+on-disk blob cache.
+
+ - Streaming download over a pooled requests.Session, with a size cap and
+   a wall-clock bound on the whole fetch
+ - Only public addresses are fetched: every hop (redirects are followed
+   by hand) is resolved and loopback/private/link-local/metadata hosts
+   are refused
+ - Real type sniffed from magic bytes, not the URL or Content-Type
+ - Payload stored once under its sha256 (blobs/ab/cd/<sha256>) and read
+   back through mmap; URL → blob mapping kept alongside with a TTL
+ - Periodic sweep drops expired URL records and evicts least-recently-used
+   blobs beyond the disk budget
+ - Media tagged image | video | other | unavailable so image-only stages
+   can be skipped for non-images
+"""
+
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MEDIA_PREFETCH_ENABLED = os.getenv("MEDIA_PREFETCH_ENABLED", "true").lower() == "true"
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "10"))
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", str(24 * 3600)))
+MEDIA_POOL_SIZE = int(os.getenv("MEDIA_POOL_SIZE", "32"))
+MEDIA_MAX_REDIRECTS = int(os.getenv("MEDIA_MAX_REDIRECTS", "5"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# New blobs written between eviction sweeps
+MEDIA_CACHE_EVICT_EVERY = int(os.getenv("MEDIA_CACHE_EVICT_EVERY", "200"))
+
+SNIFF_BYTES = 64
+_CHUNK = 64 * 1024
+
+# Hosts whose pages are videos even though the payload is HTML
+VIDEO_HOSTS = ("youtube.com", "youtu.be", "vimeo.com", "dailymotion.com")
+
+
+# ------------------------------
+# Sniffing
+# ------------------------------
+def sniff(head: bytes) -> Dict[str, str]:
+    """
+    {"kind": image|video|other, "mime": ...} from the first bytes.
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return {"kind": "image", "mime": "image/jpeg"}
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return {"kind": "image", "mime": "image/png"}
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return {"kind": "image", "mime": "image/gif"}
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return {"kind": "image", "mime": "image/webp"}
+    if head.startswith(b"BM"):
+        return {"kind": "image", "mime": "image/bmp"}
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return {"kind": "image", "mime": "image/tiff"}
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"heic", b"heix", b"mif1", b"msf1"):
+            return {"kind": "image", "mime": "image/heic"}
+        if brand in (b"avif", b"avis"):
+            return {"kind": "image", "mime": "image/avif"}
+        if brand == b"qt  ":
+            return {"kind": "video", "mime": "video/quicktime"}
+        return {"kind": "video", "mime": "video/mp4"}
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return {"kind": "video", "mime": "video/webm"}
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return {"kind": "video", "mime": "video/x-msvideo"}
+    if head.startswith(b"FLV"):
+        return {"kind": "video", "mime": "video/x-flv"}
+
+    text = head.lstrip().lower()
+    if text.startswith((b"<!doctype html", b"<html", b"<head")):
+        return {"kind": "other", "mime": "text/html"}
+    return {"kind": "other", "mime": "application/octet-stream"}
+
+
+def _is_video_host(url: str) -> bool:
+    host = (urlparse(url).hostname or "").lower()
+    return any(host == h or host.endswith("." + h) for h in VIDEO_HOSTS)
+
+
+# ------------------------------
+# Address guard
+# ------------------------------
+class UnsafeURL(ValueError):
+    """
+    URL points somewhere the fetcher must not go (non-http, private address).
+    """
+
+
+def _resolve(host: str) -> Set[str]:
+    return {info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)}
+
+
+def check_url(url: str) -> None:
+    """
+    Raise UnsafeURL unless url is http(s) and every address its host
+    resolves to is public (no loopback, private, link-local - which covers
+    the 169.254.169.254 metadata endpoint - multicast or reserved ranges).
+    """
+    parts = urlparse(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeURL(f"unsupported url: {url!r}")
+    for addr in _resolve(parts.hostname):
+        ip = ipaddress.ip_address(addr.split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise UnsafeURL(f"blocked address {ip} for host {parts.hostname}")
+
+
+# ------------------------------
+# Blob cache
+# ------------------------------
+class MediaFetcher:
+    def __init__(
+        self,
+        cache_dir: str = MEDIA_CACHE_DIR,
+        max_bytes: int = MEDIA_MAX_BYTES,
+        timeout: float = MEDIA_FETCH_TIMEOUT,
+        url_ttl: int = MEDIA_URL_TTL,
+        pool_size: int = MEDIA_POOL_SIZE,
+        max_cache_bytes: int = MEDIA_CACHE_MAX_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.url_ttl = url_ttl
+        self.max_cache_bytes = max_cache_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._evict_lock = threading.Lock()
+
+        # Nothing touches cache_dir until the first write (_atomic_write
+        # creates the directories)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers["User-Agent"] = "coastguard-nlp-engine/1.0"
+        self._counter_lock = threading.Lock()
+
+    # ---- paths ----
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", sha256[:2], sha256[2:4], sha256)
+
+    def _url_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "urls", key[:2], key + ".json")
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _bump(self, name: str) -> None:
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # ---- URL mapping ----
+    def _lookup_url(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._url_path(url), "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - info.get("fetched_at", 0) > self.url_ttl:
+            return None
+        if info.get("sha256"):
+            # Blob mtime is the LRU stamp for evict()
+            try:
+                os.utime(self.blob_path(info["sha256"]))
+            except OSError:
+                return None
+        return info
+
+    def _remember_url(self, url: str, info: Dict[str, Any]) -> None:
+        try:
+            self._atomic_write(self._url_path(url), json.dumps(info).encode("utf-8"))
+        except OSError:
+            pass
+
+    # ------------------------------
+    # Public API
+    # ------------------------------
+    def fetch(
+        self, url: Optional[str], timeout: Optional[float] = None, cached_only: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Prefetch one media URL. Returns
+        {"url", "kind", "mime", "size", "sha256", "cached", ["error"]}.
+        sha256 is only set for payloads stored in the blob cache.
+        timeout: download timeout (default: the fetcher's)
+        cached_only: never download; a miss comes back with skipped="not_cached"
+        """
+        if not isinstance(url, str) or not url:
+            return {"url": url, "kind": "unavailable", "mime": None, "size": 0, "sha256": None, "cached": False}
+
+        info = self._lookup_url(url)
+        if info is not None:
+            self._bump("hits")
+            return dict(info, url=url, cached=True)
+        self._bump("misses")
+        if cached_only:
+            return {"url": url, "kind": "unavailable", "mime": None, "size": 0, "sha256": None,
+                    "cached": False, "skipped": "not_cached"}
+
+        info = self._download(url, timeout or self.timeout)
+        info["fetched_at"] = time.time()
+        if info["kind"] != "unavailable":
+            self._remember_url(url, info)
+        return dict(info, url=url, cached=False)
+
+    def _open(self, url: str, deadline: float) -> requests.Response:
+        """
+        GET url, following redirects by hand so every hop passes check_url.
+        """
+        for _ in range(MEDIA_MAX_REDIRECTS + 1):
+            check_url(url)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout(f"media fetch exceeded its deadline: {url}")
+            resp = self._session.get(url, stream=True, timeout=remaining, allow_redirects=False)
+            if not resp.is_redirect:
+                return resp
+            location = resp.headers.get("Location", "")
+            resp.close()
+            url = urljoin(url, location)
+        raise requests.TooManyRedirects(f"more than {MEDIA_MAX_REDIRECTS} redirects")
+
+    def _download(self, url: str, timeout: float) -> Dict[str, Any]:
+        info: Dict[str, Any] = {"kind": "unavailable", "mime": None, "size": 0, "sha256": None}
+        # requests' timeout is per socket read; this bounds the whole fetch
+        deadline = time.monotonic() + timeout
+        try:
+            with self._open(url, deadline) as resp:
+                resp.raise_for_status()
+
+                declared = resp.headers.get("Content-Length")
+                chunks = []
+                size = 0
+                digest = hashlib.sha256()
+                sniffed = None
+
+                for chunk in resp.iter_content(_CHUNK):
+                    if time.monotonic() > deadline:
+                        info.update(kind="unavailable", size=size, error="timeout")
+                        return info
+                    if not chunk:
+                        continue
+                    if sniffed is None:
+                        sniffed = sniff(chunk[:SNIFF_BYTES])
+                        info.update(sniffed)
+                        if sniffed["kind"] == "other" and _is_video_host(url):
+                            info["kind"] = "video"
+                        # Only images are needed downstream; don't pull videos
+                        if info["kind"] != "image":
+                            info["size"] = int(declared) if declared and declared.isdigit() else None
+                            return info
+                        if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                            info.update(kind="image", size=int(declared), error="too_large")
+                            return info
+
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        info.update(size=size, error="too_large")
+                        return info
+                    digest.update(chunk)
+                    chunks.append(chunk)
+
+                if sniffed is None:
+                    info["error"] = "empty"
+                    return info
+
+                sha = digest.hexdigest()
+                path = self.blob_path(sha)
+                if not os.path.exists(path):
+                    self._atomic_write(path, b"".join(chunks))
+                    self._maybe_evict()
+                info.update(size=size, sha256=sha)
+                return info
+        except UnsafeURL as e:
+            info["error"] = str(e)
+            return info
+        except Exception as e:
+            info["error"] = str(e)
+            if _is_video_host(url):
+                info["kind"] = "video"
+            return info
+
+
+    def open_blob(self, sha256: str) -> Optional[mmap.mmap]:
+        """
+        Read-only mmap of a cached payload (caller closes it).
+        """
+        try:
+            with open(self.blob_path(sha256), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    # ------------------------------
+    # Eviction
+    # ------------------------------
+    def _maybe_evict(self) -> None:
+        with self._counter_lock:
+            self._writes_since_evict += 1
+            if self._writes_since_evict < MEDIA_CACHE_EVICT_EVERY:
+                return
+            self._writes_since_evict = 0
+        self.evict()
+
+    @staticmethod
+    def _walk(root: str) -> List[str]:
+        return [os.path.join(d, name) for d, _, names in os.walk(root) for name in names]
+
+    def evict(self) -> Dict[str, int]:
+        """
+        Drop URL records older than url_ttl, then delete least-recently-used
+        blobs (by mtime) until the blob store fits max_cache_bytes.
+        A sweep already in progress in another thread is not repeated.
+        """
+        removed = {"urls": 0, "blobs": 0}
+        if not self._evict_lock.acquire(blocking=False):
+            return removed
+        try:
+            cutoff = time.time() - self.url_ttl
+            for path in self._walk(os.path.join(self.cache_dir, "urls")):
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        removed["urls"] += 1
+                except OSError:
+                    pass
+
+            blobs = []
+            for path in self._walk(os.path.join(self.cache_dir, "blobs")):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                blobs.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in blobs)
+            for _, size, path in sorted(blobs):
+                if total <= self.max_cache_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                removed["blobs"] += 1
+        finally:
+            self._evict_lock.release()
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,319 @@
+"""
+metrics.py
+
+Minimal in-process metrics for the NLP pipeline, exposed in the
+Prometheus text format on a local HTTP endpoint.
+
+ - Counter / Gauge / Histogram with label support
+ - Callback gauges, evaluated at scrape time (cache hit rates, ...)
+ - No third-party dependency; thread-safe
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0,
+)
+
+LabelKey = Tuple[str, ...]
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelKey, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(v)}" for k, v in items
+        ]
+
+
+class CallbackGauge(_Metric):
+    """
+    Gauge whose samples come from a function at scrape time.
+    fn returns {label_values_tuple: value}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Dict[LabelKey, float]], labels: Iterable[str] = ()):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            items = list(self.fn().items())
+        except Exception:
+            items = []
+        return self.header() + [
+            f"{self.name}{_fmt_labels(self.label_names, k)} {_fmt_value(v)}" for k, v in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = row
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        for key, row in items:
+            for bound, count in zip(self.buckets, row):
+                le = 'le="' + ("+Inf" if math.isinf(bound) else repr(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, key, le)} {_fmt_value(count)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, key)} {_fmt_value(row[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.label_names, key)} {_fmt_value(row[-1])}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: Dict[str, str]):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+        return False
+
+
+# ------------------------------
+# Registry
+# ------------------------------
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, doc: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, doc, labels))
+
+    def gauge(self, name: str, doc: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, doc, labels))
+
+    def histogram(self, name: str, doc: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def callback_gauge(self, name: str, doc: str, fn, labels: Iterable[str] = ()) -> CallbackGauge:
+        return self.register(CallbackGauge(name, doc, fn, labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ------------------------------
+# Pipeline metrics
+# ------------------------------
+STAGE_LATENCY = REGISTRY.histogram(
+    "nlp_stage_duration_seconds",
+    "Latency of each pipeline stage",
+    labels=("stage",),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "nlp_stage_errors_total",
+    "Stages that raised or returned an error result",
+    labels=("stage",),
+)
+PROVIDER_RETRIES = REGISTRY.counter(
+    "nlp_provider_retries_total",
+    "Retried calls to external providers",
+    labels=("provider",),
+)
+PROVIDER_ERRORS = REGISTRY.counter(
+    "nlp_provider_errors_total",
+    "Failed calls to external providers",
+    labels=("provider", "kind"),
+)
+REPORTS_PROCESSED = REGISTRY.counter(
+    "nlp_reports_processed_total",
+    "Reports that completed the pipeline",
+    labels=("tier",),
+)
+QUEUE_LAG = REGISTRY.histogram(
+    "nlp_queue_lag_seconds",
+    "Time between publish (AMQP timestamp) and consumption",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+MESSAGES_INFLIGHT = REGISTRY.gauge(
+    "nlp_messages_inflight",
+    "Deliveries received but not yet acked",
+)
+LANE_LATENCY = REGISTRY.histogram(
+    "nlp_lane_latency_seconds",
+    "Time between publish (AMQP timestamp, else receipt) and outputs published, per intake lane",
+    labels=("lane",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+LANE_BUFFERED = REGISTRY.gauge(
+    "nlp_lane_buffered",
+    "Deliveries received and waiting for a worker, per intake lane",
+    labels=("lane",),
+)
+
+
+def observe_stage(name: str, seconds: float, error: bool = False) -> None:
+    STAGE_LATENCY.observe(seconds, stage=name)
+    if error:
+        STAGE_ERRORS.inc(stage=name)
+
+
+# ------------------------------
+# HTTP endpoint
+# ------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve REGISTRY on http://host:port/metrics from a daemon thread.
+    """
+    global _server
+    if _server is not None or port <= 0:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"[WARN] metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"[+] Metrics on http://{host}:{port}/metrics")
+    return _server
@@ -0,0 +1,447 @@
+"""
+phash_index.py
+
+Local perceptual-hash index of every image the pipeline has seen.
+
+ - 64-bit pHash (DCT) or dHash computed with Pillow
+ - BK-tree for Hamming-radius lookups (near-duplicates in microseconds)
+ - Persisted in SQLite so the index survives restarts and is shared by
+   worker processes on the node (each refreshes from the store)
+ - Age-based eviction on last_seen
+ - Sightings are recorded per report (message id, else image URL), so a
+   redelivered or retried report neither matches nor counts its own
+   earlier sighting
+
+A hit means the image (or a near-duplicate) has already been uploaded
+by another report, which is what the relevance rule needs; SerpAPI is
+only consulted for images no other report has been seen with.
+"""
+
+import io
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+PHASH_ENABLED = os.getenv("PHASH_ENABLED", "true").lower() == "true"
+PHASH_ALGORITHM = os.getenv("PHASH_ALGORITHM", "phash")  # phash | dhash
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", "phash_index.sqlite3")
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+PHASH_MAX_AGE_DAYS = float(os.getenv("PHASH_MAX_AGE_DAYS", "30"))
+PHASH_REFRESH_SECONDS = float(os.getenv("PHASH_REFRESH_SECONDS", "5"))
+PHASH_EVICT_INTERVAL = float(os.getenv("PHASH_EVICT_INTERVAL", "3600"))
+
+
+# ------------------------------
+# Hashing
+# ------------------------------
+_DCT_N = 32
+_DCT_K = 8
+_COS = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_N)) for x in range(_DCT_N)]
+    for u in range(_DCT_K)
+]
+
+
+def _load_gray(data, size: Tuple[int, int]):
+    """
+    data: raw bytes, or a seekable file-like object (e.g. an mmap'd blob).
+    """
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+    img.draft("L", size)  # lets JPEG decode at reduced scale
+    return img.convert("L").resize(size, Image.LANCZOS)
+
+
+def dhash(data: bytes) -> int:
+    """
+    Difference hash: 9x8 grayscale, compare horizontal neighbours.
+    """
+    img = _load_gray(data, (9, 8))
+    px = list(img.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = px[row * 9 + col]
+            right = px[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def phash(data: bytes) -> int:
+    """
+    DCT hash: 32x32 grayscale, keep the 8x8 lowest frequencies,
+    threshold against their median (DC term excluded).
+    """
+    img = _load_gray(data, (_DCT_N, _DCT_N))
+    px = list(img.getdata())
+    rows = [px[r * _DCT_N:(r + 1) * _DCT_N] for r in range(_DCT_N)]
+
+    # Separable 2D DCT-II, only the first 8 coefficients per axis
+    tmp = [[sum(c * v for c, v in zip(_COS[u], row)) for u in range(_DCT_K)] for row in rows]
+    coeffs = []
+    for v in range(_DCT_K):
+        for u in range(_DCT_K):
+            coeffs.append(sum(_COS[v][y] * tmp[y][u] for y in range(_DCT_N)))
+
+    ac = sorted(coeffs[1:])
+    median = (ac[len(ac) // 2 - 1] + ac[len(ac) // 2]) / 2
+    value = 0
+    for c in coeffs:
+        value = (value << 1) | (1 if c > median else 0)
+    return value
+
+
+def image_hash(data: bytes, algorithm: str = PHASH_ALGORITHM) -> int:
+    return dhash(data) if algorithm == "dhash" else phash(data)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# ------------------------------
+# BK-tree
+# ------------------------------
+class BKTree:
+    """
+    Metric tree over Hamming distance. Nodes are [hash, {distance: child}].
+    """
+
+    def __init__(self):
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, h: int) -> None:
+        if self._root is None:
+            self._root = [h, {}]
+            self.size = 1
+            return
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [h, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, h: int, radius: int) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (hash, distance) for every stored hash within radius.
+        """
+        if self._root is None:
+            return
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                yield node[0], d
+            lo, hi = d - radius, d + radius
+            for cd, child in node[1].items():
+                if lo <= cd <= hi:
+                    stack.append(child)
+
+
+# ------------------------------
+# Persistent index
+# ------------------------------
+def _to_signed(h: int) -> int:
+    # SQLite INTEGER is signed 64-bit
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def _to_unsigned(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+# A SQLite connection must never cross fork(): one hook for every index,
+# children open their own connections
+_instances: "weakref.WeakSet[PHashIndex]" = weakref.WeakSet()
+
+
+def _drop_all_connections() -> None:
+    for index in list(_instances):
+        index._drop_connections()
+
+
+os.register_at_fork(after_in_child=_drop_all_connections)
+
+
+class PHashIndex:
+    def __init__(
+        self,
+        path: str = PHASH_INDEX_PATH,
+        max_distance: int = PHASH_MAX_DISTANCE,
+        max_age_days: float = PHASH_MAX_AGE_DAYS,
+        refresh_seconds: float = PHASH_REFRESH_SECONDS,
+    ):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_age = max_age_days * 24 * 3600
+        self.refresh_seconds = refresh_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        _instances.add(self)
+        self._tree = BKTree()
+        self._last_rowid = 0
+        self._last_refresh = 0.0
+        self._last_evict = 0.0
+        self._opened = False
+
+    def open(self) -> None:
+        """
+        Create the schema and load the BK-tree from disk. Done on first
+        use, or ahead of time by the warm-up hook.
+        """
+        if self._opened:
+            return
+        with self._lock:
+            if not self._opened:
+                self._init_schema()
+                self.evict()
+                self._opened = True
+
+    def _drop_connections(self) -> None:
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS phash_index ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " hash INTEGER NOT NULL UNIQUE,"
+            " image_url TEXT,"
+            " first_seen REAL NOT NULL,"
+            " last_seen REAL NOT NULL,"
+            " seen_count INTEGER NOT NULL DEFAULT 1,"
+            " reverse_search TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS phash_last_seen ON phash_index(last_seen)")
+        # seen_count above is the number of distinct sightings
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS phash_sightings ("
+            " hash INTEGER NOT NULL,"
+            " sighting TEXT NOT NULL,"
+            " image_url TEXT,"
+            " seen_at REAL NOT NULL,"
+            " PRIMARY KEY (hash, sighting))"
+        )
+
+    # ------------------------------
+    # Tree maintenance
+    # ------------------------------
+    def _refresh(self, force: bool = False) -> None:
+        """
+        Pull rows added by other processes since the last refresh.
+        """
+        now = time.time()
+        if not force and now - self._last_refresh < self.refresh_seconds:
+            return
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT id, hash FROM phash_index WHERE id > ? ORDER BY id", (self._last_rowid,)
+            ).fetchall()
+            for rowid, h in rows:
+                self._tree.add(_to_unsigned(h))
+                self._last_rowid = rowid
+            self._last_refresh = now
+
+    def evict(self) -> int:
+        """
+        Drop entries not seen within max_age and rebuild the tree
+        (BK-trees do not support deletion).
+        """
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            conn = self._conn()
+            removed = conn.execute("DELETE FROM phash_index WHERE last_seen < ?", (cutoff,)).rowcount
+            conn.execute("DELETE FROM phash_sightings WHERE seen_at < ?", (cutoff,))
+            self._tree = BKTree()
+            self._last_rowid = 0
+            self._refresh(force=True)
+            self._last_evict = time.time()
+        return removed
+
+    # ------------------------------
+    # Public API
+    # ------------------------------
+    def lookup(self, h: int, sighting: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Nearest image within max_distance seen by another report, or None.
+        sighting: this report's key; its own earlier sightings are not
+        counted (seen_count) and do not make a hit on their own.
+        """
+        self.open()
+        self._refresh()
+        with self._lock:
+            candidates = sorted(self._tree.search(h, self.max_distance), key=lambda c: c[1])
+
+        conn = self._conn()
+        for other, d in candidates:
+            row = conn.execute(
+                "SELECT image_url, first_seen, seen_count, reverse_search FROM phash_index WHERE hash = ?",
+                (_to_signed(other),),
+            ).fetchone()
+            if row is None:
+                # Evicted by another process since our last refresh
+                continue
+            image_url, first_seen, seen_count, reverse_search = row
+            if sighting is not None:
+                own = conn.execute(
+                    "SELECT 1 FROM phash_sightings WHERE hash = ? AND sighting = ?",
+                    (_to_signed(other), sighting),
+                ).fetchone()
+                if own is not None:
+                    seen_count -= 1
+                    prior = conn.execute(
+                        "SELECT image_url FROM phash_sightings WHERE hash = ? AND sighting != ? "
+                        "ORDER BY seen_at DESC LIMIT 1",
+                        (_to_signed(other), sighting),
+                    ).fetchone()
+                    image_url = prior[0] if prior else image_url
+            if seen_count <= 0:
+                continue
+
+            self.hits += 1
+            return {
+                "hash": f"{other:016x}",
+                "distance": d,
+                "image_url": image_url,
+                "first_seen": first_seen,
+                "seen_count": seen_count,
+                "reverse_search": json.loads(reverse_search) if reverse_search else None,
+            }
+
+        self.misses += 1
+        return None
+
+    def add(
+        self,
+        h: int,
+        image_url: Optional[str],
+        reverse_search: Optional[Dict[str, Any]] = None,
+        sighting: Optional[str] = None,
+    ) -> None:
+        """
+        Record a sighting of an image; bumps last_seen, and seen_count
+        unless this sighting key was already recorded for the hash.
+        """
+        self.open()
+        now = time.time()
+        if now - self._last_evict > PHASH_EVICT_INTERVAL:
+            self.evict()
+
+        rs = json.dumps(reverse_search) if reverse_search else None
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO phash_index(hash, image_url, first_seen, last_seen, seen_count, reverse_search) "
+                    "VALUES(?, ?, ?, ?, 0, ?) "
+                    "ON CONFLICT(hash) DO UPDATE SET last_seen = excluded.last_seen, "
+                    " reverse_search = COALESCE(excluded.reverse_search, reverse_search)",
+                    (_to_signed(h), image_url, now, now, rs),
+                )
+                self._record_sighting(conn, h, sighting, image_url, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            return
+        with self._lock:
+            self._tree.add(h)
+
+    def touch(self, h: int, sighting: Optional[str] = None, image_url: Optional[str] = None) -> None:
+        """
+        Record a sighting of an already indexed hash (a lookup hit).
+        """
+        self.open()
+        now = time.time()
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = conn.execute(
+                    "UPDATE phash_index SET last_seen = ? WHERE hash = ?", (now, _to_signed(h))
+                ).rowcount
+                if updated:
+                    self._record_sighting(conn, h, sighting, image_url, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            pass
+
+    def _record_sighting(
+        self, conn: sqlite3.Connection, h: int, sighting: Optional[str], image_url: Optional[str], now: float
+    ) -> None:
+        """
+        seen_count counts distinct sightings; without a key every call is
+        a new one.
+        """
+        new = True
+        if sighting is not None:
+            new = conn.execute(
+                "INSERT OR IGNORE INTO phash_sightings(hash, sighting, image_url, seen_at) VALUES(?, ?, ?, ?)",
+                (_to_signed(h), sighting, image_url, now),
+            ).rowcount == 1
+            if not new:
+                conn.execute(
+                    "UPDATE phash_sightings SET seen_at = ? WHERE hash = ? AND sighting = ?",
+                    (now, _to_signed(h), sighting),
+                )
+        if new:
+            conn.execute(
+                "UPDATE phash_index SET seen_count = seen_count + 1 WHERE hash = ?", (_to_signed(h),)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": self._tree.size, "hits": self.hits, "misses": self.misses}
+
+
+def reverse_search_from_hit(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reverse-search result synthesised from a local index hit, in the same
+    shape serpapi_reverse_image_search returns.
+    """
+    prior = hit.get("reverse_search") or {}
+    first_seen = prior.get("first_seen") or time.strftime(
+        "%Y-%m-%dT%H:%M:%SZ", time.gmtime(hit["first_seen"])
+    )
+    return {
+        "performed": True,
+        "matches": int(prior.get("matches") or 0) + int(hit["seen_count"]),
+        "domains": prior.get("domains") or [],
+        "first_seen": first_seen,
+        "engine": "local_phash",
+        "phash": {
+            "hash": hit["hash"],
+            "distance": hit["distance"],
+            "prior_image_url": hit["image_url"],
+        },
+    }
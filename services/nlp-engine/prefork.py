@@ -0,0 +1,242 @@
+"""
+prefork.py
+
+Pre-fork process supervisor for CPU-bound pipeline work.
+
+ - The parent loads read-only state once (model weights, pHash tree),
+   freezes it out of the garbage collector and forks PREFORK_WORKERS
+   children that share those pages copy-on-write
+ - Each child pins its math-library thread pools (torch / OpenMP / MKL)
+   to PREFORK_TORCH_THREADS so N workers do not oversubscribe the cores
+ - A worker that exits is restarted, with exponential backoff when it
+   keeps crashing right after start; the restart is scheduled, so the
+   supervisor keeps reaping other workers and handling signals meanwhile
+ - SIGTERM / SIGINT are forwarded to the workers; the supervisor exits
+   once they are all gone
+ - A worker that gets SIGTERM / SIGINT stops consuming, settles the
+   deliveries it already holds, then exits; a second signal kills it
+
+The parent must not start threads or open connections before forking;
+see main_script.main_prefork for what is (and is not) done up front.
+"""
+
+import gc
+import os
+import signal
+import sys
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", "0"))
+PREFORK_TORCH_THREADS = int(os.getenv("PREFORK_TORCH_THREADS", "0"))  # 0 = cores / workers
+PREFORK_RESTART_BACKOFF_MAX = float(os.getenv("PREFORK_RESTART_BACKOFF_MAX", "30"))
+# A worker that dies sooner than this after starting counts as crash-looping
+PREFORK_MIN_UPTIME = float(os.getenv("PREFORK_MIN_UPTIME", "10"))
+
+_THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def threads_per_worker(workers: int) -> int:
+    if PREFORK_TORCH_THREADS > 0:
+        return PREFORK_TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def pin_threads(n: int) -> None:
+    """
+    Limit intra-op thread pools for this process. Libraries imported
+    later read the env vars; torch, if already imported, is told directly.
+    """
+    for name in _THREAD_ENV:
+        os.environ[name] = str(n)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(n)
+
+
+def freeze_shared() -> None:
+    """
+    Move everything allocated so far into the permanent GC generation, so
+    collections in the children never write to (and un-share) its pages.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+# ------------------------------
+# Worker shutdown
+# ------------------------------
+_stop_requested = False
+_stop_callbacks: List[Callable[[], None]] = []
+
+
+def stop_requested() -> bool:
+    """
+    True once this worker was asked to stop; consumers check it between
+    deliveries.
+    """
+    return _stop_requested
+
+
+def on_stop(callback: Callable[[], None]) -> None:
+    """
+    Run callback when the stop signal arrives (at once if it already has).
+    It runs inside the signal handler, so it may only set a flag or wake
+    an event loop.
+    """
+    _stop_callbacks.append(callback)
+    if _stop_requested:
+        callback()
+
+
+def _request_stop(signum: int, frame) -> None:
+    global _stop_requested
+    _stop_requested = True
+    # A second signal kills the worker outright
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    for callback in list(_stop_callbacks):
+        callback()
+
+
+def install_stop_handler() -> None:
+    """
+    Run in each forked worker: SIGTERM / SIGINT set the stop flag instead
+    of killing it mid-delivery.
+    """
+    global _stop_requested
+    _stop_requested = False
+    _stop_callbacks.clear()
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+
+class Supervisor:
+    def __init__(
+        self,
+        workers: int,
+        target: Callable[[int], None],
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        target(worker_id) runs in each forked child; worker ids are
+        0..workers-1 and stay stable across restarts.
+        """
+        self.workers = max(1, workers)
+        self.target = target
+        self._clock = clock
+        self.restarts = 0
+        self._children: Dict[int, int] = {}  # pid -> worker id
+        self._started: Dict[int, float] = {}  # worker id -> start time
+        self._backoff: Dict[int, float] = {}
+        self._respawn_at: Dict[int, float] = {}  # worker id -> due time
+        self._stopping = False
+
+    # ------------------------------
+    # Children
+    # ------------------------------
+    def _spawn(self, worker_id: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            install_stop_handler()
+            code = 0
+            try:
+                self.target(worker_id)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        self._children[pid] = worker_id
+        self._started[worker_id] = self._clock()
+        print(f"[prefork] worker {worker_id} started (pid {pid})")
+
+    def _on_exit(self, pid: int, status: int) -> None:
+        worker_id = self._children.pop(pid, None)
+        if worker_id is None:
+            return
+        code = os.waitstatus_to_exitcode(status)
+        print(f"[prefork] worker {worker_id} (pid {pid}) exited with {code}")
+        if self._stopping:
+            return
+
+        uptime = self._clock() - self._started.get(worker_id, 0.0)
+        if uptime < PREFORK_MIN_UPTIME:
+            delay = min(PREFORK_RESTART_BACKOFF_MAX, max(1.0, self._backoff.get(worker_id, 0.5) * 2))
+        else:
+            delay = 0.0
+        self._backoff[worker_id] = delay
+        if delay:
+            print(f"[prefork] worker {worker_id} crash-looping; restarting in {delay:.0f}s")
+        # run() spawns it once due
+        self._respawn_at[worker_id] = self._clock() + delay
+
+    def _respawn_due(self) -> Optional[float]:
+        """
+        Restart the workers whose delay is over. Returns the seconds until
+        the next scheduled restart, or None when there is none.
+        """
+        if self._stopping:
+            self._respawn_at.clear()
+            return None
+        now = self._clock()
+        for worker_id, due in sorted(self._respawn_at.items()):
+            if due <= now:
+                del self._respawn_at[worker_id]
+                self.restarts += 1
+                self._spawn(worker_id)
+        if not self._respawn_at:
+            return None
+        return max(0.0, min(self._respawn_at.values()) - self._clock())
+
+    # ------------------------------
+    # Signals
+    # ------------------------------
+    def _stop(self, signum: int, frame) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+        while True:
+            wait = self._respawn_due()
+            if not self._children and wait is None:
+                break
+            try:
+                # Block only when no restart is pending
+                pid, status = os.waitpid(-1, 0 if wait is None else os.WNOHANG)
+            except ChildProcessError:
+                if wait is None:
+                    break
+                pid, status = 0, 0
+            if pid:
+                self._on_exit(pid, status)
+            elif wait is not None:
+                time.sleep(min(wait, 0.2))
+        print(f"[prefork] all workers stopped ({self.restarts} restarts)")
+        return 0
+
+
+def worker_path(path: str, worker_id: Optional[int]) -> str:
+    """
+    "true_final_output.json" -> "true_final_output.w3.json" for worker 3.
+    """
+    if worker_id is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{worker_id}{ext}"
@@ -0,0 +1,602 @@
+"""
+provider_gateway.py
+
+Per-provider gateway in front of SerpAPI, OpenAI and Google Vision.
+
+ - Token bucket per provider (quota-aware admission, never queues forever)
+ - Retries with full-jitter exponential backoff, bounded by a per-call
+   deadline; backoff is abandoned as soon as the breaker opens
+ - Backoff and rate-limit waits never park a pipeline thread: under
+   deferred_retries() (every StageDAG stage runs under it) call() raises
+   RetryLater and the DAG re-runs the stage once the delay is up;
+   elsewhere it sleeps
+ - Circuit breaker (closed → open → half-open) so an outage fails fast
+   instead of every report waiting out the provider timeout
+ - Optional hedging (<PROVIDER>_HEDGE_ENABLED): a call still running
+   after the provider's observed pN latency gets a second identical
+   request, first answer wins; hedges draw <PROVIDER>_HEDGE_COST from a
+   per-minute budget as well as a normal rate-limit token
+ - State (breaker, tokens, rejections) exported through metrics.REGISTRY
+
+Every policy decision (admit, after_failure, hedge_delay / admit_hedge /
+race_winner, record_*) is a plain method usable from threads and
+asyncio alike; call() is the threaded driver and async_engine only adds
+the awaiting.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as wait_futures
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+import metrics
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class ProviderUnavailable(Exception):
+    """
+    Raised instead of calling the provider; reason is "circuit_open"
+    or "rate_limited". Callers mark the stage skipped.
+    """
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider}:{reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+class ProviderRetryable(Exception):
+    """
+    Raised by call functions for transient provider answers (429, 5xx).
+    """
+
+
+class RetryLater(BaseException):
+    """
+    Raised by call() under deferred_retries() instead of sleeping through
+    a backoff. A BaseException so the stages' own `except Exception`
+    fallbacks let it through to the StageDAG, which re-runs the stage
+    after `delay` seconds.
+    """
+
+    def __init__(self, provider: str, delay: float):
+        super().__init__(f"{provider}: retry in {delay:.2f}s")
+        self.provider = provider
+        self.delay = delay
+
+
+_deferral = threading.local()
+
+
+@contextmanager
+def deferred_retries(attempts: Dict[str, int]) -> Iterator[None]:
+    """
+    Within the block, call() raises RetryLater rather than sleeping
+    (retry backoff or a rate-limit wait). attempts (provider -> attempts
+    made, "<provider>:token" -> a token already reserved) is kept by the
+    caller and passed again on every re-run, so max_retries still holds
+    and no token is taken twice.
+    """
+    previous = getattr(_deferral, "attempts", None)
+    _deferral.attempts = attempts
+    try:
+        yield
+    finally:
+        _deferral.attempts = previous
+
+
+def _failure_kind(e: BaseException) -> str:
+    return "timeout" if "timeout" in type(e).__name__.lower() else "retryable"
+
+
+# ------------------------------
+# Token bucket
+# ------------------------------
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        """
+        rate: tokens per second (<= 0 disables limiting)
+        burst: bucket capacity
+        """
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float, cost: float = 1.0) -> Optional[float]:
+        """
+        Take cost tokens, possibly in the future. Returns the seconds the
+        caller must wait before using them, or None if that exceeds
+        max_wait (nothing is taken in that case).
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = 0.0 if self._tokens >= cost else (cost - self._tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self._tokens -= cost
+            return wait
+
+    def refund(self, cost: float = 1.0) -> None:
+        """
+        Give back tokens taken by a reserve() whose call was not made.
+        """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + cost)
+
+    def scale(self, factor: float) -> None:
+        """
+        Keep only this fraction of the rate and burst, e.g. 1/N in each
+        of N prefork workers sharing one provider quota.
+        """
+        with self._lock:
+            self.rate *= factor
+            self.capacity = max(1.0, self.capacity * factor)
+            self._tokens = min(self._tokens, self.capacity)
+
+    @property
+    def tokens(self) -> float:
+        if self.rate <= 0:
+            return self.capacity
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+# ------------------------------
+# Circuit breaker
+# ------------------------------
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float, half_open_probes: int = 1):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.on_transition: Optional[Callable[[str, str], None]] = None
+
+    def _set(self, state: str) -> None:
+        old, self.state = self.state, state
+        if old != state and self.on_transition is not None:
+            self.on_transition(old, state)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self._set(HALF_OPEN)
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    return False
+                self._probes += 1
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self.state != CLOSED:
+                self._set(CLOSED)
+
+    def release(self) -> None:
+        """
+        A call that says nothing about the provider's health (it answered
+        with a client error): frees its half-open probe slot, changes
+        nothing else.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set(OPEN)
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+
+# ------------------------------
+# Latency window (hedging)
+# ------------------------------
+class LatencyWindow:
+    """
+    The last `size` successful call latencies (every call through the
+    gateway), for percentile lookups.
+    """
+
+    def __init__(self, size: int):
+        self._samples: Deque[float] = deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = min(len(samples) - 1, max(0, int(round(p / 100.0 * len(samples))) - 1))
+        return samples[rank]
+
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_pool_lock = threading.Lock()
+HEDGE_POOL_WORKERS = int(os.getenv("HEDGE_POOL_WORKERS", "64"))
+
+
+def hedge_pool() -> ThreadPoolExecutor:
+    """
+    Hedged calls run both requests here so the caller can wait on them
+    with a timeout; kept apart from the stage pool that calls in.
+    """
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_WORKERS, thread_name_prefix="hedge")
+    return _hedge_pool
+
+
+# ------------------------------
+# Gateway
+# ------------------------------
+def _env(provider: str, key: str, default: str) -> str:
+    return os.getenv(f"{provider.upper()}_{key}", os.getenv(f"GATEWAY_{key}", default))
+
+
+class ProviderGateway:
+    def __init__(
+        self,
+        name: str,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+        max_queue_wait: Optional[float] = None,
+        failure_threshold: Optional[int] = None,
+        reset_seconds: Optional[float] = None,
+    ):
+        """
+        Unset arguments come from <PROVIDER>_<KEY> then GATEWAY_<KEY> env
+        vars, e.g. SERPAPI_RATE_PER_SEC, GATEWAY_BREAKER_THRESHOLD.
+        """
+        self.name = name
+        self.max_retries = max_retries if max_retries is not None else int(_env(name, "MAX_RETRIES", "2"))
+        self.backoff_base = backoff_base if backoff_base is not None else float(_env(name, "BACKOFF_BASE", "0.5"))
+        self.backoff_max = backoff_max if backoff_max is not None else float(_env(name, "BACKOFF_MAX", "8"))
+        self.max_queue_wait = (
+            max_queue_wait if max_queue_wait is not None else float(_env(name, "MAX_QUEUE_WAIT", "2"))
+        )
+        self.bucket = TokenBucket(
+            rate if rate is not None else float(_env(name, "RATE_PER_SEC", "0")),
+            burst if burst is not None else float(_env(name, "BURST", "10")),
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold if failure_threshold is not None else int(_env(name, "BREAKER_THRESHOLD", "5")),
+            reset_seconds if reset_seconds is not None else float(_env(name, "BREAKER_RESET_SECONDS", "30")),
+        )
+        self.breaker.on_transition = self._on_transition
+
+        # Hedging (see call(hedge=True)); off unless enabled per provider
+        self.hedge_enabled = _env(name, "HEDGE_ENABLED", "false").lower() == "true"
+        self.hedge_percentile = float(_env(name, "HEDGE_PERCENTILE", "95"))
+        self.hedge_min_delay = float(_env(name, "HEDGE_MIN_DELAY", "0.05"))
+        self.hedge_min_samples = int(_env(name, "HEDGE_MIN_SAMPLES", "20"))
+        # Budget units per minute; each hedge spends hedge_cost of them
+        # (e.g. SERPAPI_HEDGE_COST=1 search credit)
+        self.hedge_cost = float(_env(name, "HEDGE_COST", "1"))
+        budget = float(_env(name, "HEDGE_BUDGET_PER_MIN", "30"))
+        self.hedge_budget = TokenBucket(budget / 60.0, budget) if budget > 0 else None
+        self.latency = LatencyWindow(int(_env(name, "HEDGE_WINDOW", "200")))
+
+    def _on_transition(self, old: str, new: str) -> None:
+        BREAKER_TRANSITIONS.inc(provider=self.name, state=new)
+        print(f"[WARN] {self.name} circuit {old} -> {new}")
+
+    # ------------------------------
+    # Primitives
+    # ------------------------------
+    def admit(self, reserved: bool = False) -> float:
+        """
+        Breaker check + token reservation. Returns the seconds to wait
+        before calling; raises ProviderUnavailable to fail fast.
+        reserved: the caller already holds a token (a deferred call).
+        """
+        if not self.breaker.allow():
+            GATEWAY_REJECTIONS.inc(provider=self.name, reason="circuit_open")
+            raise ProviderUnavailable(self.name, "circuit_open")
+        if reserved:
+            return 0.0
+        wait = self.bucket.reserve(self.max_queue_wait)
+        if wait is None:
+            # No call follows, so a half-open probe slot taken by allow()
+            # must be handed back
+            self.breaker.release()
+            GATEWAY_REJECTIONS.inc(provider=self.name, reason="rate_limited")
+            raise ProviderUnavailable(self.name, "rate_limited")
+        return wait
+
+    def retry_delay(self, attempt: int) -> float:
+        """
+        Full-jitter backoff for the given (1-based) failed attempt.
+        """
+        cap = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def record_success(self) -> None:
+        self.breaker.success()
+
+    def record_failure(self, kind: str = "error") -> None:
+        metrics.PROVIDER_ERRORS.inc(provider=self.name, kind=kind)
+        self.breaker.failure()
+
+    def record_neutral(self) -> None:
+        """
+        The provider answered but the call failed anyway (4xx, bad
+        payload): neither an outage nor a success for the breaker.
+        """
+        self.breaker.release()
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Seconds after which a still-running call gets a hedge: the
+        observed hedge_percentile latency. None while hedging is off or
+        too few latencies have been seen.
+        """
+        if not self.hedge_enabled or self.hedge_budget is None or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    def admit_hedge(self) -> bool:
+        """
+        Whether a hedge may be sent right now: breaker closed, hedge_cost
+        left in this minute's budget and a rate-limit token free without
+        waiting.
+        """
+        if self.breaker.is_open:
+            return False
+        # Nothing is spent unless the hedge is actually sent
+        if self.bucket.reserve(0.0) is None:
+            HEDGES.inc(provider=self.name, outcome="rate_limited")
+            return False
+        if self.hedge_budget.reserve(0.0, self.hedge_cost) is None:
+            self.bucket.refund()
+            HEDGES.inc(provider=self.name, outcome="no_budget")
+            return False
+        HEDGES.inc(provider=self.name, outcome="sent")
+        return True
+
+    def record_hedge_result(self, hedge_won: bool) -> None:
+        HEDGES.inc(provider=self.name, outcome="hedge_won" if hedge_won else "primary_won")
+
+    def record_latency(self, seconds: float) -> None:
+        self.latency.add(seconds)
+
+    def race_winner(self, done: Iterable[Any], hedge: Any, failed: List[Any]) -> Optional[Any]:
+        """
+        First successful request among the finished ones of a hedged pair
+        (concurrent or asyncio futures), recording which one won; the
+        failed ones are appended to failed. None if all of done failed.
+        """
+        for fut in done:
+            if fut.exception() is None:
+                self.record_hedge_result(fut is hedge)
+                return fut
+            failed.append(fut)
+        return None
+
+    def after_failure(
+        self,
+        e: BaseException,
+        attempt: int,
+        retry_on: Tuple[Type[BaseException], ...],
+        deadline: Optional[float] = None,
+    ) -> Optional[float]:
+        """
+        Bookkeeping for a failed (1-based) attempt. Returns the backoff
+        before the next attempt, or None when e is to be raised:
+         - retry_on errors count against the breaker and are retried while
+           attempts, the breaker and the deadline allow
+         - other errors mean the provider answered (4xx, bad payload):
+           not an outage
+         - anything else (cancellation) hands back a half-open probe slot
+        """
+        if isinstance(e, retry_on):
+            self.record_failure(_failure_kind(e))
+            delay = self.retry_delay(attempt)
+            if (
+                attempt > self.max_retries
+                or self.breaker.is_open
+                or (deadline is not None and time.monotonic() + delay >= deadline)
+            ):
+                return None
+            metrics.PROVIDER_RETRIES.inc(provider=self.name)
+            return delay
+        if isinstance(e, Exception):
+            self.record_neutral()
+        else:
+            self.breaker.release()
+        return None
+
+    # ------------------------------
+    # Threaded helper
+    # ------------------------------
+    def _timed(self, fn: Callable[[], Any]) -> Any:
+        t0 = time.monotonic()
+        result = fn()
+        self.record_latency(time.monotonic() - t0)
+        return result
+
+    def _hedged(self, fn: Callable[[], Any], delay: float) -> Any:
+        """
+        Both requests run on the hedge pool. The loser cannot be
+        interrupted; it finishes in the background and is dropped.
+        """
+        pool = hedge_pool()
+        primary = pool.submit(self._timed, fn)
+        done, _ = wait_futures([primary], timeout=delay)
+        if done or not self.admit_hedge():
+            return primary.result()
+
+        hedge = pool.submit(self._timed, fn)
+        pending = {primary, hedge}
+        failed: List[Future] = []
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            winner = self.race_winner(done, hedge, failed)
+            if winner is not None:
+                return winner.result()
+        # Both failed: raise the first error
+        return failed[0].result()
+
+    def _attempt(self, fn: Callable[[], Any], hedge: bool) -> Any:
+        delay = self.hedge_delay() if hedge else None
+        if delay is not None:
+            return self._hedged(fn, delay)
+        # Every call feeds the latency window, not only hedgeable ones,
+        # so the hedge delay reflects the provider's real latency
+        return self._timed(fn)
+
+    def call(
+        self,
+        fn: Callable[[], Any],
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        deadline: Optional[float] = None,
+        hedge: bool = False,
+    ) -> Any:
+        """
+        Run fn() through the gateway. Exceptions in retry_on are retried
+        up to max_retries times; anything else is raised immediately.
+        deadline: time.monotonic() value after which no retry is started.
+        hedge: fn is idempotent and may be sent twice when the provider
+        has hedging enabled.
+        Under deferred_retries() a retry or a rate-limit wait raises
+        RetryLater instead of sleeping; the attempt count and a reserved
+        token are carried in the caller's dict.
+        """
+        deferred = getattr(_deferral, "attempts", None)
+        attempt = deferred.get(self.name, 0) if deferred is not None else 0
+        token_key = f"{self.name}:token"
+        while True:
+            wait = self.admit(reserved=deferred is not None and deferred.pop(token_key, 0) > 0)
+            if wait:
+                if deferred is not None:
+                    # The token is ours; come back once it is due
+                    self.breaker.release()
+                    deferred[token_key] = 1
+                    raise RetryLater(self.name, wait)
+                time.sleep(wait)
+            attempt += 1
+            try:
+                result = self._attempt(fn, hedge)
+            except BaseException as e:
+                delay = self.after_failure(e, attempt, retry_on, deadline)
+                if delay is None:
+                    raise
+                if deferred is not None:
+                    deferred[self.name] = attempt
+                    raise RetryLater(self.name, delay)
+                time.sleep(delay)
+                continue
+            self.record_success()
+            return result
+
+
+_gateways: Dict[str, ProviderGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(name: str) -> ProviderGateway:
+    gw = _gateways.get(name)
+    if gw is None:
+        with _gateways_lock:
+            gw = _gateways.get(name)
+            if gw is None:
+                gw = ProviderGateway(name)
+                _gateways[name] = gw
+    return gw
+
+
+def share_quota(processes: int) -> None:
+    """
+    Split every gateway's rate limit and hedge budget across this many
+    processes.
+    """
+    for gw in list(_gateways.values()):
+        gw.bucket.scale(1.0 / max(1, processes))
+        if gw.hedge_budget is not None:
+            gw.hedge_budget.scale(1.0 / max(1, processes))
+
+
+def skipped_result(e: ProviderUnavailable) -> Dict[str, Any]:
+    return {"skipped": e.reason, "provider": e.provider}
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+GATEWAY_REJECTIONS = metrics.REGISTRY.counter(
+    "nlp_provider_rejections_total",
+    "Calls refused by the provider gateway without reaching the provider",
+    labels=("provider", "reason"),
+)
+BREAKER_TRANSITIONS = metrics.REGISTRY.counter(
+    "nlp_provider_circuit_transitions_total",
+    "Circuit breaker state changes",
+    labels=("provider", "state"),
+)
+metrics.REGISTRY.callback_gauge(
+    "nlp_provider_circuit_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    lambda: {(n,): _STATE_VALUE[g.breaker.state] for n, g in list(_gateways.items())},
+    labels=("provider",),
+)
+HEDGES = metrics.REGISTRY.counter(
+    "nlp_provider_hedges_total",
+    "Hedged provider requests: sent, hedge_won / primary_won, or not sent (no_budget, rate_limited)",
+    labels=("provider", "outcome"),
+)
+metrics.REGISTRY.callback_gauge(
+    "nlp_provider_hedge_delay_seconds",
+    "Current hedging threshold (observed pN latency) per provider",
+    lambda: {(n,): d for n, g in list(_gateways.items()) if (d := g.hedge_delay()) is not None},
+    labels=("provider",),
+)
+metrics.REGISTRY.callback_gauge(
+    "nlp_provider_tokens_available",
+    "Tokens left in each provider's rate-limit bucket",
+    lambda: {(n,): g.bucket.tokens for n, g in list(_gateways.items())},
+    labels=("provider",),
+)
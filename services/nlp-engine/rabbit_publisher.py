@@ -0,0 +1,252 @@
+"""
+rabbit_publisher.py
+
+Long-lived RabbitMQ publisher for pipeline outputs.
+
+ - One channel reused for every publish (no per-message TCP/AMQP handshake)
+ - Can ride on the consumer's connection (heartbeats are serviced by the
+   consumer loop) or own a dedicated connection
+ - Broker acknowledgement batched per publish_batch call
+   (PUBLISH_CONFIRM_MODE=tx): the messages are sent back-to-back inside an
+   AMQP transaction and one tx.commit-ok covers all of them. pika's
+   BlockingChannel has no way to wait on several publisher confirms at
+   once; PUBLISH_CONFIRM_MODE=confirm uses them anyway, at one broker
+   round-trip per message
+ - Queues are declared once per channel, not per message
+ - Reconnects automatically and retries once on connection loss
+ - Bodies encoded with wire_codec; content_type tells consumers which codec
+
+Not thread-safe: like any pika BlockingConnection object it must only be
+used from the thread that owns the connection.
+"""
+
+import os
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import pika
+    from pika.exceptions import AMQPConnectionError, AMQPChannelError, StreamLostError
+except Exception:
+    pika = None
+
+import wire_codec
+
+# tx: one commit round-trip per batch | confirm: one confirm wait per message
+PUBLISH_CONFIRM_MODE = os.getenv("PUBLISH_CONFIRM_MODE", "tx").lower()
+
+_CONNECTION_ERRORS = (
+    (AMQPConnectionError, AMQPChannelError, StreamLostError, ConnectionError) if pika else (ConnectionError,)
+)
+
+
+class RabbitPublisher:
+    def __init__(
+        self, params: Any = None, confirm: bool = True, codec: str = "json", mode: str = PUBLISH_CONFIRM_MODE
+    ):
+        """
+        params: pika connection parameters for the dedicated connection
+                (used when not attached, or after the attached one is lost)
+        confirm: wait for the broker to take responsibility for each batch
+        mode: "tx" (batched) or "confirm" (per message), see module docstring
+        codec: wire_codec name for message bodies
+        """
+        self.params = params
+        self.confirm = confirm
+        self.transactional = confirm and mode == "tx"
+        self.codec = codec
+        self._conn = None
+        self._owns_conn = False
+        self._ch = None
+        self._declared = set()
+
+    # ------------------------------
+    # Connection handling
+    # ------------------------------
+    def attach(self, connection) -> "RabbitPublisher":
+        """
+        Publish on a new channel of an existing (consumer) connection.
+        """
+        self._close_channel()
+        self._conn = connection
+        self._owns_conn = False
+        self._open_channel()
+        return self
+
+    def _open_channel(self) -> None:
+        self._ch = self._conn.channel()
+        if self.transactional:
+            self._ch.tx_select()
+        elif self.confirm:
+            self._ch.confirm_delivery()
+        self._declared = set()
+
+    def _ensure_channel(self) -> None:
+        if self._ch is not None and self._ch.is_open:
+            return
+        if self._conn is None or not self._conn.is_open:
+            if self.params is None:
+                raise RuntimeError("No RabbitMQ connection parameters for publisher")
+            self._conn = pika.BlockingConnection(self.params)
+            self._owns_conn = True
+        self._open_channel()
+
+    def _close_channel(self) -> None:
+        try:
+            if self._ch is not None and self._ch.is_open:
+                self._ch.close()
+        except Exception:
+            pass
+        self._ch = None
+        self._declared = set()
+
+    def _reset(self) -> None:
+        """
+        Drop the current channel, and the connection if it is ours or has
+        died, so the next publish reconnects.
+        """
+        self._close_channel()
+        if self._conn is None:
+            return
+        if self._owns_conn:
+            try:
+                if self._conn.is_open:
+                    self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+        elif not self._conn.is_open:
+            # Attached consumer connection is gone; fall back to our own
+            self._conn = None
+
+    def close(self) -> None:
+        self._close_channel()
+        if self._owns_conn and self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    # ------------------------------
+    # Publishing
+    # ------------------------------
+    def _declare(self, queue: str) -> None:
+        if queue in self._declared:
+            return
+        self._ch.queue_declare(queue=queue, durable=True)
+        self._declared.add(queue)
+
+    def _publish_one(
+        self,
+        queue: str,
+        body: bytes,
+        content_type: str,
+        exchange: str = "",
+        headers: Optional[Dict[str, Any]] = None,
+        timestamp: Optional[int] = None,
+    ) -> None:
+        """
+        In confirm mode BlockingChannel.basic_publish returns only once
+        the broker has acked the message; in tx mode nothing is final
+        until _commit().
+        """
+        self._ensure_channel()
+        if not exchange:
+            self._declare(queue)
+        self._ch.basic_publish(
+            exchange=exchange,
+            routing_key=queue,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                content_type=content_type,
+                timestamp=timestamp or int(time.time()),
+                headers=headers,
+            ),
+        )
+
+    def _commit(self) -> None:
+        if self.transactional:
+            self._ch.tx_commit()
+
+    def publish_batch(self, messages: Iterable[Tuple[str, Any]]) -> bool:
+        """
+        Publish [(queue, payload), ...] back-to-back on the shared channel.
+        Returns True once the broker has taken every message: after one
+        commit for the whole batch in tx mode, after each confirm otherwise.
+        """
+        if pika is None:
+            return False
+
+        encoded = [(q, *wire_codec.encode(p, self.codec)) for q, p in messages]
+
+        sent = 0
+        reconnected = False
+        while sent < len(encoded):
+            queue, body, content_type = encoded[sent]
+            try:
+                self._publish_one(queue, body, content_type)
+                sent += 1
+                if sent == len(encoded):
+                    self._commit()
+            except _CONNECTION_ERRORS:
+                # Reconnect once; an uncommitted transaction is discarded
+                # with the channel, so tx mode resends the whole batch,
+                # confirm mode resumes after the last confirmed message
+                self._reset()
+                if reconnected:
+                    return False
+                reconnected = True
+                if self.transactional:
+                    sent = 0
+            except Exception:
+                if self.transactional:
+                    # Never let a later commit pick up this batch's leftovers
+                    self._reset()
+                return False
+        return True
+
+    def publish(self, queue: str, payload: Any) -> bool:
+        return self.publish_batch([(queue, payload)])
+
+    def forward(
+        self,
+        exchange: str,
+        routing_key: str,
+        body: bytes,
+        content_type: Optional[str],
+        headers: Optional[Dict[str, Any]] = None,
+        timestamp: Optional[int] = None,
+    ) -> bool:
+        """
+        Republish an already-encoded body (retry tiers, dead-letter queue),
+        keeping its content_type and original publish timestamp.
+        """
+        if pika is None:
+            return False
+        for _ in range(2):
+            try:
+                self._publish_one(routing_key, body, content_type, exchange, headers, timestamp)
+                self._commit()
+                return True
+            except _CONNECTION_ERRORS:
+                self._reset()
+            except Exception:
+                if self.transactional:
+                    self._reset()
+                return False
+        return False
+
+
+_default: Optional[RabbitPublisher] = None
+
+
+def get_publisher(params: Any = None, codec: str = "json") -> RabbitPublisher:
+    """
+    Process-wide publisher (created on first use).
+    """
+    global _default
+    if _default is None:
+        _default = RabbitPublisher(params, codec=codec)
+    return _default
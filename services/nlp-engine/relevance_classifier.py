@@ -0,0 +1,190 @@
+"""
+relevance_classifier.py
+
+Local CPU hazard-relevance classifier used as a cascade tier in front of GPT.
+
+ - Scores P(hazard-relevant) from the sanitized text
+ - Clear negatives / clear positives get a locally produced decision
+ - Only the uncertain band is sent on to gpt_decision_wrapper
+ - Concurrent single-text calls are micro-batched into one forward pass
+ - A local negative is decided before any provider is called: the
+   pipeline skips SerpAPI / Vision / GPT for it
+ - score() gives up after RELEVANCE_TIMEOUT_SECONDS, so a wedged model
+   sends reports on to GPT instead of hanging the stage
+
+The model is loaded lazily on first use (torch / transformers are heavy).
+"""
+
+from concurrent.futures import Future, wait as wait_futures
+import os
+import queue
+import threading
+from typing import Any, Dict, List, Optional
+
+RELEVANCE_ENABLED = os.getenv("RELEVANCE_ENABLED", "false").lower() == "true"
+RELEVANCE_MODEL = os.getenv("RELEVANCE_MODEL", "typeform/distilbert-base-uncased-mnli")
+# zero-shot-classification | text-classification
+RELEVANCE_TASK = os.getenv("RELEVANCE_TASK", "zero-shot-classification")
+# Label treated as "hazard" for text-classification models
+RELEVANCE_POSITIVE_LABEL = os.getenv("RELEVANCE_POSITIVE_LABEL", "LABEL_1")
+RELEVANCE_NEGATIVE_THRESHOLD = float(os.getenv("RELEVANCE_NEGATIVE_THRESHOLD", "0.10"))
+RELEVANCE_POSITIVE_THRESHOLD = float(os.getenv("RELEVANCE_POSITIVE_THRESHOLD", "0.95"))
+RELEVANCE_BATCH_SIZE = int(os.getenv("RELEVANCE_BATCH_SIZE", "16"))
+RELEVANCE_BATCH_WAIT_MS = int(os.getenv("RELEVANCE_BATCH_WAIT_MS", "10"))
+RELEVANCE_TORCH_THREADS = int(os.getenv("RELEVANCE_TORCH_THREADS", "0"))
+RELEVANCE_TIMEOUT_SECONDS = float(os.getenv("RELEVANCE_TIMEOUT_SECONDS", "10"))
+RELEVANCE_MAX_CHARS = 2000
+
+HAZARD_LABELS = [
+    "coastal or ocean hazard report",
+    "unrelated to any natural hazard",
+]
+
+
+class RelevanceClassifier:
+    def __init__(
+        self,
+        model: str = RELEVANCE_MODEL,
+        task: str = RELEVANCE_TASK,
+        negative_threshold: float = RELEVANCE_NEGATIVE_THRESHOLD,
+        positive_threshold: float = RELEVANCE_POSITIVE_THRESHOLD,
+        batch_size: int = RELEVANCE_BATCH_SIZE,
+        batch_wait_ms: int = RELEVANCE_BATCH_WAIT_MS,
+    ):
+        self.model = model
+        self.task = task
+        self.negative_threshold = negative_threshold
+        self.positive_threshold = positive_threshold
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0, batch_wait_ms) / 1000.0
+
+        self._pipe = None
+        self._load_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    # ------------------------------
+    # Model
+    # ------------------------------
+    def load(self) -> None:
+        if self._pipe is not None:
+            return
+        with self._load_lock:
+            if self._pipe is not None:
+                return
+            import torch
+            from transformers import pipeline
+
+            if RELEVANCE_TORCH_THREADS > 0:
+                torch.set_num_threads(RELEVANCE_TORCH_THREADS)
+            self._pipe = pipeline(self.task, model=self.model, device=-1)
+
+    def score_batch(self, texts: List[str]) -> List[float]:
+        """
+        P(hazard-relevant) for each text, one forward pass per batch.
+        """
+        if not texts:
+            return []
+        self.load()
+        inputs = [(t or "")[:RELEVANCE_MAX_CHARS] for t in texts]
+
+        if self.task == "zero-shot-classification":
+            outputs = self._pipe(
+                inputs,
+                candidate_labels=HAZARD_LABELS,
+                batch_size=self.batch_size,
+            )
+            if isinstance(outputs, dict):
+                outputs = [outputs]
+            return [
+                float(dict(zip(o["labels"], o["scores"]))[HAZARD_LABELS[0]])
+                for o in outputs
+            ]
+
+        outputs = self._pipe(inputs, top_k=None, batch_size=self.batch_size)
+        scores = []
+        for o in outputs:
+            by_label = {r["label"]: r["score"] for r in o}
+            scores.append(float(by_label.get(RELEVANCE_POSITIVE_LABEL, 0.0)))
+        return scores
+
+    # ------------------------------
+    # Micro-batched single calls
+    # ------------------------------
+    def score(self, text: str, timeout: float = RELEVANCE_TIMEOUT_SECONDS) -> float:
+        """
+        Score one text. Calls arriving from concurrent pipeline threads
+        within RELEVANCE_BATCH_WAIT_MS share a single forward pass.
+        Raises TimeoutError after timeout seconds.
+        """
+        return self.score_many([text], timeout)[0]
+
+    def score_many(self, texts: List[str], timeout: float = RELEVANCE_TIMEOUT_SECONDS) -> List[float]:
+        """
+        Score several texts through the batching worker, waiting at most
+        timeout seconds for all of them.
+        """
+        self._ensure_worker()
+        futures: List[Future] = []
+        for text in texts:
+            fut: Future = Future()
+            self._queue.put((text, fut))
+            futures.append(fut)
+        _, not_done = wait_futures(futures, timeout=timeout)
+        if not_done:
+            for fut in not_done:
+                fut.cancel()
+            raise TimeoutError(f"relevance model gave no score within {timeout:.1f}s")
+        return [fut.result() for fut in futures]
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._load_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._drain, name="relevance-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _drain(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.batch_wait))
+            except queue.Empty:
+                pass
+
+            # Callers that timed out have already given up on theirs
+            batch = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                scores = self.score_batch([text for text, _ in batch])
+                for (_, fut), s in zip(batch, scores):
+                    fut.set_result(s)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+
+    # ------------------------------
+    # Cascade
+    # ------------------------------
+    def local_decision(self, score: float) -> Optional[Dict[str, Any]]:
+        """
+        Decision for clear negatives / positives, None for the uncertain band.
+        """
+        if score <= self.negative_threshold:
+            return {
+                "alert": False,
+                "confidence": round(score, 4),
+                "reasons": [f"local_classifier:negative score={score:.3f}"],
+            }
+        if score >= self.positive_threshold:
+            return {
+                "alert": True,
+                "confidence": round(score, 4),
+                "reasons": [f"local_classifier:positive score={score:.3f}"],
+            }
+        return None
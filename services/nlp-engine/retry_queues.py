@@ -0,0 +1,161 @@
+"""
+retry_queues.py
+
+Delayed-retry and dead-letter topology for the report intake.
+
+ - A report that failed transiently (provider down, rate limited, timed
+   out) leaves the hot path at once: it is republished to a retry tier
+   instead of being retried in-line by the consumer
+ - Tier i is a fanout exchange + queue "<input>.retry.<delay>s" with
+   x-message-ttl = delay; expired messages dead-letter to the default
+   exchange under their original routing key, i.e. back to the lane
+   queue they came from
+ - After the last tier, and for bodies that cannot be decoded at all,
+   messages go to "<input>.dead" and stay there for inspection
+ - Retry metadata travels in x-retry-* headers, with a failure count
+   per pipeline stage
+
+Declaring the tiers never touches the input queues themselves, so
+existing queues need no new arguments.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+RETRY_QUEUES_ENABLED = os.getenv("RETRY_QUEUES_ENABLED", "false").lower() == "true"
+RETRY_DELAYS_SECONDS = [
+    int(d) for d in os.getenv("RETRY_DELAYS_SECONDS", "15,60,300").split(",") if d.strip()
+]
+# Provider retries still done in-line (with backoff sleeps) when the
+# retry tiers are on; the tiers take over after that
+RETRY_INLINE_MAX_RETRIES = int(os.getenv("RETRY_INLINE_MAX_RETRIES", "0"))
+
+ATTEMPT_HEADER = "x-retry-attempt"
+STAGES_HEADER = "x-retry-stages"
+LAST_STAGE_HEADER = "x-retry-last-stage"
+LAST_ERROR_HEADER = "x-retry-last-error"
+FIRST_FAILED_HEADER = "x-retry-first-failed-at"
+ORIGIN_HEADER = "x-retry-origin"
+DEAD_REASON_HEADER = "x-dead-reason"
+
+
+def tier_name(base: str, delay: int) -> str:
+    return f"{base}.retry.{delay}s"
+
+
+def dead_letter_queue(base: str) -> str:
+    return f"{base}.dead"
+
+
+def topology(base: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    [(name, queue_arguments), ...] for every retry tier; each name is
+    both the fanout exchange and the queue bound to it.
+    """
+    return [
+        (
+            tier_name(base, delay),
+            {"x-message-ttl": delay * 1000, "x-dead-letter-exchange": ""},
+        )
+        for delay in RETRY_DELAYS_SECONDS
+    ]
+
+
+def declare(ch, base: str) -> None:
+    """
+    Declare the dead-letter queue, plus the retry tiers when enabled,
+    on a pika channel.
+    """
+    ch.queue_declare(queue=dead_letter_queue(base), durable=True)
+    if not RETRY_QUEUES_ENABLED:
+        return
+    for name, arguments in topology(base):
+        ch.exchange_declare(exchange=name, exchange_type="fanout", durable=True)
+        ch.queue_declare(queue=name, durable=True, arguments=arguments)
+        ch.queue_bind(queue=name, exchange=name)
+
+
+# ------------------------------
+# Headers
+# ------------------------------
+def attempt_of(headers: Optional[Dict[str, Any]]) -> int:
+    try:
+        return int((headers or {}).get(ATTEMPT_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def is_final_attempt(headers: Optional[Dict[str, Any]]) -> bool:
+    """
+    True when a failure now could no longer be retried, so whatever
+    evidence there is should be published.
+    """
+    return not RETRY_QUEUES_ENABLED or attempt_of(headers) >= len(RETRY_DELAYS_SECONDS)
+
+
+def _failure_headers(
+    headers: Optional[Dict[str, Any]], stages: List[str], error: str, origin: str
+) -> Dict[str, Any]:
+    out = dict(headers or {})
+    counts = dict(out.get(STAGES_HEADER) or {})
+    for stage in stages:
+        counts[stage] = int(counts.get(stage, 0)) + 1
+    out[STAGES_HEADER] = counts
+    out[ATTEMPT_HEADER] = attempt_of(headers) + 1
+    out[LAST_STAGE_HEADER] = ",".join(stages)
+    out[LAST_ERROR_HEADER] = str(error)[:500]
+    out.setdefault(FIRST_FAILED_HEADER, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    out[ORIGIN_HEADER] = origin
+    return out
+
+
+def route_failure(
+    base: str,
+    origin: str,
+    headers: Optional[Dict[str, Any]],
+    stages: List[str],
+    error: str,
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Where a failed message goes next: (exchange, routing_key, headers).
+    The next retry tier (routing key = origin queue, restored when its
+    TTL expires), or the dead-letter queue once the tiers are used up.
+    """
+    attempt = attempt_of(headers)
+    out = _failure_headers(headers, stages, error, origin)
+    if RETRY_QUEUES_ENABLED and attempt < len(RETRY_DELAYS_SECONDS):
+        delay = RETRY_DELAYS_SECONDS[attempt]
+        for stage in stages:
+            RETRIES.inc(stage=stage, delay=str(delay))
+        return tier_name(base, delay), origin, out
+    out[DEAD_REASON_HEADER] = "retries_exhausted" if RETRY_QUEUES_ENABLED else "failed"
+    DEAD_LETTERED.inc(reason=out[DEAD_REASON_HEADER])
+    return "", dead_letter_queue(base), out
+
+
+def route_dead(base: str, headers: Optional[Dict[str, Any]], reason: str) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Straight to the dead-letter queue (e.g. an undecodable body).
+    """
+    out = dict(headers or {})
+    out[DEAD_REASON_HEADER] = reason
+    DEAD_LETTERED.inc(reason=reason)
+    return "", dead_letter_queue(base), out
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+RETRIES = metrics.REGISTRY.counter(
+    "nlp_retry_scheduled_total",
+    "Reports sent to a delayed-retry tier, by failed stage",
+    labels=("stage", "delay"),
+)
+DEAD_LETTERED = metrics.REGISTRY.counter(
+    "nlp_dead_lettered_total",
+    "Deliveries moved to the dead-letter queue",
+    labels=("reason",),
+)
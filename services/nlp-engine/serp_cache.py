@@ -0,0 +1,309 @@
+"""
+serp_cache.py
+
+Persistent cache for summarized SerpAPI reverse-image results.
+
+ - Keyed on a normalized image URL, optionally on a content hash
+ - Stored in a local SQLite file (WAL mode) so every worker process
+   on the node shares the same entries
+ - TTL expiry + LRU eviction once the entry limit is exceeded
+ - Hit / miss counters (per process and node-wide)
+ - Reads never take the write lock: access times and node-wide counters
+   are buffered and written in one transaction every
+   SERPAPI_CACHE_FLUSH_SECONDS (or with the next put); the LRU overflow
+   check runs once every SERPAPI_CACHE_EVICT_EVERY puts
+ - The SQLite file is created on first use, not when the cache is built
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+import weakref
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+SERPAPI_CACHE_PATH = os.getenv("SERPAPI_CACHE_PATH", "serpapi_cache.sqlite3")
+SERPAPI_CACHE_TTL = int(os.getenv("SERPAPI_CACHE_TTL", str(7 * 24 * 3600)))
+SERPAPI_CACHE_MAX_ENTRIES = int(os.getenv("SERPAPI_CACHE_MAX_ENTRIES", "50000"))
+SERPAPI_CACHE_FLUSH_SECONDS = float(os.getenv("SERPAPI_CACHE_FLUSH_SECONDS", "5"))
+# Flush sooner once this many access times are buffered
+SERPAPI_CACHE_FLUSH_ENTRIES = int(os.getenv("SERPAPI_CACHE_FLUSH_ENTRIES", "256"))
+SERPAPI_CACHE_EVICT_EVERY = int(os.getenv("SERPAPI_CACHE_EVICT_EVERY", "100"))
+
+# Only the summary is cached, never the raw SerpAPI payload
+CACHED_FIELDS = ("performed", "matches", "domains", "first_seen", "engine")
+
+# Query parameters that never change the image being served
+_TRACKING_PARAMS = {"fbclid", "gclid", "igshid", "ref", "ref_src", "si"}
+
+
+def normalize_image_url(url: str) -> str:
+    """
+    Canonical form of an image URL:
+    - lowercase scheme / host, default ports dropped
+    - fragment removed
+    - tracking params (utm_*, fbclid, ...) removed, rest sorted
+    A URL that does not parse (bad port, unbalanced IPv6 brackets) is
+    returned stripped but otherwise as-is.
+    """
+    try:
+        parsed = urlparse(url.strip())
+        port = parsed.port
+    except ValueError:
+        return url.strip()
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+
+    query = [
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    ]
+    query.sort()
+
+    return urlunparse((scheme, host, parsed.path or "/", "", urlencode(query), ""))
+
+
+def url_key(url: str) -> str:
+    return "url:" + hashlib.sha256(normalize_image_url(url).encode("utf-8")).hexdigest()
+
+
+def content_key(content_hash: str) -> str:
+    return "sha256:" + content_hash.lower()
+
+
+# A SQLite connection must never cross fork(): one hook for every cache,
+# children open their own connections
+_instances: "weakref.WeakSet[SerpCache]" = weakref.WeakSet()
+
+
+def _drop_all_connections() -> None:
+    for cache in list(_instances):
+        cache._drop_connections()
+
+
+os.register_at_fork(after_in_child=_drop_all_connections)
+
+
+class SerpCache:
+    def __init__(
+        self,
+        path: str = SERPAPI_CACHE_PATH,
+        ttl: int = SERPAPI_CACHE_TTL,
+        max_entries: int = SERPAPI_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        _instances.add(self)
+        self._counter_lock = threading.Lock()
+        self._opened = False
+        # key -> last access, and stat name -> increment, not yet written
+        self._pending_access: Dict[str, float] = {}
+        self._pending_stats: Dict[str, int] = {}
+        self._last_flush = time.monotonic()
+        self._puts_since_evict = SERPAPI_CACHE_EVICT_EVERY
+
+    def open(self) -> None:
+        """
+        Create the schema. Done on first use, or ahead of time by the
+        warm-up hook.
+        """
+        if self._opened:
+            return
+        with self._counter_lock:
+            if not self._opened:
+                self._init_schema()
+                self._opened = True
+
+    # ------------------------------
+    # Connection handling
+    # ------------------------------
+    def _drop_connections(self) -> None:
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        One connection per thread; SQLite handles cross-process locking.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS serp_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS serp_cache_last_access ON serp_cache(last_access)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS serp_cache_stats ("
+            " name TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL)"
+        )
+
+    # ------------------------------
+    # Buffered writes
+    # ------------------------------
+    def _bump(self, name: str, key: Optional[str] = None, now: float = 0.0) -> None:
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+            self._pending_stats[name] = self._pending_stats.get(name, 0) + 1
+            if key is not None:
+                self._pending_access[key] = now
+            due = (
+                len(self._pending_access) >= SERPAPI_CACHE_FLUSH_ENTRIES
+                or time.monotonic() - self._last_flush >= SERPAPI_CACHE_FLUSH_SECONDS
+            )
+        if due:
+            self.flush()
+
+    def _take_pending(self) -> Tuple[Dict[str, float], Dict[str, int]]:
+        with self._counter_lock:
+            access, stats = self._pending_access, self._pending_stats
+            self._pending_access, self._pending_stats = {}, {}
+            self._last_flush = time.monotonic()
+        return access, stats
+
+    def _write_pending(self, conn: sqlite3.Connection, access: Dict[str, float], stats: Dict[str, int]) -> None:
+        conn.executemany(
+            "UPDATE serp_cache SET last_access = MAX(last_access, ?) WHERE key = ?",
+            [(ts, key) for key, ts in access.items()],
+        )
+        conn.executemany(
+            "INSERT INTO serp_cache_stats(name, value) VALUES(?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(stats.items()),
+        )
+
+    def flush(self) -> None:
+        """
+        Write buffered access times and counters. Best-effort: they are
+        dropped if the store is busy.
+        """
+        access, stats = self._take_pending()
+        if not access and not stats:
+            return
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending(conn, access, stats)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            pass
+
+    # ------------------------------
+    # Public API
+    # ------------------------------
+    def get(self, image_url: str, content_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        keys = []
+        if content_hash:
+            keys.append(content_key(content_hash))
+        keys.append(url_key(image_url))
+
+        now = time.time()
+        try:
+            self.open()
+            conn = self._conn()
+            for key in keys:
+                row = conn.execute(
+                    "SELECT value, created_at FROM serp_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                value, created_at = row
+                # Expired rows are left to the eviction sweep in put():
+                # a read never writes
+                if now - created_at > self.ttl:
+                    continue
+                self._bump("hits", key, now)
+                return json.loads(value)
+        except sqlite3.Error:
+            pass
+
+        self._bump("misses")
+        return None
+
+    def put(self, image_url: str, result: Dict[str, Any], content_hash: Optional[str] = None) -> None:
+        summary = {k: result[k] for k in CACHED_FIELDS if k in result}
+        value = json.dumps(summary)
+        now = time.time()
+
+        keys = [url_key(image_url)]
+        if content_hash:
+            keys.append(content_key(content_hash))
+
+        with self._counter_lock:
+            self._puts_since_evict += 1
+            evict = self._puts_since_evict >= SERPAPI_CACHE_EVICT_EVERY
+            if evict:
+                self._puts_since_evict = 0
+        access, stats = self._take_pending()
+
+        try:
+            self.open()
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending(conn, access, stats)
+                for key in keys:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO serp_cache(key, value, created_at, last_access) "
+                        "VALUES(?, ?, ?, ?)",
+                        (key, value, now, now),
+                    )
+                if evict:
+                    self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM serp_cache WHERE created_at < ?", (now - self.ttl,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM serp_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM serp_cache WHERE key IN ("
+                " SELECT key FROM serp_cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Process-local counters plus node-wide totals from the shared store.
+        """
+        out = {"hits": self.hits, "misses": self.misses, "entries": None, "node": {}}
+        self.flush()
+        try:
+            self.open()
+            conn = self._conn()
+            out["entries"] = conn.execute("SELECT COUNT(*) FROM serp_cache").fetchone()[0]
+            out["node"] = dict(conn.execute("SELECT name, value FROM serp_cache_stats").fetchall())
+        except sqlite3.Error:
+            pass
+        return out
@@ -0,0 +1,261 @@
+"""
+stage_dag.py
+
+Small dependency-graph executor for the per-report pipeline stages.
+
+ - Stages declare the stages they depend on
+ - Independent stages run in parallel on a shared thread pool
+ - A stage starts as soon as all of its inputs are ready
+ - Per-stage start / end times are recorded for the report, plus the
+   reason when a stage returns {"skipped": reason, ...}
+ - Provider retries do not hold a pool thread through their backoff: the
+   stage is given up (provider_gateway.RetryLater) and re-submitted once
+   the delay is up, with the attempts made so far
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from provider_gateway import RetryLater, deferred_retries
+
+STAGE_WORKERS = int(os.getenv("PIPELINE_STAGE_WORKERS", "32"))
+
+_shared_executor: Optional[ThreadPoolExecutor] = None
+
+# fn(stage_name, seconds, error) called after every stage (metrics hook)
+_observers: List[Callable[[str, float, bool], None]] = []
+
+
+def add_stage_observer(fn: Callable[[str, float, bool], None]) -> None:
+    _observers.append(fn)
+
+
+def shared_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool used by every StageDAG that is not given its own.
+    """
+    global _shared_executor
+    if _shared_executor is None:
+        _shared_executor = ThreadPoolExecutor(
+            max_workers=STAGE_WORKERS,
+            thread_name_prefix="stage",
+        )
+    return _shared_executor
+
+
+class _Scheduler:
+    """
+    One daemon thread that runs callbacks at a later time (deferred stage
+    retries); nothing sleeps on the stage pool meanwhile.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stage-retry", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, fn = heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception:
+                pass
+
+
+_scheduler = _Scheduler()
+
+
+def _reset_scheduler() -> None:
+    global _scheduler
+    _scheduler = _Scheduler()
+
+
+# The scheduler thread does not survive fork()
+os.register_at_fork(after_in_child=_reset_scheduler)
+
+
+class _Deferred:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+
+def iso_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        deps: Iterable[str] = (),
+        fallback: Optional[Callable[[Exception], Any]] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.fallback = fallback
+
+
+class StageDAG:
+    """
+    Usage:
+        dag = StageDAG()
+        dag.add("a", fetch_a)
+        dag.add("b", fetch_b)
+        dag.add("c", lambda a, b: combine(a, b), deps=("a", "b"))
+        results = dag.run(report["timestamps"])
+
+    Each stage function is called with its dependencies' results as
+    keyword arguments.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None):
+        self._executor = executor
+        self._stages: Dict[str, Stage] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        deps: Iterable[str] = (),
+        fallback: Optional[Callable[[Exception], Any]] = None,
+    ) -> "StageDAG":
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        stage = Stage(name, fn, deps, fallback)
+        for dep in stage.deps:
+            if dep not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self._stages[name] = stage
+        return self
+
+    def _run_stage(
+        self, stage: Stage, kwargs: Dict[str, Any], timings: Dict[str, Any], attempts: Dict[str, int]
+    ) -> Any:
+        # A re-run after a deferred retry keeps the original start time
+        entry = timings.setdefault(stage.name, {"started_at": iso_now()})
+        t0 = time.perf_counter()
+        result = None
+        try:
+            with deferred_retries(attempts):
+                result = stage.fn(**kwargs)
+            if isinstance(result, dict) and result.get("skipped"):
+                entry["skipped"] = result["skipped"]
+            return result
+        except RetryLater as e:
+            entry["retries"] = entry.get("retries", 0) + 1
+            result = _Deferred(e.delay)
+            return result
+        except Exception as e:
+            entry["error"] = str(e)
+            if stage.fallback is None:
+                raise
+            return stage.fallback(e)
+        finally:
+            elapsed = time.perf_counter() - t0
+            # Time spent running; a deferred retry's backoff is not counted
+            entry["duration_ms"] = round(entry.get("duration_ms", 0.0) + elapsed * 1000, 3)
+            if not isinstance(result, _Deferred):
+                entry["completed_at"] = iso_now()
+                for observer in _observers:
+                    try:
+                        observer(stage.name, entry["duration_ms"] / 1000.0, "error" in entry)
+                    except Exception:
+                        pass
+
+    def _resubmit(self, executor: Executor, stage: Stage, kwargs, timings, attempts, delay: float) -> Future:
+        """
+        Placeholder future for a stage re-run after delay seconds.
+        """
+        placeholder: Future = Future()
+
+        def fire():
+            if not placeholder.set_running_or_notify_cancel():
+                return  # the report failed meanwhile
+            try:
+                fut = executor.submit(self._run_stage, stage, kwargs, timings, attempts)
+            except Exception as e:
+                placeholder.set_exception(e)
+                return
+
+            def copy(f: Future) -> None:
+                if f.exception() is not None:
+                    placeholder.set_exception(f.exception())
+                else:
+                    placeholder.set_result(f.result())
+
+            fut.add_done_callback(copy)
+
+        _scheduler.call_later(delay, fire)
+        return placeholder
+
+    def run(self, timestamps: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Execute every stage respecting dependencies.
+        Returns {stage_name: result}. Timings are written to
+        timestamps["stages"] when a timestamps dict is given.
+        """
+        executor = self._executor or shared_executor()
+        timings: Dict[str, Any] = {}
+        if timestamps is not None:
+            timestamps["stages"] = timings
+
+        results: Dict[str, Any] = {}
+        pending = dict(self._stages)
+        running = {}
+        launched: Dict[str, tuple] = {}
+
+        while pending or running:
+            ready = [
+                s for s in pending.values()
+                if all(d in results for d in s.deps)
+            ]
+            for stage in ready:
+                del pending[stage.name]
+                kwargs = {d: results[d] for d in stage.deps}
+                attempts: Dict[str, int] = {}
+                launched[stage.name] = (stage, kwargs, attempts)
+                fut = executor.submit(self._run_stage, stage, kwargs, timings, attempts)
+                running[fut] = stage.name
+
+            if not running:
+                # Only reachable if the graph is malformed
+                raise RuntimeError(f"Unresolvable stages: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                if isinstance(result, _Deferred):
+                    stage, kwargs, attempts = launched[name]
+                    retry = self._resubmit(executor, stage, kwargs, timings, attempts, result.delay)
+                    running[retry] = name
+                else:
+                    results[name] = result
+
+        return results
@@ -0,0 +1,118 @@
+"""
+startup.py
+
+Cold-start accounting for the nlp-engine process.
+
+ - Import this module first: its import time is the reference point, so
+   interpreter boot itself is not counted
+ - mark(phase) records how long after that point each startup phase
+   finished; exported as nlp_startup_seconds{phase}
+ - track_imports() times every top-level import from then on (nested
+   ones count towards their parent), including the lazy ones made
+   during warm-up (openai, torch, google.cloud.vision); use
+   `python -X importtime` for the full tree
+ - report() prints the phases and the slowest imports once the consumer
+   is ready
+"""
+
+import builtins
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+_T0 = time.perf_counter()
+
+STARTUP_REPORT_TOP = 15
+
+PHASES: Dict[str, float] = {}
+# module -> [seconds, modules loaded], top-level imports only
+IMPORTS: Dict[str, List[float]] = {}
+
+_original_import = builtins.__import__
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def elapsed() -> float:
+    return time.perf_counter() - _T0
+
+
+def mark(phase: str) -> float:
+    t = elapsed()
+    PHASES[phase] = t
+    return t
+
+
+# ------------------------------
+# Import timing
+# ------------------------------
+def _absolute(name: str, globals, level: int) -> str:
+    if level == 0:
+        return name
+    package = (globals or {}).get("__package__") or ""
+    base = package.rsplit(".", level - 1)[0] if level > 1 else package
+    return f"{base}.{name}" if name else base
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    depth = getattr(_local, "depth", 0)
+    loaded = len(sys.modules)
+    start = time.perf_counter()
+    _local.depth = depth + 1
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = depth
+        added = len(sys.modules) - loaded
+        # Nested imports are part of their top-level import's time
+        if depth == 0 and added > 0:
+            took = time.perf_counter() - start
+            with _lock:
+                entry = IMPORTS.setdefault(_absolute(name, globals, level), [0.0, 0])
+                entry[0] += took
+                entry[1] += added
+
+
+def track_imports() -> None:
+    builtins.__import__ = _timed_import
+
+
+def stop_tracking() -> None:
+    builtins.__import__ = _original_import
+
+
+def slowest_imports(top: int = STARTUP_REPORT_TOP) -> List[Tuple[str, float, int]]:
+    """
+    [(module, seconds, modules_loaded), ...], slowest first. Times are
+    inclusive of everything the import pulled in.
+    """
+    with _lock:
+        rows = [(name, e[0], int(e[1])) for name, e in IMPORTS.items()]
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows[:top]
+
+
+def report(top: int = STARTUP_REPORT_TOP) -> None:
+    phases = ", ".join(f"{p}={t:.3f}s" for p, t in sorted(PHASES.items(), key=lambda kv: kv[1]))
+    print(f"[startup] {phases}")
+    for name, took, count in slowest_imports(top):
+        print(f"[startup]   {took * 1000:8.1f} ms  {count:4d} modules  {name}")
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+def register_metrics() -> None:
+    """
+    Called by main_script once .env is loaded; importing metrics here
+    would read its METRICS_* settings too early.
+    """
+    import metrics
+
+    metrics.REGISTRY.callback_gauge(
+        "nlp_startup_seconds",
+        "Seconds from process start to the end of each startup phase",
+        lambda: {(p,): t for p, t in PHASES.items()},
+        labels=("phase",),
+    )
@@ -0,0 +1,9 @@
+"""
+The nlp-engine modules are flat (run from this directory), so make them
+importable when pytest is started from here or from the repo root.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import async_engine
+import main_script as ms
+import retry_queues
+
+
+class StubEngine(async_engine.AsyncEngine):
+    def __init__(self, crash=()):
+        super().__init__()
+        self.crash = set(crash)
+
+    async def run_report(self, msg, final=True):
+        await asyncio.sleep(0)
+        if msg["id"] in self.crash:
+            raise RuntimeError(f"boom {msg['id']}")
+        return {"id": msg["id"]}
+
+
+@pytest.fixture
+def retry_queues_on(monkeypatch):
+    monkeypatch.setattr(retry_queues, "RETRY_QUEUES_ENABLED", True)
+    monkeypatch.setattr(ms, "RETRY_QUEUES_ENABLED", True)
+    monkeypatch.setattr(ms, "_transient_error", lambda result: None)
+    monkeypatch.setattr(ms, "build_outputs", lambda reports: ([r["id"] for r in reports], []))
+
+
+def test_a_crashed_report_is_routed_on_its_own(retry_queues_on):
+    msgs = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    outputs, failed = asyncio.run(StubEngine(crash={"b"}).process_messages(msgs))
+    assert outputs == (["a", "c"], [])
+    assert failed == [(1, ["pipeline"], "boom b")]
+
+
+def test_split_failed_indexes_refer_to_the_delivery(retry_queues_on, monkeypatch):
+    monkeypatch.setattr(ms, "split_failed", lambda reports, finals: (
+        [r for r in reports if r["id"] != "c"],
+        [(i, ["decision"], "HTTP 503") for i, r in enumerate(reports) if r["id"] == "c"],
+    ))
+    msgs = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    outputs, failed = asyncio.run(StubEngine(crash={"a"}).process_messages(msgs))
+    assert outputs == (["b"], [])
+    assert failed == [(0, ["pipeline"], "boom a"), (2, ["decision"], "HTTP 503")]
+
+
+def test_every_report_crashing_fails_the_delivery(retry_queues_on):
+    with pytest.raises(RuntimeError):
+        asyncio.run(StubEngine(crash={"a", "b"}).process_messages([{"id": "a"}, {"id": "b"}]))
+
+
+def test_without_retry_queues_a_crash_fails_the_delivery(monkeypatch):
+    monkeypatch.setattr(retry_queues, "RETRY_QUEUES_ENABLED", False)
+    with pytest.raises(RuntimeError, match="boom b"):
+        asyncio.run(StubEngine(crash={"b"}).process_messages([{"id": "a"}, {"id": "b"}]))
@@ -0,0 +1,351 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main_script as ms
+import priority_lanes
+import retry_queues
+
+
+class FakeChannel:
+    def __init__(self, events):
+        self.events = events
+        self.consumers = {}
+        self._ids = 0
+
+    def basic_consume(self, queue, on_message_callback):
+        self._ids += 1
+        tag = f"ctag{self._ids}"
+        self.consumers[tag] = queue
+        self.events.append(("consume", queue))
+        return tag
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def basic_cancel(self, tag):
+        del self.consumers[tag]
+        self.events.append(("cancel", tag))
+
+    def basic_ack(self, delivery_tag):
+        self.events.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.events.append(("nack", delivery_tag, requeue))
+
+
+class FakeConnection:
+    """
+    The test thread plays the pika connection thread: worker callbacks
+    and timers only run when pump() / fire_timers() is called.
+    """
+
+    def __init__(self):
+        self.callbacks = []
+        self.timers = []
+        self._lock = threading.Lock()
+
+    def add_callback_threadsafe(self, fn):
+        with self._lock:
+            self.callbacks.append(fn)
+
+    def call_later(self, delay, fn):
+        handle = [delay, fn]
+        self.timers.append(handle)
+        return handle
+
+    def remove_timeout(self, handle):
+        self.timers.remove(handle)
+
+    def pump(self, expected, timeout=5.0):
+        """
+        Run worker callbacks on this thread until expected have run.
+        """
+        deadline = time.monotonic() + timeout
+        ran = 0
+        while ran < expected:
+            with self._lock:
+                batch, self.callbacks = self.callbacks, []
+            for fn in batch:
+                fn()
+                ran += 1
+            if not batch:
+                assert time.monotonic() < deadline, "worker callback never arrived"
+                time.sleep(0.001)
+
+    def fire_timers(self):
+        timers, self.timers = self.timers, []
+        for _, fn in timers:
+            fn()
+
+
+def properties():
+    return SimpleNamespace(content_type="application/json", headers={}, timestamp=None)
+
+
+def method(tag):
+    return SimpleNamespace(delivery_tag=tag, redelivered=False)
+
+
+@pytest.fixture
+def harness(monkeypatch):
+    """
+    Patches the pipeline and the output path. Returns (events, gates):
+    events is the ordered log of channel operations and publishes;
+    run_delivery for delivery tag N blocks until gates[N] is set.
+    """
+    events = []
+    gates = {}
+
+    def run_delivery(delivery):
+        gates[delivery.tag].wait(5)
+        return ([delivery.tag], []), [], None
+
+    monkeypatch.setattr(ms, "run_delivery", run_delivery)
+    monkeypatch.setattr(ms, "publish_outputs", lambda final, alerts: events.append(("publish", final[0])))
+    for tag in range(1, 10):
+        gates[tag] = threading.Event()
+    return events, gates
+
+
+def start(consumer, events):
+    consumer.conn = FakeConnection()
+    consumer.ch = FakeChannel(events)
+    consumer._start_consuming()
+    return consumer.conn, consumer.ch
+
+
+def test_pauses_at_the_high_watermark_and_resumes_at_the_low_one(harness):
+    events, gates = harness
+    consumer = ms.ConcurrentConsumer(workers=4, prefetch=3, lanes=[(priority_lanes.NORMAL, "q")])
+    assert (consumer.high_watermark, consumer.low_watermark) == (4, 2)
+    conn, ch = start(consumer, events)
+
+    for tag in (1, 2, 3, 4):
+        consumer._on_message(ch, method(tag), properties(), b"[]")
+    assert ch.consumers == {} and ("cancel", "ctag1") in events
+
+    # Three in flight: above the low watermark, still paused
+    gates[1].set()
+    conn.pump(1)
+    assert ch.consumers == {}
+    # Two in flight: consuming again
+    gates[2].set()
+    conn.pump(1)
+    assert list(ch.consumers.values()) == ["q"]
+
+    gates[3].set()
+    gates[4].set()
+    conn.pump(2)
+    consumer._pool.shutdown(wait=True)
+
+
+def test_outputs_are_published_before_the_ack_in_completion_order(harness):
+    events, gates = harness
+    consumer = ms.ConcurrentConsumer(workers=3, prefetch=8, lanes=[(priority_lanes.NORMAL, "q")])
+    conn, ch = start(consumer, events)
+    for tag in (1, 2, 3):
+        consumer._on_message(ch, method(tag), properties(), b"[]")
+
+    for tag in (3, 1, 2):
+        gates[tag].set()
+        conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+
+    settled = [e for e in events if e[0] in ("publish", "ack")]
+    assert settled == [
+        ("publish", 3), ("ack", 3), ("publish", 1), ("ack", 1), ("publish", 2), ("ack", 2),
+    ]
+
+
+def test_a_free_worker_takes_the_high_lane_first(harness):
+    events, gates = harness
+    lanes = [(priority_lanes.HIGH, "q.high"), (priority_lanes.LOW, "q.low")]
+    consumer = ms.ConcurrentConsumer(workers=1, prefetch=8, lanes=lanes)
+    conn, ch = start(consumer, events)
+
+    consumer._on_message(ch, method(1), properties(), b"[]", lane=priority_lanes.LOW)
+    consumer._on_message(ch, method(2), properties(), b"[]", lane=priority_lanes.LOW)
+    consumer._on_message(ch, method(3), properties(), b"[]", lane=priority_lanes.HIGH)
+    assert consumer._busy == 1 and len(consumer._scheduler) == 2
+
+    for tag in (1, 3, 2):
+        gates[tag].set()
+        conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+    assert [e[1] for e in events if e[0] == "ack"] == [1, 3, 2]
+
+
+def test_stop_settles_held_deliveries_without_resuming(harness):
+    events, gates = harness
+    consumer = ms.ConcurrentConsumer(workers=1, prefetch=8, lanes=[(priority_lanes.NORMAL, "q")])
+    conn, ch = start(consumer, events)
+    consumer._on_message(ch, method(1), properties(), b"[]")
+    consumer._on_message(ch, method(2), properties(), b"[]")
+
+    consumer.stop()
+    assert ch.consumers == {}
+    gates[1].set()
+    gates[2].set()
+    conn.pump(2)
+    consumer._pool.shutdown(wait=True)
+    # Below the low watermark, but stopping: no new consumer
+    assert [e[0] for e in events] == ["consume", "cancel", "publish", "ack", "publish", "ack"]
+    assert consumer._inflight == 0
+
+
+def test_run_returns_after_the_stop_signal_once_drained(harness, monkeypatch):
+    events, gates = harness
+    consumer = ms.ConcurrentConsumer(workers=1, prefetch=8, lanes=[(priority_lanes.NORMAL, "q")])
+    signalled = []
+
+    class Connection(FakeConnection):
+        is_open = True
+
+        def channel(self):
+            return ch
+
+        def close(self):
+            self.is_open = False
+            events.append(("close",))
+
+        def process_data_events(self, time_limit=0):
+            if signalled:
+                self.pump(1)
+                return
+            # The stop signal arrives while two deliveries are held
+            consumer._on_message(ch, method(1), properties(), b"[]")
+            consumer._on_message(ch, method(2), properties(), b"[]")
+            signalled.append(True)
+            gates[1].set()
+            gates[2].set()
+
+    conn = Connection()
+    ch = FakeChannel(events)
+    monkeypatch.setattr(ms, "pika", SimpleNamespace(BlockingConnection=lambda params: conn))
+    monkeypatch.setattr(ms, "_rabbit_params", lambda: None)
+    monkeypatch.setattr(ms, "_declare_queues", lambda channel: None)
+    monkeypatch.setattr(ms, "_publisher", lambda: SimpleNamespace(attach=lambda c: None))
+    monkeypatch.setattr(ms, "consumer_ready", lambda: None)
+    monkeypatch.setattr(ms.prefork, "stop_requested", lambda: bool(signalled))
+
+    consumer.run()
+    assert [e[0] for e in events] == ["consume", "cancel", "publish", "ack", "publish", "ack", "close"]
+
+
+# ------------------------------
+# MicroBatchConsumer
+# ------------------------------
+def body(*ids):
+    return json.dumps([{"id": i} for i in ids]).encode()
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """
+    Records every window run through process_messages as a list of
+    report ids; the last report of the window is failed when its id
+    starts with "fail".
+    """
+    events = []
+    windows = []
+
+    def process_messages(msgs, finals):
+        windows.append([m["id"] for m in msgs])
+        failed = [(i, ["decision"], "HTTP 503") for i, m in enumerate(msgs) if m["id"].startswith("fail")]
+        return ([m["id"] for m in msgs], []), failed
+
+    class Publisher:
+        def forward(self, exchange, routing_key, body, content_type, headers=None, timestamp=None):
+            events.append(("forward", routing_key, body))
+            return True
+
+    monkeypatch.setattr(ms, "process_messages", process_messages)
+    monkeypatch.setattr(ms, "publish_outputs", lambda final, alerts: events.append(("publish", final)))
+    monkeypatch.setattr(ms, "_publisher", lambda: Publisher())
+    return events, windows
+
+
+def microbatch(events, **kwargs):
+    lanes = [(priority_lanes.HIGH, "q.high"), (priority_lanes.NORMAL, "q")]
+    consumer = ms.MicroBatchConsumer(max_wait_ms=1000, workers=2, prefetch=8, lanes=lanes, **kwargs)
+    conn, ch = start(consumer, events)
+    return consumer, conn, ch
+
+
+def test_a_full_window_is_flushed_by_size(batches):
+    events, windows = batches
+    consumer, conn, ch = microbatch(events, max_reports=3)
+    consumer._on_message(ch, method(1), properties(), body("a"))
+    consumer._on_message(ch, method(2), properties(), body("b"))
+    assert windows == [] and len(conn.timers) == 1
+
+    consumer._on_message(ch, method(3), properties(), body("c"))
+    conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+    assert windows == [["a", "b", "c"]]
+    assert [e for e in events if e[0] in ("publish", "ack")] == [
+        ("publish", ["a", "b", "c"]), ("ack", 1), ("ack", 2), ("ack", 3),
+    ]
+
+
+def test_a_partial_window_is_flushed_by_time(batches):
+    events, windows = batches
+    consumer, conn, ch = microbatch(events, max_reports=16)
+    consumer._on_message(ch, method(1), properties(), body("a", "b"))
+    consumer._on_message(ch, method(2), properties(), body("c"))
+    assert windows == []
+
+    conn.fire_timers()
+    conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+    assert windows == [["a", "b", "c"]]
+    assert [e[1] for e in events if e[0] == "ack"] == [1, 2]
+
+
+def test_a_high_lane_delivery_closes_the_window(batches):
+    events, windows = batches
+    consumer, conn, ch = microbatch(events, max_reports=16)
+    consumer._on_message(ch, method(1), properties(), body("a"))
+    consumer._on_message(ch, method(2), properties(), body("urgent"), lane=priority_lanes.HIGH)
+    conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+    assert windows == [["urgent", "a"]] and conn.timers == []
+
+
+def test_failures_are_split_back_to_their_deliveries(batches):
+    events, windows = batches
+    consumer, conn, ch = microbatch(events, max_reports=3)
+    consumer._on_message(ch, method(1), properties(), body("a"))
+    consumer._on_message(ch, method(2), properties(), body("b", "fail-c"))
+    conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+    # Only the failed report is republished, from the delivery it came in
+    settled = [e for e in events if e[0] in ("forward", "ack")]
+    assert [e[0] for e in settled] == ["ack", "forward", "ack"]
+    assert json.loads(settled[1][2]) == {"id": "fail-c"}
+
+
+def test_a_malformed_delivery_is_not_batched(batches):
+    events, windows = batches
+    consumer, conn, ch = microbatch(events, max_reports=3)
+    consumer._on_message(ch, method(1), properties(), b"{not json")
+    dead = retry_queues.dead_letter_queue(ms.INPUT_QUEUE)
+    assert events[-2:] == [("forward", dead, b"{not json"), ("ack", 1)]
+    assert consumer._inflight == 0 and len(consumer._scheduler) == 0
+
+
+def test_stop_flushes_the_open_window(batches):
+    events, windows = batches
+    consumer, conn, ch = microbatch(events, max_reports=16)
+    consumer._on_message(ch, method(1), properties(), body("a"))
+    assert windows == [] and len(conn.timers) == 1
+
+    consumer.stop()
+    conn.pump(1)
+    consumer._pool.shutdown(wait=True)
+    assert windows == [["a"]] and conn.timers == []
+    assert ch.consumers == {} and ("ack", 1) in events
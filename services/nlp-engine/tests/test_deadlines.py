@@ -0,0 +1,78 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+import deadlines
+from deadlines import Deadline, missing_evidence, parse_budgets
+from decision_cache import evidence_complete
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=100.0)
+    monkeypatch.setattr(deadlines, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+def test_call_timeout_keeps_the_decision_reserve(clock):
+    d = Deadline(30.0, "normal")
+    assert d.call_timeout(15.0, reserve=5.0) == 15.0
+    clock.t += 20.0
+    assert d.call_timeout(15.0, reserve=5.0) == pytest.approx(5.0)
+    # Less than DEADLINE_MIN_CALL_SECONDS (1.5) left after the reserve: skip
+    clock.t += 4.0
+    assert d.call_timeout(15.0, reserve=5.0) is None
+    assert d.cutoff(reserve=5.0) == 125.0
+
+
+def test_decision_always_gets_a_minimum(clock):
+    d = Deadline(10.0, "high")
+    assert d.decision_timeout(20.0) == pytest.approx(10.0)
+    clock.t += 60.0
+    assert d.decision_timeout(20.0) == deadlines.DEADLINE_MIN_CALL_SECONDS
+
+
+def test_skip_and_summary(clock):
+    d = Deadline(10.0, "low")
+    assert d.skip("vision_web", vision_available=False) == {"vision_available": False, "skipped": "deadline"}
+    clock.t += 12.5
+    assert d.summary() == {
+        "lane": "low", "budget_s": 10.0, "elapsed_s": 12.5, "exceeded": True, "skipped_stages": ["vision_web"],
+    }
+
+
+def test_budget_by_lane_then_source(monkeypatch):
+    monkeypatch.setattr(deadlines, "DEADLINES_ENABLED", True)
+    monkeypatch.setattr(deadlines, "DEADLINE_LANE_SECONDS", parse_budgets("high:10, normal:30"))
+    monkeypatch.setattr(deadlines, "DEADLINE_SOURCE_SECONDS", parse_budgets("reddit:90"))
+    red = deadlines.for_message({"platform": "app", "extra": {"alert_level": "red"}})
+    assert (red.lane, red.budget) == ("high", 10.0)
+    assert deadlines.for_message({"platform": "reddit"}).budget == 90.0
+    # No budget configured for the lane: unbounded
+    assert deadlines.for_message({"platform": "twitter"}).budget == math.inf
+
+    monkeypatch.setattr(deadlines, "DEADLINES_ENABLED", False)
+    assert deadlines.for_message({"platform": "app"}) is None
+
+
+def test_missing_evidence_ignores_not_applicable():
+    assert missing_evidence(
+        {"performed": False, "skipped": "deadline"}, {"vision_available": False, "error": "timeout"}
+    ) == ["reverse_search:deadline", "vision_web:timeout"]
+    assert missing_evidence(
+        {"performed": False, "skipped": "local_negative"}, {"vision_available": False, "skipped": "not_an_image"}
+    ) == []
+
+
+def test_missing_evidence_agrees_with_the_decision_cache():
+    results = [
+        None, {}, {"performed": True, "matches": 2}, {"skipped": "event_member"},
+        {"skipped": "circuit_open"}, {"error": "timeout"}, {"error": "HTTP 500"},
+    ]
+    for rs in results:
+        for vision in results:
+            assert (missing_evidence(rs, vision) == []) == evidence_complete(rs, vision)
+    assert missing_evidence({"error": "HTTP 500"}, {"skipped": "circuit_open"}) == [
+        "reverse_search:error", "vision_web:circuit_open",
+    ]
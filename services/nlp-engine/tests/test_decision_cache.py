@@ -0,0 +1,53 @@
+from decision_cache import DecisionCache, evidence_fingerprint, evidence_status
+
+RS = {"performed": True, "matches": 2, "domains": ["b.com", "a.com"], "first_seen": "2024-01-01"}
+VISION = {"vision_available": True, "best_guess": "flood"}
+DECISION = {"alert": True, "confidence": 0.9, "reasons": ["flood"]}
+
+
+def test_fingerprint_ignores_debug_fields():
+    noisy = dict(RS, domains=["a.com", "b.com"], cached=True, debug={"t": 1})
+    assert evidence_fingerprint(RS, VISION) == evidence_fingerprint(noisy, VISION)
+
+
+def test_fingerprint_depends_on_evidence_status():
+    skipped = {"performed": False, "skipped": "deadline"}
+    failed = {"performed": False, "error": "HTTP 500"}
+    timed_out = {"performed": False, "error": "timeout"}
+    prints = {evidence_fingerprint(r, VISION) for r in (RS, skipped, failed, timed_out)}
+    assert len(prints) == 4
+    assert [evidence_status(r) for r in (RS, skipped, failed, timed_out, None)] == [
+        "ok", "skipped:deadline", "error", "timeout", "none",
+    ]
+    assert evidence_status({"performed": False, "skipped": "not_an_image"}) == "not_applicable"
+
+
+def test_full_evidence_decision_not_reused_without_evidence():
+    cache = DecisionCache(mode="exact")
+    cache.put("Flooding at the pier", RS, VISION, DECISION)
+    assert cache.get("flooding at the PIER!", RS, VISION)["cache"]["match"] == "exact"
+    assert cache.get("Flooding at the pier", {"performed": False, "skipped": "deadline"}, VISION) is None
+
+
+def test_decisions_from_incomplete_evidence_not_cached():
+    cache = DecisionCache(mode="exact")
+    vision_timeout = {"vision_available": False, "best_guess": None, "error": "timeout"}
+    cache.put("Flooding at the pier", RS, vision_timeout, DECISION)
+    assert cache.stats()["entries"] == 0
+    assert cache.get("Flooding at the pier", RS, vision_timeout) is None
+
+
+def test_similar_mode_requires_matching_evidence():
+    cache = DecisionCache(mode="similar", threshold=0.8)
+    text = "Heavy flooding reported near the harbour road this morning, boats damaged"
+    cache.put(text, RS, VISION, DECISION)
+    near = text + " badly"
+    assert cache.get(near, RS, VISION)["cache"]["match"] in ("exact", "similar")
+    assert cache.get(near, dict(RS, matches=0), VISION) is None
+
+
+def test_entries_expire_lazily():
+    cache = DecisionCache(mode="exact", ttl=-1)
+    cache.put("Flooding at the pier", RS, VISION, DECISION)
+    assert cache.get("Flooding at the pier", RS, VISION) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,73 @@
+import threading
+
+from event_clusters import EventClusterer
+
+TEXT = "Huge waves flooding Marina beach road, water entering houses now"
+
+
+def msg(i):
+    return {"text": TEXT, "created_at": "2026-10-18T10:00:00Z",
+            "location": {"lat": 13.05 + i * 0.001, "lon": 80.28}, "extra": {"hazard_type": "flood"}}
+
+
+def test_members_join_the_representatives_cluster():
+    clusterer = EventClusterer()
+    rep = clusterer.assign("r1", msg(0), TEXT)
+    member = clusterer.assign("r2", msg(1), TEXT)
+    assert rep["role"] == "representative" and member["role"] == "member"
+    assert member["cluster_id"] == rep["cluster_id"] and clusterer.size(rep["cluster_id"]) == 2
+
+
+def test_on_resolved_wakes_waiters_once():
+    clusterer = EventClusterer()
+    cluster_id = clusterer.assign("r1", msg(0), TEXT)["cluster_id"]
+    woken = []
+    clusterer.on_resolved(cluster_id, lambda: woken.append("early"))
+    assert woken == []
+
+    resolver = threading.Thread(target=clusterer.resolve, args=(cluster_id, None))
+    resolver.start()
+    assert clusterer.wait(cluster_id, 1.0) is None
+    resolver.join()
+    clusterer.resolve(cluster_id, {"alert": True, "confidence": 0.9})
+    clusterer.on_resolved(cluster_id, lambda: woken.append("late"))
+    clusterer.on_resolved("evc_expired", lambda: woken.append("expired"))
+    assert woken == ["early", "late", "expired"]
+
+
+def test_representative_never_joins_its_own_cluster():
+    clusterer = EventClusterer()
+    first = clusterer.assign("r1", msg(0), TEXT)
+    # Redelivered / back from a retry tier
+    again = clusterer.assign("r1", msg(0), TEXT)
+    assert again == first and again["role"] == "representative"
+    assert clusterer.representatives == 1 and clusterer.members == 0
+
+
+def test_representative_retry_reopens_an_unverified_cluster():
+    clusterer = EventClusterer()
+    cluster_id = clusterer.assign("r1", msg(0), TEXT)["cluster_id"]
+    clusterer.resolve(cluster_id, None)
+    clusterer.assign("r1", msg(0), TEXT)
+    assert clusterer.wait(cluster_id, 0) is None
+    clusterer.resolve(cluster_id, {"alert": True, "confidence": 0.9})
+    assert clusterer.wait(cluster_id, 0) == {"alert": True, "confidence": 0.9}
+
+
+def test_decision_with_evidence_to_retry_is_not_propagated(monkeypatch):
+    import main_script as ms
+
+    clusterer = EventClusterer()
+    monkeypatch.setattr(ms, "event_clusterer", clusterer)
+    monkeypatch.setattr(ms, "RETRY_QUEUES_ENABLED", True)
+    membership = clusterer.assign("r1", msg(0), TEXT)
+    report = {
+        "reverse_search": {"performed": False, "error": "HTTP 503", "retryable": True},
+        "vision_web": {"vision_available": True, "best_guess": "flood"},
+    }
+    assert ms.evidence_retried(report, final=False)
+    assert not ms.evidence_retried(report, final=True)
+
+    ms.resolve_event(membership, {"alert": True, "confidence": 0.9, "reasons": ["flood"]},
+                     ms.evidence_retried(report, final=False))
+    assert clusterer.wait(membership["cluster_id"], 0) is None
@@ -0,0 +1,149 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import main_script as ms
+from decision_cache import DecisionCache
+from provider_gateway import ProviderGateway, ProviderUnavailable
+
+RS = {"performed": True, "matches": 0}
+VISION = {"vision_available": True, "web_entities": []}
+
+
+def item(rid, text=None):
+    return {"id": rid, "text": text or f"high waves at beach {rid}", "reverse_search": RS, "vision": VISION}
+
+
+def decision(rid, alert=True, confidence=0.9):
+    return {"id": rid, "alert": alert, "confidence": confidence, "reasons": [f"r{rid}"]}
+
+
+class FakeOpenAI:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        self.prompts.append(messages[0]["content"])
+        content = self.responses.pop(0)
+        if isinstance(content, Exception):
+            raise content
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def gpt(monkeypatch):
+    """
+    Returns (install(*responses) -> FakeOpenAI, singles): singles lists
+    the texts that fell back to a one-report gpt_decision_wrapper call.
+    """
+    singles = []
+    monkeypatch.setattr(ms, "USE_GPT", True)
+    monkeypatch.setattr(ms, "GPT_BATCH_SIZE", 4)
+    monkeypatch.setattr(ms, "decision_cache", DecisionCache(mode="exact"))
+    monkeypatch.setattr(ms, "openai_gateway", ProviderGateway("test_gpt_batch", max_retries=0))
+
+    def single(text, rs, vision, deadline=None):
+        singles.append(text)
+        return {"alert": False, "confidence": 0.1, "reasons": ["single"]}
+
+    monkeypatch.setattr(ms, "gpt_decision_wrapper", single)
+
+    def install(*responses):
+        client = FakeOpenAI(*responses)
+        monkeypatch.setattr(ms, "get_openai_client", lambda: client)
+        return client
+
+    return install, singles
+
+
+def test_batch_answers_map_back_by_id(gpt):
+    install, singles = gpt
+    client = install([decision("b", alert=False, confidence=0.2), decision("a")])
+    out = ms.gpt_batch_decision_wrapper([item("a"), item("b")])
+    assert out == {
+        "a": {"alert": True, "confidence": 0.9, "reasons": ["ra"]},
+        "b": {"alert": False, "confidence": 0.2, "reasons": ["rb"]},
+    }
+    assert singles == [] and len(client.prompts) == 1
+    assert "### id: a" in client.prompts[0] and "### id: b" in client.prompts[0]
+
+
+def test_missing_invalid_and_extra_ids(gpt):
+    install, singles = gpt
+    install({"decisions": [
+        decision("a"),
+        decision("a", alert=False),  # duplicate: the first answer counts
+        decision("zzz"),  # not in the batch
+        {"id": "c", "alert": "yes", "confidence": 0.5, "reasons": []},  # invalid
+    ]})
+    out = ms.gpt_batch_decision_wrapper([item("a"), item("b"), item("c")])
+    assert out["a"]["alert"] is True
+    assert "zzz" not in out
+    assert out["b"]["reasons"] == out["c"]["reasons"] == ["single"]
+    assert sorted(singles) == [item("b")["text"], item("c")["text"]]
+
+
+def test_unparseable_batch_falls_back_per_item(gpt):
+    install, singles = gpt
+    install("not json")
+    out = ms.gpt_batch_decision_wrapper([item("a"), item("b")])
+    assert set(out) == {"a", "b"} and len(singles) == 2
+
+
+def test_provider_down_skips_without_per_item_calls(gpt, monkeypatch):
+    install, singles = gpt
+    install()
+
+    def unavailable(*args, **kwargs):
+        raise ProviderUnavailable("openai", "circuit_open")
+
+    monkeypatch.setattr(ms.openai_gateway, "call", unavailable)
+    out = ms.gpt_batch_decision_wrapper([item("a"), item("b")])
+    assert all(d["reasons"] == ["gpt_skipped:circuit_open"] for d in out.values())
+    assert singles == []
+
+
+def test_chunks_and_cache(gpt):
+    install, singles = gpt
+    ids = list("abcdef")
+    client = install([decision(r) for r in ids[:4]], [decision(r) for r in ids[4:]])
+    first = ms.gpt_batch_decision_wrapper([item(r) for r in ids])
+    assert len(client.prompts) == 2 and set(first) == set(ids)
+
+    # Every decision is cached now: no further call, same answers
+    again = ms.gpt_batch_decision_wrapper([item(r) for r in ids])
+    assert len(client.prompts) == 2
+    assert {k: v["alert"] for k, v in again.items()} == {k: v["alert"] for k, v in first.items()}
+
+
+def test_a_lone_report_uses_the_single_call(gpt):
+    install, singles = gpt
+    client = install()
+    assert ms.gpt_batch_decision_wrapper([item("a")])["a"]["reasons"] == ["single"]
+    assert client.prompts == [] and singles == [item("a")["text"]]
+
+
+def enriched(rid, text, relevance=None):
+    return {
+        "id": rid, "stage1_text": {"sanitized_text": text}, "reverse_search": RS, "vision_web": VISION,
+        "relevance": relevance, "cluster": None, "timestamps": {},
+    }
+
+
+def test_decide_batch_keys_repeated_ids_apart(gpt):
+    install, singles = gpt
+    client = install([decision("r1", confidence=0.8), decision("r1#1", alert=False, confidence=0.3)])
+    local = {"score": 0.01, "decision": {"alert": False, "confidence": 0.99, "reasons": ["local"]}}
+    reports = [enriched("r1", "surge at Kochi"), enriched("r1", "calm sea"), enriched("r2", "cat video", local)]
+    out = ms._decide_batch([{}, {}, {}], reports, [None] * 3, [True] * 3)
+
+    assert [r["decision"]["confidence"] for r in out] == [0.8, 0.3, 0.99]
+    assert [r["decision_tier"] for r in out][:2] == ["gpt", "gpt"]
+    assert "### id: r2" not in client.prompts[0]
+    assert out[0]["timestamps"]["stages"]["decision"]["batch_size"] == 2
+    assert singles == []
@@ -0,0 +1,197 @@
+import os
+import time
+
+import pytest
+
+import media_fetch
+from media_fetch import MediaFetcher, UnsafeURL, check_url, sniff
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 60
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 56
+
+
+class FakeResponse:
+    def __init__(self, chunks=(), headers=None, status=200, on_chunk=None):
+        self.chunks = list(chunks)
+        self.headers = headers or {}
+        self.status_code = status
+        self.on_chunk = on_chunk
+        self.closed = False
+
+    @property
+    def is_redirect(self):
+        return self.status_code in (301, 302, 303, 307, 308) and "Location" in self.headers
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def iter_content(self, size):
+        for chunk in self.chunks:
+            if self.on_chunk:
+                self.on_chunk()
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeSession:
+    def __init__(self, routes):
+        self.routes = routes
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        return self.routes[url]
+
+
+@pytest.fixture
+def public_dns(monkeypatch):
+    table = {"img.example.com": {"93.184.216.34"}, "cdn.example.com": {"93.184.216.35"}}
+    monkeypatch.setattr(media_fetch, "_resolve", lambda host: table.get(host, {"127.0.0.1"}))
+    return table
+
+
+def make_fetcher(tmp_path, routes, **kwargs):
+    fetcher = MediaFetcher(cache_dir=str(tmp_path / "media"), **kwargs)
+    fetcher._session = FakeSession(routes)
+    return fetcher
+
+
+@pytest.mark.parametrize(
+    "head, kind, mime",
+    [
+        (JPEG, "image", "image/jpeg"),
+        (PNG, "image", "image/png"),
+        (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image", "image/webp"),
+        (b"\x00\x00\x00\x18ftypheic", "image", "image/heic"),
+        (b"\x00\x00\x00\x18ftypisom", "video", "video/mp4"),
+        (b"\x1a\x45\xdf\xa3\x01", "video", "video/webm"),
+        (b"  <!DOCTYPE html><html>", "other", "text/html"),
+        (b"plain bytes", "other", "application/octet-stream"),
+    ],
+)
+def test_sniff_uses_magic_bytes(head, kind, mime):
+    assert sniff(head) == {"kind": kind, "mime": mime}
+
+
+def test_image_is_stored_once_and_served_from_cache(tmp_path, public_dns):
+    url = "https://img.example.com/a.jpg"
+    fetcher = make_fetcher(tmp_path, {url: FakeResponse([JPEG])})
+    first = fetcher.fetch(url)
+    assert (first["kind"], first["mime"], first["cached"]) == ("image", "image/jpeg", False)
+    blob = fetcher.open_blob(first["sha256"])
+    assert blob[:] == JPEG
+    blob.close()
+
+    second = fetcher.fetch(url)
+    assert second["cached"] is True and second["sha256"] == first["sha256"]
+    assert len(fetcher._session.calls) == 1
+    assert fetcher.stats() == {"hits": 1, "misses": 1}
+
+
+def test_size_cap_from_header_and_from_stream(tmp_path, public_dns):
+    declared = "https://img.example.com/declared.jpg"
+    streamed = "https://img.example.com/streamed.jpg"
+    fetcher = make_fetcher(
+        tmp_path,
+        {
+            declared: FakeResponse([JPEG], headers={"Content-Length": "1000"}),
+            streamed: FakeResponse([JPEG, b"\x00" * 64]),
+        },
+        max_bytes=100,
+    )
+    out = fetcher.fetch(declared)
+    assert (out["error"], out["size"], out["sha256"]) == ("too_large", 1000, None)
+    out = fetcher.fetch(streamed)
+    assert (out["error"], out["size"], out["sha256"]) == ("too_large", 128, None)
+    assert not os.path.exists(os.path.join(fetcher.cache_dir, "blobs"))
+
+
+def test_url_record_expires_after_ttl(tmp_path, public_dns):
+    url = "https://img.example.com/a.jpg"
+    fetcher = make_fetcher(tmp_path, {url: FakeResponse([JPEG])}, url_ttl=60)
+    fetcher.fetch(url)
+    assert fetcher._lookup_url(url) is not None
+
+    info = fetcher._lookup_url(url)
+    info["fetched_at"] -= 120
+    fetcher._remember_url(url, info)
+    assert fetcher._lookup_url(url) is None
+    assert fetcher.fetch(url, cached_only=True)["skipped"] == "not_cached"
+
+
+def test_private_and_metadata_hosts_are_refused(monkeypatch):
+    monkeypatch.setattr(media_fetch, "_resolve", lambda host: {host})
+    for host in ("127.0.0.1", "10.0.0.5", "192.168.1.1", "169.254.169.254", "::1", "fd00::1", "0.0.0.0"):
+        with pytest.raises(UnsafeURL):
+            check_url(f"http://[{host}]/x" if ":" in host else f"http://{host}/x")
+    with pytest.raises(UnsafeURL):
+        check_url("file:///etc/passwd")
+    check_url("http://93.184.216.34/x")
+
+
+def test_redirect_to_private_address_is_not_followed(tmp_path, public_dns):
+    url = "https://img.example.com/a.jpg"
+    internal = "http://internal.local/latest/meta-data"
+    redirect = FakeResponse(status=302, headers={"Location": internal})
+    fetcher = make_fetcher(tmp_path, {url: redirect, internal: FakeResponse([JPEG])})
+    out = fetcher.fetch(url)
+    assert out["kind"] == "unavailable" and "blocked address" in out["error"]
+    assert [u for u, _ in fetcher._session.calls] == [url]
+    assert redirect.closed
+    assert all(kw["allow_redirects"] is False for _, kw in fetcher._session.calls)
+
+
+def test_public_redirect_is_followed(tmp_path, public_dns):
+    url = "https://img.example.com/a.jpg"
+    target = "https://cdn.example.com/a.jpg"
+    fetcher = make_fetcher(
+        tmp_path,
+        {url: FakeResponse(status=301, headers={"Location": target}), target: FakeResponse([PNG])},
+    )
+    assert fetcher.fetch(url)["mime"] == "image/png"
+
+
+def test_slow_stream_is_cut_at_the_deadline(tmp_path, public_dns, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(media_fetch.time, "monotonic", lambda: now[0])
+
+    def tick():
+        now[0] += 0.4
+
+    url = "https://img.example.com/slow.jpg"
+    fetcher = make_fetcher(tmp_path, {url: FakeResponse([JPEG] + [b"\x00" * 8] * 10, on_chunk=tick)})
+    out = fetcher.fetch(url, timeout=1.0)
+    assert out["error"] == "timeout" and out["kind"] == "unavailable"
+    # A transient failure is not remembered
+    assert fetcher._lookup_url(url) is None
+
+
+def test_evict_drops_expired_urls_and_lru_blobs(tmp_path, public_dns):
+    urls = [f"https://img.example.com/{i}.jpg" for i in range(3)]
+    payloads = [JPEG + bytes([i]) * 100 for i in range(3)]
+    fetcher = make_fetcher(
+        tmp_path, {u: FakeResponse([p]) for u, p in zip(urls, payloads)}, max_cache_bytes=400
+    )
+    infos = [fetcher.fetch(u) for u in urls]
+
+    for age, info in zip((3000, 3600, 2400), infos):
+        stamp = time.time() - age
+        os.utime(fetcher.blob_path(info["sha256"]), (stamp, stamp))
+    # A cache hit refreshes the blob's recency
+    assert fetcher.fetch(urls[0])["cached"] is True
+    stale = time.time() - fetcher.url_ttl - 10
+    os.utime(fetcher._url_path(urls[2]), (stale, stale))
+
+    assert fetcher.evict() == {"urls": 1, "blobs": 1}
+    survivors = [os.path.exists(fetcher.blob_path(i["sha256"])) for i in infos]
+    assert survivors == [True, False, True]
+    assert fetcher._lookup_url(urls[2]) is None
@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+import pytest
+
+import main_script as ms
+import metrics
+import stage_dag
+
+IMPORT_PROBE = """
+import main_script, metrics, stage_dag
+print(sorted(type(m).__name__ for m in metrics.REGISTRY._metrics))
+print(len(stage_dag._observers))
+"""
+
+
+def test_import_declares_families_but_installs_nothing(tmp_path):
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], capture_output=True, text=True, check=True,
+        cwd=str(tmp_path), env={"PYTHONPATH": ":".join(sys.path), "METRICS_PORT": "0"},
+    ).stdout.splitlines()
+    assert "CallbackGauge" not in out[0]
+    assert out[1] == "0"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_first_pipeline_run_installs_the_stage_observer(monkeypatch):
+    monkeypatch.setattr(ms, "_metrics_installed", False)
+    monkeypatch.setattr(stage_dag, "_observers", [])
+    monkeypatch.setattr(metrics, "REGISTRY", metrics.Registry())
+
+    def stop(msg):
+        raise LookupError("stop after install")
+
+    monkeypatch.setattr(ms, "deadline_for", stop)
+    with pytest.raises(LookupError):
+        ms.run_full_pipeline({"id": "r1"})
+    assert stage_dag._observers == [metrics.observe_stage]
+    with pytest.raises(LookupError):
+        ms.run_full_pipeline({"id": "r2"})
+    assert len(stage_dag._observers) == 1
@@ -0,0 +1,78 @@
+import gc
+import os
+import random
+import weakref
+
+import phash_index
+from phash_index import BKTree, PHashIndex, hamming, reverse_search_from_hit
+
+H = 0x0F0F_F0F0_1234_ABCD
+NEAR = H ^ 0b101  # distance 2
+
+
+def make_index(tmp_path):
+    return PHashIndex(path=str(tmp_path / "phash.sqlite3"), refresh_seconds=0)
+
+
+def test_bktree_matches_linear_scan():
+    rng = random.Random(3)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    tree = BKTree()
+    for h in hashes:
+        tree.add(h)
+    probe = hashes[17] ^ 0b11
+    found = sorted(tree.search(probe, 6))
+    assert found == sorted((h, hamming(h, probe)) for h in set(hashes) if hamming(h, probe) <= 6)
+
+
+def test_own_sighting_is_not_a_hit(tmp_path):
+    index = make_index(tmp_path)
+    index.add(H, "https://x/a.jpg", {"performed": True, "matches": 0}, sighting="id:r1")
+    # The same report redelivered or retried
+    assert index.lookup(H, sighting="id:r1") is None
+    assert index.lookup(NEAR, sighting="id:r1") is None
+
+
+def test_other_reports_are_counted_once_each(tmp_path):
+    index = make_index(tmp_path)
+    index.add(H, "https://x/a.jpg", {"performed": True, "matches": 0}, sighting="id:r1")
+
+    hit = index.lookup(NEAR, sighting="id:r2")
+    assert hit["seen_count"] == 1 and hit["distance"] == 2
+    assert reverse_search_from_hit(hit)["matches"] == 1
+
+    # r2 reprocessed: its sighting is recorded once and never counts for itself
+    index.touch(int(hit["hash"], 16), "id:r2", "https://y/b.jpg")
+    index.touch(int(hit["hash"], 16), "id:r2", "https://y/b.jpg")
+    again = index.lookup(NEAR, sighting="id:r2")
+    assert again["seen_count"] == 1
+    assert again["image_url"] == "https://x/a.jpg"
+
+    third = index.lookup(H, sighting="id:r3")
+    assert third["seen_count"] == 2
+    assert third["image_url"] == "https://x/a.jpg"
+
+
+def test_index_is_shared_through_the_store(tmp_path):
+    make_index(tmp_path).add(H, "https://x/a.jpg", sighting="id:r1")
+    other_process = make_index(tmp_path)
+    assert other_process.lookup(H, sighting="id:r2")["seen_count"] == 1
+
+
+def test_fork_drops_every_index_connection(tmp_path):
+    indexes = [PHashIndex(path=str(tmp_path / f"phash{i}.sqlite3")) for i in range(3)]
+    for index in indexes:
+        index.open()
+    assert all(i in phash_index._instances for i in indexes)
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if all(getattr(i._local, "conn", None) is None for i in indexes) else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    # The fork hook does not keep an index alive
+    ref = weakref.ref(indexes.pop(0))
+    del index
+    gc.collect()
+    assert ref() is None
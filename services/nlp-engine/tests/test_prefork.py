@@ -0,0 +1,130 @@
+import itertools
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import prefork
+from prefork import Supervisor
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_fork(monkeypatch):
+    """
+    Supervisor bookkeeping without processes: fork() hands out pids and
+    never returns 0. Returns the list of pids forked so far.
+    """
+    pids = itertools.count(100)
+    forked = []
+
+    def fork():
+        forked.append(next(pids))
+        return forked[-1]
+
+    monkeypatch.setattr(prefork.os, "fork", fork)
+    monkeypatch.setattr(prefork, "PREFORK_MIN_UPTIME", 0.5)
+    monkeypatch.setattr(prefork, "PREFORK_RESTART_BACKOFF_MAX", 4.0)
+    return forked
+
+
+def exited(code):
+    return code << 8
+
+
+def test_crash_backoff_does_not_block_other_workers(fake_fork):
+    clock = Clock()
+    sup = Supervisor(2, target=None, clock=clock)
+    sup._spawn(0)
+    sup._spawn(1)
+    crashing, healthy = fake_fork
+
+    clock.now += 0.1
+    sup._on_exit(crashing, exited(1))
+    assert sup._respawn_due() == pytest.approx(1.0)
+
+    # Worker 1 ran long enough: back at once, while worker 0 still waits
+    clock.now += 0.6
+    sup._on_exit(healthy, exited(0))
+    assert sup._respawn_due() == pytest.approx(0.4)
+    assert sorted(sup._children.values()) == [1] and sup.restarts == 1
+
+    clock.now += 0.4
+    assert sup._respawn_due() is None
+    assert sorted(sup._children.values()) == [0, 1] and sup.restarts == 2
+
+
+def test_backoff_doubles_up_to_the_cap(fake_fork):
+    clock = Clock()
+    sup = Supervisor(1, target=None, clock=clock)
+    sup._spawn(0)
+    delays = []
+    for _ in range(5):
+        sup._on_exit(fake_fork[-1], exited(1))
+        delays.append(sup._respawn_at[0] - clock.now)
+        clock.now = sup._respawn_at[0]
+        sup._respawn_due()
+    assert delays == [1.0, 2.0, 4.0, 4.0, 4.0]
+
+    # A worker that stayed up long enough restarts without delay
+    clock.now += 1.0
+    sup._on_exit(fake_fork[-1], exited(1))
+    assert sup._respawn_at[0] == clock.now
+
+
+def test_no_restart_once_stopping(fake_fork):
+    sup = Supervisor(1, target=None, clock=Clock())
+    sup._spawn(0)
+    sup._stop(signal.SIGTERM, None)
+    sup._on_exit(fake_fork[0], exited(0))
+    assert sup._respawn_due() is None and sup._children == {}
+    assert len(fake_fork) == 1
+
+
+def test_sigterm_lets_workers_finish_before_exiting(tmp_path, monkeypatch):
+    """
+    Real processes: worker 0 crashes on its first start, then both wait
+    for the stop signal and record that they got to finish.
+    """
+    monkeypatch.setattr(prefork, "PREFORK_MIN_UPTIME", 0.5)
+
+    def target(worker_id):
+        if worker_id == 0 and not (tmp_path / "crashed").exists():
+            (tmp_path / "crashed").touch()
+            os._exit(1)
+        (tmp_path / f"ready{worker_id}").touch()
+        while not prefork.stop_requested():
+            time.sleep(0.01)
+        (tmp_path / f"done{worker_id}").touch()
+
+    def stop_when_ready():
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            if all((tmp_path / f"ready{i}").exists() for i in (0, 1)):
+                break
+            time.sleep(0.02)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)}
+    poller = threading.Thread(target=stop_when_ready, daemon=True)
+    try:
+        sup = Supervisor(2, target)
+        poller.start()
+        assert sup.run() == 0
+    finally:
+        poller.join()
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+
+    assert all((tmp_path / f"ready{i}").exists() for i in (0, 1))
+    assert all((tmp_path / f"done{i}").exists() for i in (0, 1))
+    assert sup.restarts == 1
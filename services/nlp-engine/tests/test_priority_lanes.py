@@ -0,0 +1,36 @@
+from collections import Counter
+
+import priority_lanes
+from priority_lanes import HIGH, LOW, NORMAL, LaneScheduler, classify, lane_queues, parse_weights
+
+
+def test_parse_weights_defaults_missing_lanes_to_one():
+    assert parse_weights("high:8, low:0") == {HIGH: 8, NORMAL: 1, LOW: 1}
+
+
+def test_weighted_share_when_all_lanes_backed_up():
+    sched = LaneScheduler({HIGH: 8, NORMAL: 3, LOW: 1})
+    for lane in (HIGH, NORMAL, LOW):
+        for i in range(100):
+            sched.push(lane, i)
+    picks = [sched.pop()[0] for _ in range(24)]
+    assert Counter(picks) == {HIGH: 16, NORMAL: 6, LOW: 2}
+    # Smooth round-robin: low is served once in every window of 12
+    assert LOW in picks[:12] and LOW in picks[12:]
+
+
+def test_lanes_are_fifo_and_idle_lanes_skipped():
+    sched = LaneScheduler({HIGH: 8, NORMAL: 3, LOW: 1})
+    sched.push(LOW, "l1")
+    sched.push(LOW, "l2")
+    sched.push("unknown", "n1")
+    assert [sched.pop() for _ in range(3)] == [(NORMAL, "n1"), (LOW, "l1"), (LOW, "l2")]
+    assert sched.pop() is None and len(sched) == 0
+
+
+def test_classify_and_lane_queues():
+    assert classify({"platform": "twitter"}) == LOW
+    assert classify({"platform": "twitter", "extra": {"alert_level": "yellow"}}) == NORMAL
+    assert classify({"platform": "app", "extra": {"alert_level": "RED"}}) == HIGH
+    base = priority_lanes.REPORTS_QUEUE
+    assert lane_queues(base) == [(HIGH, f"{base}.high"), (NORMAL, base), (LOW, f"{base}.low")]
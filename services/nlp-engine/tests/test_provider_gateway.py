@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+
+import async_engine
+from provider_gateway import (
+    ProviderGateway, ProviderRetryable, ProviderUnavailable, RetryLater, TokenBucket, deferred_retries,
+)
+
+
+def gateway(name, **kwargs):
+    gw = ProviderGateway(name, **kwargs)
+    gw.hedge_enabled = True
+    return gw
+
+
+def test_rate_limited_hedge_spends_no_budget():
+    gw = gateway("test_hedge_rate", rate=1.0, burst=1)
+    gw.hedge_budget = TokenBucket(1.0 / 60, 1)
+    assert gw.bucket.reserve(0.0) == 0.0  # the primary took the only token
+    assert not gw.admit_hedge()
+    assert gw.hedge_budget.tokens == pytest.approx(1.0, abs=0.01)
+
+
+def test_hedge_without_budget_gives_the_rate_token_back():
+    gw = gateway("test_hedge_budget", rate=1.0, burst=2)
+    gw.hedge_budget = TokenBucket(1.0 / 60, 1)
+    gw.hedge_cost = 2.0
+    assert not gw.admit_hedge()
+    assert gw.bucket.tokens == pytest.approx(2.0, abs=0.01)
+
+
+def test_every_successful_call_feeds_the_latency_window():
+    gw = gateway("test_hedge_latency")
+
+    def bad_request():
+        raise ValueError("HTTP 400")
+
+    gw.call(lambda: "ok")
+    gw.call(lambda: "ok", hedge=True)
+    with pytest.raises(ValueError):
+        gw.call(bad_request, retry_on=())
+    assert len(gw.latency) == 2
+
+
+def half_open_gateway(name):
+    gw = ProviderGateway(name, rate=0.001, burst=1, max_retries=0, failure_threshold=1, reset_seconds=0.0)
+    gw.max_queue_wait = 0.0
+    with pytest.raises(ProviderRetryable):
+        gw.call(flaky())
+    assert gw.breaker.is_open
+    return gw
+
+
+def flaky():
+    def fn():
+        raise ProviderRetryable("HTTP 503")
+
+    return fn
+
+
+def test_rate_limited_call_gives_back_the_half_open_probe():
+    gw = half_open_gateway("test_probe_rate")
+    # The failed call spent the only token
+    with pytest.raises(ProviderUnavailable, match="rate_limited"):
+        gw.call(lambda: "ok")
+    assert gw.breaker._probes == 0
+    gw.bucket.refund()
+    assert gw.call(lambda: "ok") == "ok"
+    assert gw.breaker.state == "closed"
+
+
+def test_cancelled_async_call_gives_back_the_half_open_probe():
+    gw = half_open_gateway("test_probe_cancel")
+    gw.bucket = TokenBucket(0, 1)
+
+    async def main():
+        task = asyncio.ensure_future(
+            async_engine._gateway_call(gw, lambda: asyncio.sleep(10), (ProviderRetryable,))
+        )
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert gw.breaker._probes == 0
+
+        async def ok():
+            return "ok"
+
+        return await async_engine._gateway_call(gw, ok, (ProviderRetryable,))
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_rate_limit_wait_is_deferred_with_the_token_kept():
+    gw = ProviderGateway("test_defer_token", rate=10.0, burst=1)
+    gw.max_queue_wait = 5.0
+    assert gw.call(lambda: "first") == "first"
+    attempts = {}
+    with deferred_retries(attempts):
+        with pytest.raises(RetryLater) as e:
+            gw.call(lambda: "second")
+    assert 0.0 < e.value.delay <= 0.1
+    tokens_after_reserve = gw.bucket.tokens
+    with deferred_retries(attempts):
+        assert gw.call(lambda: "second") == "second"
+    # The re-run used the token reserved the first time, not a new one
+    assert gw.bucket.tokens >= tokens_after_reserve
+    assert attempts == {}
+
+
+def test_after_failure_policy():
+    gw = ProviderGateway("test_after_failure", max_retries=1, backoff_base=0.01, failure_threshold=10)
+    assert gw.after_failure(ProviderRetryable("503"), 1, (ProviderRetryable,)) is not None
+    # Out of attempts
+    assert gw.after_failure(ProviderRetryable("503"), 2, (ProviderRetryable,)) is None
+    # Past the deadline
+    assert gw.after_failure(ProviderRetryable("503"), 1, (ProviderRetryable,), deadline=0.0) is None
+    # The provider answered: no retry, no breaker failure
+    failures = gw.breaker._failures
+    assert gw.after_failure(ValueError("HTTP 400"), 1, (ProviderRetryable,)) is None
+    assert gw.breaker._failures == failures
+
+
+def test_async_call_retries_like_the_threaded_one():
+    gw = ProviderGateway("test_async_retry", max_retries=2, backoff_base=0.001, failure_threshold=10)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ProviderRetryable("HTTP 503")
+        return "ok"
+
+    assert asyncio.run(async_engine._gateway_call(gw, fn, (ProviderRetryable,))) == "ok"
+    assert len(calls) == 3 and len(gw.latency) == 1
+
+    async def bad_request():
+        calls.append(1)
+        raise ValueError("HTTP 400")
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        asyncio.run(async_engine._gateway_call(gw, bad_request, (ProviderRetryable,)))
+    assert len(calls) == 1
+
+
+def test_async_hedge_wins_and_the_primary_is_cancelled():
+    gw = gateway("test_async_hedge")
+    gw.hedge_min_samples = 1
+    gw.hedge_min_delay = 0.01
+    gw.record_latency(0.01)
+    starts = []
+    cancelled = []
+
+    async def fn():
+        starts.append(len(starts))
+        if len(starts) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return "hedge"
+
+    assert asyncio.run(async_engine._gateway_call(gw, fn, (ProviderRetryable,), hedge=True)) == "hedge"
+    assert starts == [0, 1] and cancelled == [True]
@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+import main_script as ms
+from relevance_classifier import HAZARD_LABELS, RelevanceClassifier
+
+
+class FakeZeroShot:
+    """
+    Stands in for a transformers zero-shot pipeline; scores come from a
+    {text: score} table and every forward pass is recorded.
+    """
+
+    def __init__(self, scores, gate=None):
+        self.scores = scores
+        self.gate = gate
+        self.calls = []
+
+    def __call__(self, inputs, candidate_labels, batch_size):
+        self.calls.append(list(inputs))
+        if self.gate is not None:
+            self.gate.wait()
+        out = []
+        for text in inputs:
+            s = self.scores[text]
+            if isinstance(s, Exception):
+                raise s
+            # Labels come back sorted by score, not in the given order
+            pairs = sorted(zip(candidate_labels, (s, 1 - s)), key=lambda p: -p[1])
+            out.append({"labels": [p[0] for p in pairs], "scores": [p[1] for p in pairs]})
+        return out[0] if len(out) == 1 else out
+
+
+def classifier(scores, **kwargs):
+    clf = RelevanceClassifier(negative_threshold=0.1, positive_threshold=0.9, **kwargs)
+    clf._pipe = FakeZeroShot(scores)
+    return clf
+
+
+def test_thresholds():
+    clf = classifier({})
+    assert clf.local_decision(0.1)["alert"] is False
+    assert clf.local_decision(0.9)["alert"] is True
+    assert clf.local_decision(0.5) is None
+    assert clf.local_decision(0.02)["reasons"] == ["local_classifier:negative score=0.020"]
+
+
+def test_zero_shot_score_is_the_hazard_label():
+    clf = classifier({"surge": 0.97, "cat": 0.03})
+    assert clf.score_batch(["surge", "cat"]) == pytest.approx([0.97, 0.03])
+    assert clf.score_batch(["surge"]) == pytest.approx([0.97])
+    assert HAZARD_LABELS[0].startswith("coastal")
+
+
+def test_text_classification_uses_the_positive_label():
+    clf = RelevanceClassifier(task="text-classification")
+    clf._pipe = lambda inputs, top_k, batch_size: [
+        [{"label": "LABEL_0", "score": 0.3}, {"label": "LABEL_1", "score": 0.7}] for _ in inputs
+    ]
+    assert clf.score_batch(["a", "b"]) == pytest.approx([0.7, 0.7])
+
+
+def test_concurrent_calls_share_a_forward_pass():
+    clf = classifier({"a": 0.2, "b": 0.4, "c": 0.6}, batch_wait_ms=200)
+    results = {}
+    threads = [
+        threading.Thread(target=lambda t=t: results.__setitem__(t, clf.score(t, timeout=5)))
+        for t in ("a", "b", "c")
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == pytest.approx({"a": 0.2, "b": 0.4, "c": 0.6})
+    assert sorted(len(c) for c in clf._pipe.calls) == [3]
+
+
+def test_a_wedged_model_times_out_and_queued_texts_are_dropped():
+    gate = threading.Event()
+    clf = classifier({"slow": 0.5, "queued": 0.5, "next": 0.5}, batch_wait_ms=0)
+    clf._pipe.gate = gate
+    slow = threading.Thread(target=clf.score, args=("slow", 5))
+    slow.start()
+    deadline = time.monotonic() + 5
+    while not clf._pipe.calls and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    # The worker is stuck on "slow": this caller gives up and its text
+    # never reaches the model
+    with pytest.raises(TimeoutError):
+        clf.score("queued", timeout=0.05)
+    gate.set()
+    slow.join()
+    assert clf.score("next", timeout=5) == pytest.approx(0.5)
+    assert clf._pipe.calls == [["slow"], ["next"]]
+
+
+def test_model_errors_reach_the_caller():
+    clf = classifier({"bad": RuntimeError("model exploded")}, batch_wait_ms=0)
+    with pytest.raises(RuntimeError):
+        clf.score("bad", timeout=5)
+
+
+# ------------------------------
+# Cascade in run_full_pipeline
+# ------------------------------
+@pytest.fixture
+def pipeline(monkeypatch):
+    """
+    run_full_pipeline with every provider stubbed; returns
+    (set_score(score_or_exception), calls) where calls records which
+    providers were consulted.
+    """
+    calls = []
+    clf = classifier({}, batch_wait_ms=0)
+    monkeypatch.setattr(ms, "relevance_classifier", clf)
+    monkeypatch.setattr(ms, "event_clusterer", None)
+    monkeypatch.setattr(ms, "media_fetcher", None)
+    monkeypatch.setattr(ms, "phash_index", None)
+    monkeypatch.setattr(ms, "deadline_for", lambda msg: None)
+
+    def reverse_search(*args, **kwargs):
+        calls.append("serpapi")
+        return {"performed": True, "matches": 0}
+
+    def gpt(text, rs, vision, deadline=None):
+        calls.append("gpt")
+        return {"alert": True, "confidence": 0.6, "reasons": ["gpt"]}
+
+    monkeypatch.setattr(ms, "reverse_search_stage", reverse_search)
+    monkeypatch.setattr(ms, "gpt_decision_wrapper", gpt)
+
+    def set_score(score):
+        monkeypatch.setattr(clf, "score_batch", lambda texts: [_raise_or(score) for _ in texts])
+
+    return set_score, calls
+
+
+def _raise_or(value):
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+
+MSG = {"id": "r1", "text": "Huge waves flooding the promenade at Marina beach"}
+
+
+def test_local_negative_consults_no_provider(pipeline):
+    set_score, calls = pipeline
+    set_score(0.02)
+    report = ms.run_full_pipeline(dict(MSG))
+    assert report["decision_tier"] == "local" and report["decision"]["alert"] is False
+    assert report["reverse_search"]["skipped"] == ms.LOCAL_NEGATIVE
+    assert calls == []
+
+
+def test_local_positive_still_collects_evidence_but_skips_gpt(pipeline):
+    set_score, calls = pipeline
+    set_score(0.97)
+    report = ms.run_full_pipeline(dict(MSG))
+    assert report["decision_tier"] == "local" and report["decision"]["alert"] is True
+    assert calls == ["serpapi"]
+
+
+@pytest.mark.parametrize("score", [0.5, RuntimeError("model exploded"), TimeoutError("no score")])
+def test_uncertain_or_failed_classifier_falls_back_to_gpt(pipeline, score):
+    set_score, calls = pipeline
+    set_score(score)
+    report = ms.run_full_pipeline(dict(MSG))
+    assert report["decision_tier"] == "gpt" and report["decision"]["reasons"] == ["gpt"]
+    assert calls == ["serpapi", "gpt"]
@@ -0,0 +1,77 @@
+import gc
+import os
+import sqlite3
+import time
+import weakref
+
+import serp_cache
+from serp_cache import SerpCache, normalize_image_url, url_key
+
+
+def test_normalize_drops_tracking_params_and_default_port():
+    assert normalize_image_url("HTTPS://Img.Example.com:443/a.jpg?utm_source=x&b=2&a=1#frag") == (
+        "https://img.example.com/a.jpg?a=1&b=2"
+    )
+
+
+def test_normalize_keeps_malformed_url():
+    assert normalize_image_url(" http://example.com:99999x/a.jpg ") == "http://example.com:99999x/a.jpg"
+    assert url_key("http://[::1/a.jpg").startswith("url:")
+
+
+def test_sqlite_file_created_on_first_use(tmp_path):
+    path = tmp_path / "serp.sqlite3"
+    cache = SerpCache(path=str(path))
+    assert not path.exists()
+    assert cache.get("https://example.com/a.jpg") is None
+    assert path.exists()
+
+
+def test_hits_are_counted_after_flush(tmp_path):
+    cache = SerpCache(path=str(tmp_path / "serp.sqlite3"))
+    cache.put("https://example.com/a.jpg", {"performed": True, "matches": 3, "raw": "dropped"})
+    assert cache.get("https://example.com/a.jpg?utm_campaign=x") == {"performed": True, "matches": 3}
+    assert cache.get("https://example.com/b.jpg") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["node"] == {"hits": 1, "misses": 1}
+
+
+def test_expired_entry_is_a_miss_without_a_write(tmp_path):
+    path = str(tmp_path / "serp.sqlite3")
+    cache = SerpCache(path=path, ttl=60)
+    cache.put("https://example.com/a.jpg", {"performed": True, "matches": 1})
+    cache.flush()
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE serp_cache SET created_at = created_at - 120")
+
+    # Another process holds the write lock: the read must not wait on it
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        t0 = time.monotonic()
+        assert cache.get("https://example.com/a.jpg") is None
+        assert time.monotonic() - t0 < 1.0
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+    assert cache.stats()["entries"] == 1
+
+
+def test_fork_drops_every_cache_connection(tmp_path):
+    caches = [SerpCache(path=str(tmp_path / f"serp{i}.sqlite3")) for i in range(3)]
+    for cache in caches:
+        cache.open()
+    assert all(c in serp_cache._instances for c in caches)
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if all(getattr(c._local, "conn", None) is None for c in caches) else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert all(getattr(c._local, "conn", None) is not None for c in caches)
+
+    # The fork hook does not keep a cache alive
+    ref = weakref.ref(caches.pop(0))
+    gc.collect()
+    assert ref() is None
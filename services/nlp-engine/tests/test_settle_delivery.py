@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+
+import main_script as ms
+import retry_queues
+import wire_codec
+
+BASE = ms.INPUT_QUEUE
+
+
+class FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag):
+        self.calls.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+class FakePublisher:
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.sent = []
+
+    def forward(self, exchange, routing_key, body, content_type, headers=None, timestamp=None):
+        self.sent.append(SimpleNamespace(
+            exchange=exchange, routing_key=routing_key, body=body, headers=headers or {},
+        ))
+        return self.ok
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    pub = FakePublisher()
+    monkeypatch.setattr(ms, "_publisher", lambda: pub)
+    return pub
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    monkeypatch.setattr(ms, "RETRY_QUEUES_ENABLED", True)
+    monkeypatch.setattr(retry_queues, "RETRY_QUEUES_ENABLED", True)
+    monkeypatch.setattr(retry_queues, "RETRY_DELAYS_SECONDS", [15, 60])
+
+
+def delivery(msgs=None, headers=None, redelivered=False, body=b"{}"):
+    method = SimpleNamespace(delivery_tag=7, redelivered=redelivered)
+    properties = SimpleNamespace(content_type=wire_codec.JSON, headers=headers, timestamp=None)
+    d = ms.Delivery(method, properties, body, ms.priority_lanes.NORMAL)
+    d.msgs = msgs or []
+    return d
+
+
+def test_malformed_body_is_dead_lettered(publisher):
+    ch = FakeChannel()
+    ms.settle_delivery(ch, delivery(body=b"{nope"), [], ms.MALFORMED)
+    (sent,) = publisher.sent
+    assert (sent.exchange, sent.routing_key, sent.body) == ("", f"{BASE}.dead", b"{nope")
+    assert sent.headers[retry_queues.DEAD_REASON_HEADER] == "malformed"
+    assert ch.calls == [("ack", 7)]
+
+
+def test_pipeline_error_without_tiers_requeues_once_then_dead_letters(publisher, monkeypatch):
+    monkeypatch.setattr(ms, "RETRY_QUEUES_ENABLED", False)
+    monkeypatch.setattr(retry_queues, "RETRY_QUEUES_ENABLED", False)
+    ch = FakeChannel()
+    ms.settle_delivery(ch, delivery(), [], RuntimeError("boom"))
+    assert ch.calls == [("nack", 7, True)] and publisher.sent == []
+
+    ms.settle_delivery(ch, delivery(redelivered=True), [], RuntimeError("boom"))
+    (sent,) = publisher.sent
+    assert sent.routing_key == f"{BASE}.dead" and sent.headers[retry_queues.DEAD_REASON_HEADER] == "failed"
+    assert ch.calls[-1] == ("ack", 7)
+
+
+def test_pipeline_error_goes_to_next_tier_then_dead(publisher, tiers):
+    ch = FakeChannel()
+    ms.settle_delivery(ch, delivery(), [], RuntimeError("boom"))
+    ms.settle_delivery(ch, delivery(headers={retry_queues.ATTEMPT_HEADER: 1}), [], RuntimeError("boom"))
+    ms.settle_delivery(ch, delivery(headers={retry_queues.ATTEMPT_HEADER: 2}), [], RuntimeError("boom"))
+    first, second, last = publisher.sent
+    assert (first.exchange, first.routing_key) == (f"{BASE}.retry.15s", BASE)
+    assert first.headers[retry_queues.STAGES_HEADER] == {"pipeline": 1}
+    assert (second.exchange, second.routing_key) == (f"{BASE}.retry.60s", BASE)
+    assert (last.exchange, last.routing_key) == ("", f"{BASE}.dead")
+    assert last.headers[retry_queues.DEAD_REASON_HEADER] == "retries_exhausted"
+    assert ch.calls == [("ack", 7)] * 3
+
+
+def test_failed_reports_are_republished_alone(publisher, tiers):
+    msgs = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    ch = FakeChannel()
+    ms.settle_delivery(ch, delivery(msgs), [(2, ["reverse_search"], "reverse_search=timeout")], None)
+    (sent,) = publisher.sent
+    assert sent.exchange == f"{BASE}.retry.15s"
+    assert wire_codec.decode(sent.body, wire_codec.JSON) == {"id": "c"}
+    assert sent.headers[retry_queues.STAGES_HEADER] == {"reverse_search": 1}
+    assert ch.calls == [("ack", 7)]
+
+
+def test_input_requeued_when_republish_fails(tiers, monkeypatch):
+    monkeypatch.setattr(ms, "_publisher", lambda: FakePublisher(ok=False))
+    ch = FakeChannel()
+    ms.settle_delivery(ch, delivery([{"id": "a"}]), [(0, ["vision_web"], "timeout")], None)
+    assert ch.calls == [("nack", 7, True)]
@@ -0,0 +1,19 @@
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parents[1]
+SOCIAL_INGESTION_APP = HERE.parent / "social-ingestion" / "app"
+
+
+@pytest.mark.parametrize("name", ["wire_codec.py", "priority_lanes.py"])
+def test_copies_in_sync(name):
+    """
+    Both services ship their own copy of these modules; they must match.
+    """
+    theirs = SOCIAL_INGESTION_APP / name
+    if not theirs.exists():
+        pytest.skip("social-ingestion not checked out")
+    assert theirs.read_text(encoding="utf-8") == (HERE / name).read_text(encoding="utf-8"), (
+        f"{name} differs between nlp-engine and social-ingestion/app"
+    )
@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+
+import main_script as ms
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_outputs_are_written_off_the_publish_path(monkeypatch, tmp_path):
+    final_path, alert_path = tmp_path / "final.json", tmp_path / "alert.json"
+    monkeypatch.setattr(ms, "FINAL_FILENAME", str(final_path))
+    monkeypatch.setattr(ms, "ALERT_FILENAME", str(alert_path))
+    sink = ms.SnapshotSink()
+
+    sink.submit([{"id": "r1"}], [{"alert": "r1"}])
+    assert wait_for(alert_path.exists)
+    assert json.loads(final_path.read_text()) == [{"id": "r1"}]
+
+    # A batch without alerts removes the stale alert file
+    sink.submit([{"id": "r2"}], [])
+    assert wait_for(lambda: not alert_path.exists())
+    assert json.loads(final_path.read_text()) == [{"id": "r2"}]
+
+
+def test_submit_never_waits_and_only_the_latest_snapshot_is_kept(monkeypatch):
+    gate = threading.Event()
+    written = []
+
+    def slow_write(final_outputs, alert_outputs):
+        gate.wait()
+        written.append(final_outputs)
+
+    monkeypatch.setattr(ms, "write_outputs", slow_write)
+    sink = ms.SnapshotSink()
+    sink.submit(["first"], [])
+    assert wait_for(lambda: sink._pending is None)  # the writer holds "first"
+
+    t0 = time.perf_counter()
+    for i in range(100):
+        sink.submit([i], [])
+    assert time.perf_counter() - t0 < 0.5
+
+    gate.set()
+    assert wait_for(lambda: len(written) == 2)
+    time.sleep(0.05)
+    assert written == [["first"], [99]]
+
+
+def test_a_failed_write_does_not_stop_the_writer(monkeypatch):
+    written = []
+
+    def flaky_write(final_outputs, alert_outputs):
+        if final_outputs == ["bad"]:
+            raise OSError("disk full")
+        written.append(final_outputs)
+
+    monkeypatch.setattr(ms, "write_outputs", flaky_write)
+    sink = ms.SnapshotSink()
+    sink.submit(["bad"], [])
+    assert wait_for(lambda: sink._pending is None)
+    sink.submit(["good"], [])
+    assert wait_for(lambda: written == [["good"]])
+
+
+def test_publish_outputs_hands_the_batch_to_the_sink(monkeypatch):
+    sent, snapshots = [], []
+
+    class Publisher:
+        def publish_batch(self, messages):
+            sent.extend(messages)
+            return True
+
+    class Sink:
+        def submit(self, final_outputs, alert_outputs):
+            snapshots.append((final_outputs, alert_outputs))
+
+    monkeypatch.setattr(ms, "_publisher", lambda: Publisher())
+    monkeypatch.setattr(ms, "snapshot_sink", Sink())
+    assert ms.publish_outputs([{"id": "r1"}], []) is True
+    assert sent == [(ms.FINAL_QUEUE, [{"id": "r1"}])]
+    assert snapshots == [([{"id": "r1"}], [])]
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from provider_gateway import ProviderGateway, ProviderRetryable
+from stage_dag import StageDAG
+
+
+def flaky(failures: int):
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise ProviderRetryable("HTTP 503")
+        return "ok"
+
+    return fn, calls
+
+
+def test_retry_backoff_does_not_hold_a_pool_thread():
+    gw = ProviderGateway("test_defer", max_retries=2, backoff_base=0.4, backoff_max=0.4)
+    gw.retry_delay = lambda attempt: 0.3
+    fn, calls = flaky(1)
+
+    dag = StageDAG(ThreadPoolExecutor(max_workers=1))
+    dag.add("provider", lambda: gw.call(fn))
+    dag.add("other", lambda: "done")
+    timestamps = {}
+    t0 = time.monotonic()
+    results = dag.run(timestamps)
+    timings = timestamps["stages"]
+
+    assert results == {"provider": "ok", "other": "done"}
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.29
+    # With a single worker, "other" ran while the retry was waiting
+    assert timings["other"]["completed_at"] < timings["provider"]["completed_at"]
+    assert timings["provider"]["retries"] == 1
+    assert time.monotonic() - t0 < 1.0
+
+
+def test_max_retries_holds_across_reruns():
+    gw = ProviderGateway("test_defer_max", max_retries=2)
+    gw.retry_delay = lambda attempt: 0.01
+    fn, calls = flaky(10)
+
+    dag = StageDAG(ThreadPoolExecutor(max_workers=2))
+    dag.add("provider", lambda: gw.call(fn))
+    with pytest.raises(ProviderRetryable):
+        dag.run({})
+    assert len(calls) == 3
+
+
+def test_client_error_is_not_a_breaker_success():
+    gw = ProviderGateway("test_neutral", max_retries=0)
+    for _ in range(gw.breaker.failure_threshold - 1):
+        with pytest.raises(ProviderRetryable):
+            gw.call(flaky(1)[0])
+
+    def bad_request():
+        raise ValueError("HTTP 400")
+
+    with pytest.raises(ValueError):
+        gw.call(bad_request, retry_on=(ProviderRetryable,))
+    with pytest.raises(ProviderRetryable):
+        gw.call(flaky(1)[0])
+    assert gw.breaker.is_open
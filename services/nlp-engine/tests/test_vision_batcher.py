@@ -0,0 +1,151 @@
+from concurrent.futures import Future
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from vision_client import VisionBatcher
+
+
+class FakeVision:
+    """
+    Just enough of google.cloud.vision to build requests.
+    """
+
+    class Feature:
+        Type = SimpleNamespace(WEB_DETECTION="WEB_DETECTION")
+
+        def __init__(self, type_):
+            self.type_ = type_
+
+    @staticmethod
+    def AnnotateImageRequest(image, features):
+        return SimpleNamespace(image=image, features=features)
+
+    @staticmethod
+    def Image(source):
+        return SimpleNamespace(source=source)
+
+    @staticmethod
+    def ImageSource(image_uri):
+        return SimpleNamespace(image_uri=image_uri)
+
+
+def response(label=None, error=None):
+    labels = [SimpleNamespace(label=label)] if label else []
+    return SimpleNamespace(
+        error=SimpleNamespace(message=error or ""),
+        web_detection=SimpleNamespace(best_guess_labels=labels),
+    )
+
+
+class FakeClient:
+    """
+    Answers each URI from a table: a label, ("error", message) or None
+    (no web detection); records every request.
+    """
+
+    def __init__(self, answers, fail=None, short=False):
+        self.answers = answers
+        self.fail = fail
+        self.short = short
+        self.requests = []
+
+    def batch_annotate_images(self, requests, timeout):
+        uris = [r.image.source.image_uri for r in requests]
+        self.requests.append(uris)
+        if self.fail is not None:
+            raise self.fail
+        out = []
+        for uri in uris:
+            answer = self.answers.get(uri)
+            if isinstance(answer, tuple):
+                out.append(response(error=answer[1]))
+            else:
+                out.append(response(label=answer))
+        return SimpleNamespace(responses=out[:-1] if self.short else out)
+
+
+def batcher(client, **kwargs):
+    b = VisionBatcher(max_inflight=2, **kwargs)
+    b.use_client(FakeVision, client)
+    return b
+
+
+def run_batch(b, uris, cancel=()):
+    """
+    Drive _run_batch the way _drain does (slot taken first).
+    """
+    futures = [Future() for _ in uris]
+    for i in cancel:
+        futures[i].cancel()
+    b._slots.acquire()
+    b._run_batch(list(zip(uris, futures)))
+    return futures
+
+
+def test_results_map_back_to_their_callers():
+    client = FakeClient({"a": "tsunami", "b": ("error", "bad image"), "c": None})
+    b = batcher(client)
+    futures = run_batch(b, ["a", "b", "c"])
+    assert [f.result() for f in futures] == [
+        {"vision_available": True, "best_guess": "tsunami"},
+        {"vision_available": False, "best_guess": None, "error": "bad image"},
+        {"vision_available": False, "best_guess": None},
+    ]
+    assert client.requests == [["a", "b", "c"]]
+    assert b._slots._value == 2
+
+
+def test_cancelled_callers_are_left_out_of_the_request():
+    client = FakeClient({"a": "surge", "c": "flood"})
+    b = batcher(client)
+    futures = run_batch(b, ["a", "b", "c"], cancel=[1])
+    assert client.requests == [["a", "c"]]
+    assert futures[0].result()["best_guess"] == "surge" and futures[2].result()["best_guess"] == "flood"
+    assert futures[1].cancelled()
+
+
+def test_a_fully_cancelled_batch_sends_nothing_and_frees_its_slot():
+    client = FakeClient({})
+    b = batcher(client)
+    run_batch(b, ["a", "b"], cancel=[0, 1])
+    assert client.requests == [] and b._slots._value == 2
+
+
+def test_rpc_failure_reaches_every_caller_and_frees_the_slot():
+    b = batcher(FakeClient({}, fail=RuntimeError("UNAVAILABLE")))
+    futures = run_batch(b, ["a", "b"])
+    for f in futures:
+        with pytest.raises(RuntimeError):
+            f.result()
+    assert b._slots._value == 2
+
+
+def test_a_short_response_is_padded():
+    b = batcher(FakeClient({"a": "wave", "b": "wave"}, short=True))
+    futures = run_batch(b, ["a", "b"])
+    assert futures[1].result() == {"vision_available": False, "best_guess": None}
+
+
+def test_concurrent_annotate_calls_share_one_request():
+    client = FakeClient({u: u.upper() for u in "abcd"})
+    b = batcher(client, batch_wait_ms=200, batch_max=4)
+    results = {}
+    threads = [
+        threading.Thread(target=lambda u=u: results.__setitem__(u, b.annotate(u, timeout=5)))
+        for u in "abcd"
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert {u: r["best_guess"] for u, r in results.items()} == {"a": "A", "b": "B", "c": "C", "d": "D"}
+    assert len(client.requests) == 1 and sorted(client.requests[0]) == list("abcd")
+
+
+def test_annotate_many_chunks_by_batch_max():
+    client = FakeClient({u: u for u in "abcde"})
+    b = batcher(client, batch_max=2)
+    assert [r["best_guess"] for r in b.annotate_many(list("abcde"))] == list("abcde")
+    assert client.requests == [["a", "b"], ["c", "d"], ["e"]]
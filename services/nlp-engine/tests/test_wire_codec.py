@@ -0,0 +1,19 @@
+from datetime import datetime, timezone
+import json
+
+import pytest
+
+import wire_codec
+
+
+def test_json_matches_stdlib_for_non_str_keys():
+    obj = {"counts": {1: "a", 2.5: "b", None: "c", True: "d"}, "at": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+    body, ctype = wire_codec.encode(obj)
+    assert ctype == wire_codec.JSON
+    assert wire_codec.decode(body, ctype) == json.loads(json.dumps(obj, default=str))
+
+
+def test_unknown_content_type_is_json_and_malformed_raises():
+    assert wire_codec.decode(b'{"a": 1}', "text/plain; charset=utf-8") == {"a": 1}
+    with pytest.raises(ValueError):
+        wire_codec.decode(b"{nope", wire_codec.JSON)
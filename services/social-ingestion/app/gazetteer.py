@@ -0,0 +1,294 @@
+import csv
+import math
+import re
+from app.config import Config
+
+# Lower rank = less specific; the most specific match in a string wins
+KIND_RANK = {
+    "country": 0,
+    "state": 1,
+    "region": 2,
+    "district": 2,
+}
+DEFAULT_RANK = 3  # city, town, beach, port, island, lake
+
+
+def normalize(text):
+    """
+    Lowercase, turn separators (_ - . , @ # /) into spaces, drop other
+    punctuation and collapse whitespace: "@Kerala_Weather" -> "kerala weather".
+    """
+    text = (text or "").lower().replace("&", " and ")
+    text = re.sub(r"[_\-.,@#/|:;()]+", " ", text)
+    text = re.sub(r"[^\w\s]", "", text)
+    return " ".join(text.split())
+
+
+class Place:
+    __slots__ = ("id", "name", "state", "kind", "lat", "lon")
+
+    def __init__(self, id, name, state, kind, lat, lon):
+        self.id = id
+        self.name = name
+        self.state = state
+        self.kind = kind
+        self.lat = lat
+        self.lon = lon
+
+    @property
+    def rank(self):
+        return KIND_RANK.get(self.kind, DEFAULT_RANK)
+
+
+class NameTrie:
+    """
+    Character trie over normalized names. Nodes are dicts
+    {char: child}; a node's "$" entry holds the place id that ends there.
+    """
+
+    END = "$"
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def insert(self, key, place_id):
+        node = self.root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        if self.END not in node:
+            self.size += 1
+            node[self.END] = place_id
+
+    def get(self, key):
+        node = self.root
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                return None
+        return node.get(self.END)
+
+    def matches_at(self, text, start):
+        """
+        Yields (end, place_id) for every name that starts at text[start]
+        and ends on a word boundary.
+        """
+        node = self.root
+        i = start
+        n = len(text)
+        while i < n:
+            node = node.get(text[i])
+            if node is None:
+                return
+            i += 1
+            if self.END in node and (i == n or text[i] == " "):
+                yield i, node[self.END]
+
+    def complete(self, prefix, limit=10):
+        """
+        Place ids whose name starts with prefix (autocomplete).
+        """
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        out, stack = [], [node]
+        while stack and len(out) < limit:
+            cur = stack.pop()
+            for ch, child in cur.items():
+                if ch == self.END:
+                    out.append(child)
+                else:
+                    stack.append(child)
+        return out[:limit]
+
+
+class KDTree:
+    """
+    2-d tree over (x, y) = equirectangular projection of lat/lon in km,
+    good enough for nearest-place lookups at India's latitudes.
+    Nodes are tuples (point, place_id, axis, left, right).
+    """
+
+    EARTH_KM = 6371.0
+
+    def __init__(self, places):
+        pts = [(self.project(p.lat, p.lon), p.id) for p in places]
+        self.root = self._build(pts, 0)
+
+    @classmethod
+    def project(cls, lat, lon):
+        r = math.radians
+        return (cls.EARTH_KM * r(lon) * math.cos(r(lat)), cls.EARTH_KM * r(lat))
+
+    def _build(self, pts, depth):
+        if not pts:
+            return None
+        axis = depth % 2
+        pts.sort(key=lambda p: p[0][axis])
+        mid = len(pts) // 2
+        return (
+            pts[mid][0],
+            pts[mid][1],
+            axis,
+            self._build(pts[:mid], depth + 1),
+            self._build(pts[mid + 1:], depth + 1),
+        )
+
+    def nearest(self, lat, lon):
+        """
+        (place_id, distance_km) of the closest point, or None if empty.
+        """
+        target = self.project(lat, lon)
+        best = [None, float("inf")]
+
+        def visit(node):
+            if node is None:
+                return
+            point, pid, axis, left, right = node
+            d = math.hypot(point[0] - target[0], point[1] - target[1])
+            if d < best[1]:
+                best[0], best[1] = pid, d
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if abs(diff) < best[1]:
+                visit(far)
+
+        visit(self.root)
+        if best[0] is None:
+            return None
+        return best[0], best[1]
+
+
+class Gazetteer:
+    def __init__(self, path=None):
+        self.path = path or Config.GAZETTEER_PATH
+        self.places = []
+        self.trie = NameTrie()
+        self._load()
+        self.kdtree = KDTree(self.places)
+
+    def _load(self):
+        with open(self.path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                place = Place(
+                    len(self.places),
+                    row["name"].strip(),
+                    row.get("state", "").strip(),
+                    row.get("kind", "").strip(),
+                    float(row["lat"]),
+                    float(row["lon"]),
+                )
+                self.places.append(place)
+                names = [place.name] + [a for a in (row.get("aliases") or "").split("|") if a.strip()]
+                for name in names:
+                    key = normalize(name)
+                    if not key:
+                        continue
+                    self.trie.insert(key, place.id)
+                    # Handles and subreddits squash words: "tamilnadu"
+                    if " " in key:
+                        self.trie.insert(key.replace(" ", ""), place.id)
+
+    def lookup(self, name):
+        """
+        Exact (normalized) name or alias.
+        """
+        pid = self.trie.get(normalize(name))
+        return self.places[pid] if pid is not None else None
+
+    def match(self, text):
+        """
+        Best place mentioned anywhere in a free-text location string
+        ("Marina Beach, Chennai, India", "@kerala_weather"): most specific
+        kind first, then longest name.
+        """
+        norm = normalize(text)
+        best = None
+        best_key = None
+        start = 0
+        while start < len(norm):
+            for end, pid in self.trie.matches_at(norm, start):
+                place = self.places[pid]
+                key = (place.rank, end - start)
+                if best_key is None or key > best_key:
+                    best, best_key = place, key
+            nxt = norm.find(" ", start)
+            if nxt == -1:
+                break
+            start = nxt + 1
+        return best
+
+    def reverse(self, lat, lon, max_km=None):
+        """
+        Nearest place to a point: (Place, distance_km), or None.
+        """
+        hit = self.kdtree.nearest(lat, lon)
+        if hit is None:
+            return None
+        pid, dist = hit
+        if max_km is not None and dist > max_km:
+            return None
+        return self.places[pid], round(dist, 2)
+
+    def geocode_posts(self, posts):
+        """
+        Fill location lat/lon in place for a batch of posts, from the
+        location name (or, failing that, the post text). Posts that already
+        have coordinates but no name get the nearest place name instead.
+        Returns the number of posts changed.
+        """
+        memo = {}
+        changed = 0
+        for post in posts:
+            loc = post.get("location") or {}
+
+            if loc.get("lat") is not None and loc.get("lon") is not None:
+                if not loc.get("name"):
+                    hit = self.reverse(loc["lat"], loc["lon"], Config.GAZETTEER_REVERSE_MAX_KM)
+                    if hit is not None:
+                        place, dist = hit
+                        loc.update(name=place.name, state=place.state or None)
+                        loc["geocoder"] = {"method": "reverse", "distance_km": dist}
+                        post["location"] = loc
+                        changed += 1
+                continue
+
+            place, method = None, None
+            name = loc.get("name")
+            if name:
+                if name not in memo:
+                    memo[name] = self.match(name)
+                place, method = memo[name], "name"
+            if (place is None or place.rank == KIND_RANK["country"]) and post.get("text"):
+                from_text = self.match(post["text"])
+                if from_text is not None:
+                    place, method = from_text, "text"
+            # A country centroid is not a usable point for hotspot clustering
+            if place is None or place.rank == KIND_RANK["country"]:
+                continue
+
+            if not loc.get("name"):
+                loc["name"] = place.name
+            loc.update(lat=place.lat, lon=place.lon)
+            loc["geocoder"] = {
+                "method": method,
+                "place": place.name,
+                "state": place.state or None,
+                "kind": place.kind,
+            }
+            post["location"] = loc
+            changed += 1
+        return changed
+
+
+_default = None
+
+
+def get_gazetteer():
+    global _default
+    if _default is None:
+        _default = Gazetteer()
+    return _default
@@ -0,0 +1,130 @@
+"""
+priority_lanes.py
+
+Priority lanes for the report intake, shared by the Python services
+(nlp-engine, social-ingestion). Both services carry an identical copy
+of this file (each is built on its own); nlp-engine's
+tests/test_shared_modules.py fails when the copies diverge.
+
+ - REPORTS_QUEUE names the intake queue for publishers and the consumer
+   alike, so the two ends cannot drift apart
+
+ - Publishers pick a lane per message from its source (platform) and
+   extra.alert_level, and publish to that lane's queue
+ - The "normal" lane is the base queue itself, so publishers that know
+   nothing about lanes (user-report-service) keep working unchanged
+ - Consumers drain the lanes with LaneScheduler (smooth weighted
+   round-robin), so a backlog in one lane never starves another
+
+Messages also carry the lane in the x-lane header and as the AMQP
+priority property, should a queue be declared with x-max-priority.
+"""
+
+from collections import deque
+import os
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+LANES = (HIGH, NORMAL, LOW)
+
+# Base intake queue; the lanes are <queue>.high / <queue> / <queue>.low
+REPORTS_QUEUE = os.getenv("REPORTS_QUEUE", "reports")
+
+AMQP_PRIORITY = {HIGH: 9, NORMAL: 5, LOW: 1}
+LANE_HEADER = "x-lane"
+
+
+def _csv_env(name: str, default: str) -> Tuple[str, ...]:
+    return tuple(v.strip().lower() for v in os.getenv(name, default).split(",") if v.strip())
+
+
+# Alert levels that jump the queue; the same levels format_alert_output
+# maps to "high"
+HIGH_ALERT_LEVELS = _csv_env("PRIORITY_HIGH_ALERT_LEVELS", "red,high")
+# Any alert level at all lifts a low-lane source back to normal
+LOW_SOURCES = _csv_env("PRIORITY_LOW_SOURCES", "reddit,twitter,x,telegram,bluesky")
+
+
+def parse_weights(spec: str) -> Dict[str, int]:
+    """
+    "high:8,normal:3,low:1" -> {"high": 8, "normal": 3, "low": 1}.
+    Lanes left out keep weight 1.
+    """
+    weights = {lane: 1 for lane in LANES}
+    for part in spec.split(","):
+        lane, _, w = part.partition(":")
+        lane = lane.strip().lower()
+        if lane in weights and w.strip():
+            weights[lane] = max(1, int(w))
+    return weights
+
+
+LANE_WEIGHTS = parse_weights(os.getenv("PRIORITY_LANE_WEIGHTS", "high:8,normal:3,low:1"))
+
+
+# ------------------------------
+# Publish side
+# ------------------------------
+def classify(msg: Dict[str, Any]) -> str:
+    extra = msg.get("extra") or {}
+    level = str(extra.get("alert_level") or "").strip().lower()
+    if level in HIGH_ALERT_LEVELS:
+        return HIGH
+
+    source = str(msg.get("platform") or "").strip().lower()
+    if source in LOW_SOURCES and not level:
+        return LOW
+    return NORMAL
+
+
+def lane_queue(base: str, lane: str) -> str:
+    return base if lane == NORMAL else f"{base}.{lane}"
+
+
+def lane_queues(base: str) -> List[Tuple[str, str]]:
+    """
+    [(lane, queue), ...] in priority order.
+    """
+    return [(lane, lane_queue(base, lane)) for lane in LANES]
+
+
+# ------------------------------
+# Consume side
+# ------------------------------
+class LaneScheduler:
+    """
+    Local buffer of deliveries, one FIFO per lane. pop() serves the
+    non-empty lanes in smooth weighted round-robin order: with weights
+    8/3/1 and all lanes backed up, 8 of every 12 picks are high, and a
+    low item still goes out at least once per 12.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, int]] = None):
+        self.weights = dict(weights or LANE_WEIGHTS)
+        self._queues: Dict[str, Deque[Any]] = {lane: deque() for lane in self.weights}
+        self._current = {lane: 0 for lane in self.weights}
+
+    def push(self, lane: str, item: Any) -> None:
+        self._queues[lane if lane in self._queues else NORMAL].append(item)
+
+    def pop(self) -> Optional[Tuple[str, Any]]:
+        active = [lane for lane, q in self._queues.items() if q]
+        if not active:
+            return None
+        total = sum(self.weights[lane] for lane in active)
+        for lane in active:
+            self._current[lane] += self.weights[lane]
+        best = max(active, key=lambda lane: self._current[lane])
+        self._current[best] -= total
+        return best, self._queues[best].popleft()
+
+    def depth(self, lane: str) -> int:
+        return len(self._queues.get(lane, ()))
+
+    def depths(self) -> Dict[str, int]:
+        return {lane: len(q) for lane, q in self._queues.items()}
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self._queues.values())
@@ -1,30 +1,43 @@
-import json
 import pika
 from app.config import Config
+from app import priority_lanes, wire_codec
 from urllib.parse import urlparse
 import time
 
 class RabbitPublisher:
-    def __init__(self, rabbit_url=None, queue_name=None):
+    def __init__(self, rabbit_url=None, queue_name=None, codec=None):
         self.rabbit_url = rabbit_url or Config.RABBITMQ_URL
         self.queue_name = queue_name or Config.RABBITMQ_QUEUE
+        self.codec = codec or Config.WIRE_CODEC
+        self.lanes_enabled = Config.PRIORITY_LANES_ENABLED
         params = pika.URLParameters(self.rabbit_url)
         self._connect(params)
 
     def _connect(self, params):
         self.conn = pika.BlockingConnection(params)
         self.ch = self.conn.channel()
-        self.ch.queue_declare(queue=self.queue_name, durable=True)
+        queues = [self.queue_name]
+        if self.lanes_enabled:
+            queues = [q for _, q in priority_lanes.lane_queues(self.queue_name)]
+        for queue in queues:
+            self.ch.queue_declare(queue=queue, durable=True)
 
     def publish_post(self, post: dict):
         payload = dict(post)
         payload["post_type"] = "social-media-post"
-        body = json.dumps(payload, default=str).encode("utf-8")
+        body, content_type = wire_codec.encode(payload, self.codec)
+        lane = priority_lanes.classify(payload) if self.lanes_enabled else priority_lanes.NORMAL
         self.ch.basic_publish(
             exchange="",
-            routing_key=self.queue_name,
+            routing_key=priority_lanes.lane_queue(self.queue_name, lane),
             body=body,
-            properties=pika.BasicProperties(delivery_mode=2)  # persistent message
+            properties=pika.BasicProperties(
+                delivery_mode=2,  # persistent message
+                content_type=content_type,
+                priority=priority_lanes.AMQP_PRIORITY[lane],
+                timestamp=int(time.time()),  # per-lane latency on the consumer
+                headers={priority_lanes.LANE_HEADER: lane},
+            )
         )
 
     def close(self):
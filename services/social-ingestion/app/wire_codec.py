@@ -0,0 +1,111 @@
+"""
+wire_codec.py
+
+Message body codecs shared by the Python services (nlp-engine,
+social-ingestion). Both services carry an identical copy of this file
+(each is built on its own); nlp-engine's tests/test_shared_modules.py fails
+when the copies diverge.
+
+ - "json": application/json, encoded with orjson when installed,
+   stdlib json otherwise; either way plain JSON for the Node consumers
+ - "msgpack": application/msgpack, for Python-to-Python queues
+ - decode() picks the codec from the AMQP content_type property;
+   a missing or unknown content_type is treated as JSON
+
+Values JSON cannot represent natively (datetime, Decimal, ...) are
+stringified with str(), as json.dumps(default=str) did.
+"""
+
+import json
+from typing import Any, Optional, Tuple
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+_CONTENT_TYPES = {
+    "json": JSON,
+    "msgpack": MSGPACK,
+}
+_MSGPACK_ALIASES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+
+
+def available(codec: str) -> bool:
+    if codec == "json":
+        return True
+    if codec == "msgpack":
+        return msgpack is not None
+    return False
+
+
+def content_type_for(codec: str) -> str:
+    return _CONTENT_TYPES[codec if available(codec) else "json"]
+
+
+# ------------------------------
+# Encode
+# ------------------------------
+def _encode_json(obj: Any) -> bytes:
+    if orjson is not None:
+        # Datetimes go through default=str and non-str dict keys are
+        # stringified, like the stdlib path
+        return orjson.dumps(
+            obj, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(obj, default=str).encode("utf-8")
+
+
+def encode(obj: Any, codec: str = "json") -> Tuple[bytes, str]:
+    """
+    Returns (body, content_type). Falls back to JSON when the requested
+    codec's library is not installed.
+    """
+    if codec == "msgpack" and msgpack is not None:
+        return msgpack.packb(obj, default=str, use_bin_type=True), MSGPACK
+    return _encode_json(obj), JSON
+
+
+# ------------------------------
+# Decode
+# ------------------------------
+def _base_type(content_type: Optional[str]) -> str:
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def codec_for(content_type: Optional[str]) -> str:
+    """
+    Codec name for a content_type, e.g. to re-encode part of a delivery
+    the way it arrived.
+    """
+    return "msgpack" if _base_type(content_type) in _MSGPACK_ALIASES else "json"
+
+
+def decode(body: bytes, content_type: Optional[str] = None) -> Any:
+    """
+    Decode one message body according to its content_type.
+    Raises ValueError on a malformed body or an unsupported codec.
+    """
+    ctype = _base_type(content_type)
+    if ctype in _MSGPACK_ALIASES:
+        if msgpack is None:
+            raise ValueError(f"No decoder installed for {ctype}")
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(f"Malformed msgpack body: {e}") from e
+
+    try:
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body.decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"Malformed JSON body: {e}") from e
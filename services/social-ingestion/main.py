@@ -6,6 +6,7 @@ from app.config import Config
 # from app.adapters.twitter_adapter import TwitterAdapter
 from app.publisher import RabbitPublisher
 from app.dedupe import DedupeStore
+from app.gazetteer import get_gazetteer
 import time
 import os
 
@@ -23,6 +24,13 @@ def fetch_and_publish(adapters, publisher, dedupe_store):
                 traceback.print_exc()
                 continue
 
+            # Fill lat/lon from location names (offline, whole batch)
+            if Config.GAZETTEER_ENABLED:
+                try:
+                    get_gazetteer().geocode_posts(posts)
+                except Exception as e:
+                    print("Gazetteer geocoding failed:", e)
+
             for p in posts:
                 platform = p.get("platform", adapter.platform)
                 post_id = p.get("id")
@@ -89,7 +97,7 @@ def main():
     else:
         print("Telegram adapter disabled (missing TELEGRAM_BOT_TOKEN or TELEGRAM_CHANNELS).")
 
-    publisher = RabbitPublisher(os.getenv("RABBITMQ_URL"), os.getenv("RABBITMQ_QUEUE"))
+    publisher = RabbitPublisher(os.getenv("RABBITMQ_URL"))
     dedupe_store = DedupeStore()
 
     # single run at startup
@@ -0,0 +1,9 @@
+"""
+The service imports its modules as app.*, so put the service directory
+on sys.path when pytest is started from here or from the repo root.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
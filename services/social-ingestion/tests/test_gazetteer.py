@@ -0,0 +1,100 @@
+import pytest
+
+from app.config import Config
+from app.gazetteer import Gazetteer, normalize
+
+PLACES = """name,aliases,state,kind,lat,lon
+India,Bharat,,country,20.5937,78.9629
+Tamil Nadu,,Tamil Nadu,state,11.1271,78.6569
+Kerala,Keralam,Kerala,state,10.8505,76.2711
+Chennai,Madras,Tamil Nadu,city,13.0827,80.2707
+Marina Beach,,Tamil Nadu,beach,13.0500,80.2824
+Kochi,Cochin,Kerala,city,9.9312,76.2673
+Goa,,Goa,state,15.2993,74.1240
+"""
+
+
+@pytest.fixture
+def gaz(tmp_path):
+    path = tmp_path / "places.csv"
+    path.write_text(PLACES, encoding="utf-8")
+    return Gazetteer(str(path))
+
+
+def test_normalize():
+    assert normalize("@Kerala_Weather") == "kerala weather"
+    assert normalize("  Marina   Beach, Chennai (India)!") == "marina beach chennai india"
+    assert normalize("Daman & Diu") == "daman and diu"
+    assert normalize(None) == ""
+
+
+def test_lookup_by_name_and_alias(gaz):
+    assert gaz.lookup("madras").name == "Chennai"
+    assert gaz.lookup("COCHIN").name == "Kochi"
+    assert gaz.lookup("Atlantis") is None
+
+
+def test_match_prefers_the_most_specific_place(gaz):
+    assert gaz.match("Marina Beach, Chennai, India").name == "Marina Beach"
+    assert gaz.match("Chennai, Tamil Nadu").name == "Chennai"
+    assert gaz.match("somewhere in India").name == "India"
+
+
+def test_match_needs_word_boundaries(gaz):
+    # "goa" inside "goat" / "kochin" is not a mention
+    assert gaz.match("goat farm") is None
+    assert gaz.match("kochinese food") is None
+    assert gaz.match("trip to goa").name == "Goa"
+
+
+def test_match_handles_handles_and_squashed_names(gaz):
+    assert gaz.match("@tamilnadu_rains").name == "Tamil Nadu"
+    assert gaz.match("r/Keralam").name == "Kerala"
+    assert gaz.match("#Madras").name == "Chennai"
+
+
+def test_reverse_respects_max_km(gaz):
+    place, dist = gaz.reverse(13.06, 80.28)
+    assert place.name == "Marina Beach" and dist < 2
+    assert gaz.reverse(13.06, 80.28, max_km=0.5) is None
+    assert gaz.reverse(13.06, 80.28, max_km=5)[0].name == "Marina Beach"
+    # Middle of the Bay of Bengal: nearest place is far away
+    assert gaz.reverse(15.0, 88.0, max_km=50) is None
+    assert gaz.reverse(15.0, 88.0)[1] > 500
+
+
+def test_geocode_posts(gaz, monkeypatch):
+    monkeypatch.setattr(Config, "GAZETTEER_REVERSE_MAX_KM", 50.0)
+    posts = [
+        {"location": {"name": "Marina Beach, Chennai"}},
+        # A country is not a point: fall back to the text, else leave it
+        {"location": {"name": "India"}, "text": "High waves at Kochi harbour"},
+        {"location": {"name": "India"}, "text": "Rough sea today"},
+        # Coordinates without a name get the nearest place's name
+        {"location": {"lat": 9.93, "lon": 76.27}},
+        {"location": {"lat": 15.0, "lon": 88.0}},
+        {"text": "Storm surge warning for Goa"},
+    ]
+    assert gaz.geocode_posts(posts) == 4
+
+    loc = posts[0]["location"]
+    assert (loc["lat"], loc["lon"]) == (13.05, 80.2824)
+    assert loc["name"] == "Marina Beach, Chennai" and loc["geocoder"]["method"] == "name"
+
+    loc = posts[1]["location"]
+    assert loc["geocoder"] == {"method": "text", "place": "Kochi", "state": "Kerala", "kind": "city"}
+    assert loc["name"] == "India" and (loc["lat"], loc["lon"]) == (9.9312, 76.2673)
+
+    assert "lat" not in posts[2]["location"]
+
+    loc = posts[3]["location"]
+    assert loc["name"] == "Kochi" and loc["geocoder"]["method"] == "reverse"
+    assert posts[4]["location"] == {"lat": 15.0, "lon": 88.0}
+
+    assert posts[5]["location"]["name"] == "Goa"
+
+
+def test_shipped_gazetteer_loads():
+    gaz = Gazetteer()
+    assert gaz.lookup("Calicut").name == "Kozhikode"
+    assert gaz.match("Flooding near Alleppey backwaters").name == "Alappuzha"